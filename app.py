@@ -1,11 +1,29 @@
+import math
 import os
+from collections import namedtuple
+from datetime import date, datetime, timedelta
 
-from flask import Flask, request, jsonify
-from models import Message, db, connect_db, User, Listing, ListingPhoto
+from flask import Flask, Response, json, request, jsonify
+from models import (
+    Message, db, connect_db, User, Listing, ListingPhoto, PhotoJob, Booking, BookingConflict)
 from sqlalchemy.exc import IntegrityError
+from passwords import HashingOverloaded
 from flask_cors import CORS
 # from werkzeug.security import secure_filename
-from helpers import upload_file_to_s3
+from photos import enqueue_photos, upload_photos
+from pagination import (
+    get_fields, get_page_args, get_timeline_args, keyset_page, keyset_stream, merge_ordered,
+    timeline_page)
+from search import ListingSearch
+from caching import LRUCache
+from realtime import create_broker
+from response_cache import response_cache
+from streaming import stream_collection, wants_stream
+from pooling import pool_stats
+from replicas import read_replica, replica_router
+from instrumentation import instrumentation
+from geo import geocode
+from sqlalchemy import event, inspect
 from my_secrets import S3_SMALL_BUCKET, S3_LARGE_BUCKET
 import jwt
 
@@ -21,47 +39,190 @@ app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 30 * 60))
+app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+app.config['DB_STATEMENT_TIMEOUT'] = int(os.environ.get('DB_STATEMENT_TIMEOUT', 15000))
+app.config['REPLICA_DATABASE_URLS'] = os.environ.get('REPLICA_DATABASE_URLS')
+app.config['REPLICA_LAG_WINDOW'] = int(os.environ.get('REPLICA_LAG_WINDOW', 5))
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', 500))
+app.config['SLOW_STATEMENTS'] = int(os.environ.get('SLOW_STATEMENTS', 3))
+app.config['PROFILER'] = os.environ.get('PROFILER', 'auto')
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['GEOCODER'] = os.environ.get('GEOCODER')
+app.config['DEFAULT_RADIUS_MILES'] = float(os.environ.get('DEFAULT_RADIUS_MILES', 5))
+app.config['MAX_RADIUS_MILES'] = float(os.environ.get('MAX_RADIUS_MILES', 100))
+app.config['MAX_BOOKING_NIGHTS'] = int(os.environ.get('MAX_BOOKING_NIGHTS', 90))
+app.config['MAX_CALENDAR_DAYS'] = int(os.environ.get('MAX_CALENDAR_DAYS', 366))
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "super secret secret key")
-
+app.config['PAGE_SIZE'] = int(os.environ.get('PAGE_SIZE', 100))
+app.config['MAX_PAGE_SIZE'] = int(os.environ.get('MAX_PAGE_SIZE', 500))
+app.config['AUTH_CACHE_SIZE'] = int(os.environ.get('AUTH_CACHE_SIZE', 10000))
+app.config['AUTH_CACHE_TTL'] = int(os.environ.get('AUTH_CACHE_TTL', 300))
+app.config['JWT_ACCESS_TTL'] = int(os.environ.get('JWT_ACCESS_TTL', 60 * 60))
+app.config['JWT_REFRESH_TTL'] = int(os.environ.get('JWT_REFRESH_TTL', 30 * 24 * 60 * 60))
+# Legacy tokens (username only, no expiry) are accepted until this ISO 8601
+# UTC date or datetime, if set; see README.
+app.config['JWT_ACCEPT_LEGACY_UNTIL'] = (
+    datetime.fromisoformat(os.environ['JWT_ACCEPT_LEGACY_UNTIL'])
+    if os.environ.get('JWT_ACCEPT_LEGACY_UNTIL') else None
+)
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['PASSWORD_POOL'] = os.environ.get('PASSWORD_POOL', 'thread')
+app.config['PASSWORD_POOL_SIZE'] = int(os.environ.get('PASSWORD_POOL_SIZE', os.cpu_count() or 1))
+app.config['PASSWORD_QUEUE_LIMIT'] = int(
+    os.environ.get('PASSWORD_QUEUE_LIMIT', 4 * app.config['PASSWORD_POOL_SIZE']))
+app.config['PHOTO_DERIVATIVES'] = {
+    'small': {
+        'size': os.environ.get('SMALL_PHOTO_SIZE', '480x360'),
+        'quality': int(os.environ.get('SMALL_PHOTO_QUALITY', 70)),
+    },
+    'large': {
+        'size': os.environ.get('LARGE_PHOTO_SIZE', '1600x1200'),
+        'quality': int(os.environ.get('LARGE_PHOTO_QUALITY', 85)),
+    },
+}
+app.config['PHOTO_INGEST'] = os.environ.get('PHOTO_INGEST', 'async')
+app.config['PHOTO_JOB_MAX_ATTEMPTS'] = int(os.environ.get('PHOTO_JOB_MAX_ATTEMPTS', 5))
+app.config['PHOTO_JOB_BACKOFF'] = int(os.environ.get('PHOTO_JOB_BACKOFF', 10))
+app.config['PHOTO_JOB_LEASE'] = int(os.environ.get('PHOTO_JOB_LEASE', 10 * 60))
+app.config['RESPONSE_CACHE_SIZE'] = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+app.config['RESPONSE_CACHE_TTL'] = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+app.config['RESPONSE_CACHE_REDIS_URL'] = os.environ.get('RESPONSE_CACHE_REDIS_URL')
+app.config['JSON_ENCODER'] = os.environ.get('JSON_ENCODER', 'auto')
+app.config['STREAM_BATCH_SIZE'] = int(os.environ.get('STREAM_BATCH_SIZE', 1000))
+app.config['REALTIME_BACKEND'] = os.environ.get('REALTIME_BACKEND', 'local')
+app.config['REALTIME_HEARTBEAT'] = int(os.environ.get('REALTIME_HEARTBEAT', 15))
+app.config['LONG_POLL_TIMEOUT'] = int(os.environ.get('LONG_POLL_TIMEOUT', 25))
+app.config['MAX_LONG_POLL_TIMEOUT'] = int(os.environ.get('MAX_LONG_POLL_TIMEOUT', 55))
+
+replica_router.init_app(app, db, identify=lambda: getattr(authenticateJWT(), 'id', None))
 connect_db(app)
+listing_search = ListingSearch(app)
+
+
+def load_message_events(message_ids):
+    """Returns {message id: message serialized as JSON} for realtime brokers."""
+
+    with app.app_context():
+        msgs = Message.query.filter(Message.id.in_(message_ids)).all()
+        return {
+            msg.id: json.dumps(serialized)
+            for msg, serialized in zip(msgs, Message.serialize_all(msgs))
+        }
+
+
+broker = create_broker(app, db.engine, load_message_events)
+response_cache.init_app(app)
+instrumentation.init_app(app, can_profile=lambda: getattr(authenticateJWT(), 'is_admin', False))
 
 
 ##############################################################################
 # Auth Routes / Functions
 
-def createJWT(user):
-    """ Given user instance, creates and returns JWT token with username and
-        admin in payload.
+# Just enough of a user to authorize a request. Built straight from token
+# claims, or for legacy tokens without them, cached by username so steady
+# state requests authenticate without touching the database.
+Principal = namedtuple('Principal', ['id', 'username', 'is_admin'])
+
+principal_cache = LRUCache(
+    maxsize=app.config['AUTH_CACHE_SIZE'],
+    ttl=app.config['AUTH_CACHE_TTL'],
+)
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def evict_principal(mapper, connection, user):
+    """Drops cached principal when a user is changed or deleted, including
+        under their previous username if it was renamed.
     """
 
-    payload = { 'username':user.username, 'is_admin':user.is_admin }
+    principal_cache.delete(user.username)
+    for username in inspect(user).attrs.username.history.deleted:
+        principal_cache.delete(username)
+
+def get_principal(username):
+    """Returns Principal for username from cache, loading it on a miss.
+        Returns None if no such user.
+    """
+
+    principal = principal_cache.get(username)
+    if principal is None:
+        user = User.query.filter_by(username=username).one_or_none()
+        if user is None:
+            return None
+        principal = Principal(user.id, user.username, user.is_admin)
+        principal_cache.set(username, principal)
+    return principal
+
+def createJWT(user, token_type='access'):
+    """ Given user instance or Principal, creates and returns JWT token with
+        user id (sub), username, admin, type and expiry in payload.
+
+        token_type is 'access' for tokens sent with requests (JWT_ACCESS_TTL)
+        or 'refresh' for tokens exchanged at /token/refresh (JWT_REFRESH_TTL).
+    """
+
+    ttl = app.config['JWT_ACCESS_TTL' if token_type == 'access' else 'JWT_REFRESH_TTL']
+    now = datetime.utcnow()
+
+    payload = {
+        'sub': str(user.id),
+        'username': user.username,
+        'is_admin': user.is_admin,
+        'type': token_type,
+        'iat': now,
+        'exp': now + timedelta(seconds=ttl),
+    }
     token = jwt.encode(payload, app.config.get('SECRET_KEY'), algorithm='HS256')
     return token
 
-def authenticateJWT():
-    """Verifies that JWT is valid. Returns user information if valid or empty
-        dictionary if invalid.
+def authenticateJWT(allow_query_token=False):
+    """Verifies that JWT is valid. Returns Principal if valid or None if
+        invalid.
+
+        If allow_query_token, also accepts the token as ?token=, for clients
+        like EventSource that cannot set headers.
+
+        Access tokens carry the principal in their claims, so no database
+        lookup is needed. Legacy tokens with only username in payload are
+        looked up through principal cache until JWT_ACCEPT_LEGACY_UNTIL, and
+        rejected after it or if it is unset.
 
         If valid, returns:
-            user: {id, username, first_name, last_name, email, phone}
+            Principal(id, username, is_admin)
     """
 
     auth_headers = request.headers.get('Authorization', '').split()
-    if len(auth_headers) != 2:
+    if len(auth_headers) == 2:
+        token = auth_headers[1]
+    elif allow_query_token and request.args.get('token'):
+        token = request.args['token']
+    else:
         return None
     try:
-        token = auth_headers[1]
         data = jwt.decode(token, app.config.get('SECRET_KEY'), algorithms='HS256')
-        user = User.query.filter(User.username.like((data['username']))).one_or_none()
-        if user:
-            return user
+        if 'sub' in data:
+            if data.get('type') != 'access':
+                return None
+            return Principal(int(data['sub']), data['username'], data['is_admin'])
+        legacy_until = app.config['JWT_ACCEPT_LEGACY_UNTIL']
+        if legacy_until is not None and datetime.utcnow() < legacy_until:
+            return get_principal(data['username'])
     except jwt.ExpiredSignatureError:
         return None
     except (jwt.InvalidTokenError, Exception) as e:
         return None
     return None
 
+def busy():
+    """503 response for when the password pool is saturated."""
+
+    return jsonify(error='Server busy, try again shortly'), 503, {'Retry-After': '1'}
+
 @app.route('/users', methods=["POST"])
 def sign_up(): 
     """Handles user sign up. If valid form data and no duplicate, returns
@@ -73,7 +234,8 @@ def sign_up():
         Returns: 
             {
                 user: {username, first_name, last_name, email, phone},
-                token: "token"
+                token: "token",
+                refresh_token: "token"
             }
     """
 
@@ -84,7 +246,7 @@ def sign_up():
     email = request.json["email"]
     phone = request.json["phone"]
 
-    duplicate_check = User.query.filter(User.username.like(username)).one_or_none()
+    duplicate_check = User.query.filter_by(username=username).one_or_none()
     if duplicate_check:
         return jsonify(error='Username taken'), 400
 
@@ -98,14 +260,21 @@ def sign_up():
                 phone=phone,
             )
         token = createJWT(user)
-        return jsonify(user=user.serialize(), token=token)
+        refresh_token = createJWT(user, 'refresh')
+        response_cache.invalidate('users')
+        replica_router.record_writes(user_ids=[user.id], namespaces=['users'])
+        return jsonify(user=user.serialize(), token=token, refresh_token=refresh_token)
+
+    except HashingOverloaded:
+        return busy()
 
     except IntegrityError as error:
         return (jsonify(error=error))
 
 @app.route('/login', methods=['POST'])
 def login():
-    """If valid credentials presented in JSON, returns token, otherwise 401 error.
+    """If valid credentials presented in JSON, returns access and refresh
+        tokens, otherwise 401 error.
 
         Accepts: {username, password}
     """
@@ -113,33 +282,203 @@ def login():
     username = request.json['username']
     password = request.json['password']
     
-    user = User.authenticate(username, password)
+    try:
+        user = User.authenticate(username, password)
+    except HashingOverloaded:
+        return busy()
+
     if user:
         token = createJWT(user)
-        return (jsonify(user=user.serialize(),token=token))
+        refresh_token = createJWT(user, 'refresh')
+        return (jsonify(user=user.serialize(), token=token, refresh_token=refresh_token))
     return jsonify(error='Invalid login'), 401
 
+@app.route('/token/refresh', methods=['POST'])
+def refresh():
+    """If valid refresh token presented in JSON, returns new access and
+        refresh tokens, otherwise 401 error. Reloads the user, so deleted
+        users and admin changes take effect here.
+
+        Accepts: {refresh_token}
+    """
+
+    try:
+        data = jwt.decode(
+            request.json['refresh_token'],
+            app.config.get('SECRET_KEY'),
+            algorithms='HS256',
+        )
+    except jwt.InvalidTokenError:
+        return jsonify(error='Invalid refresh token'), 401
+
+    if data.get('type') != 'refresh':
+        return jsonify(error='Invalid refresh token'), 401
+
+    user = User.query.get(int(data['sub']))
+    if user is None:
+        return jsonify(error='Invalid refresh token'), 401
+
+    return jsonify(token=createJWT(user), refresh_token=createJWT(user, 'refresh'))
+
 
 ##############################################################################
 # Listing Routes
 
 @app.route('/listings')
+@response_cache.cached('listings')
+@read_replica('listings')
 def get_listings():
-    """If search term included, gets filtered listings. Otherwise,
-        gets all listings.
-
-        Returns: listings: [{id, title, price, details, address, host_id, photos}, ...]
+    """If search term included, gets up to limit best matching listings by
+        title, address and details, best first. Otherwise, gets all listings
+        paginated by id.
+
+        Without term, ?stream=true or Accept: application/x-ndjson streams
+        every listing after cursor (or the first limit) instead of one page,
+        without next_cursor.
+
+        Location, price and availability filters narrow any of these; with
+        term, the best limit matches passing them are returned. Location
+        filters use the geohash index, so only listings with coordinates
+        match them.
+
+        With view=card, returns listing cards instead: summary fields with
+        the cover photo, photo count and host name from listing_cards, read
+        as one row per listing without loading photos.
+
+        Accepts:
+            term: "term" (optional)
+            bbox: "south,west,north,east" in degrees (optional)
+            near: "latitude,longitude" (optional)
+            radius: miles from near (optional, DEFAULT_RADIUS_MILES)
+            min_price, max_price: whole dollars, inclusive (optional)
+            available_from, available_to: "YYYY-MM-DD", listings with no
+                confirmed booking from the first night up to checkout on
+                available_to (optional, together)
+            limit: page size (optional)
+            cursor: next_cursor from previous page (optional, ignored with term)
+            fields: "title,price,..." (optional, id is always included)
+            stream: "true" (optional)
+            view: "card" (optional)
+
+        Returns:
+            listings: [{id, title, price, details, address, latitude,
+                        longitude, host_id, photos}, ...],
+                or with view=card [{id, title, price, address, latitude,
+                        longitude, host_id, host_name, cover_photo_url,
+                        photo_count}, ...],
+            next_cursor: cursor for next page or null on last page
     """
 
     search = request.args.get('term')
+    stream = wants_stream() and not search
+    cards = request.args.get('view') == 'card'
 
-    if not search: 
-        listings = Listing.query.all()
-    else: 
-        listings = Listing.query.filter(Listing.address.ilike(f"%{search}%")).all()
+    try:
+        limit, cursor = get_page_args(stream)
+        fields = get_fields(Listing.CARD_FIELDS if cards else Listing.SERIALIZED_FIELDS)
+        filters = get_listing_filters()
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+
+    if cards:
+        query = Listing.card_rows(fields).filter(*filters)
+        serialize = lambda rows: [dict(row._mapping) for row in rows]  # noqa: E731
+    else:
+        query = Listing.rows(fields).filter(*filters)
+        serialize = lambda rows: Listing.serialize_rows(rows, fields)  # noqa: E731
+
+    if stream:
+        return stream_collection(
+            'listings',
+            keyset_stream(query, Listing.id, cursor, limit, app.config['STREAM_BATCH_SIZE']),
+            serialize,
+        )
+
+    if search:
+        ids = listing_search.search(search, limit, filters)
+        found = query.filter(Listing.id.in_(ids)).all()
+        by_id = {row.id: row for row in found}
+        rows = [by_id[listing_id] for listing_id in ids if listing_id in by_id]
+        next_cursor = None
+    else:
+        rows, next_cursor = keyset_page(query, Listing.id, limit, cursor)
 
-    serialized = [listing.serialize() for listing in listings]
-    return (jsonify(listings=serialized))
+    serialized = serialize(rows)
+    return (jsonify(listings=serialized, next_cursor=next_cursor))
+
+def get_date_range(start_name, end_name, max_days):
+    """Reads a pair of YYYY-MM-DD dates from the query string or JSON body.
+        Returns (start, end). Raises ValueError unless start is before end
+        and at most max_days apart.
+    """
+
+    values = request.args if request.method == 'GET' else (request.get_json(silent=True) or {})
+
+    try:
+        start = date.fromisoformat(values[start_name])
+        end = date.fromisoformat(values[end_name])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"{start_name} and {end_name} must be YYYY-MM-DD dates")
+
+    if start >= end:
+        raise ValueError(f"{start_name} must be before {end_name}")
+    if (end - start).days > max_days:
+        raise ValueError(f"{start_name} to {end_name} must be at most {max_days} days")
+    return start, end
+
+
+def get_listing_filters():
+    """Reads GET /listings location, price and availability filters from the
+        query string.
+        Returns list of filters for Listing queries. Raises ValueError on
+        malformed ones.
+    """
+
+    def coordinates(name, count):
+        try:
+            values = [float(value) for value in request.args[name].split(',')]
+        except ValueError:
+            values = []
+        if len(values) != count or not all(map(math.isfinite, values)):
+            raise ValueError(f"{name} must be {count} comma separated numbers")
+        return values
+
+    def check_point(latitude, longitude, name):
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValueError(f"{name} is out of range")
+
+    filters = []
+
+    if 'bbox' in request.args:
+        south, west, north, east = coordinates('bbox', 4)
+        check_point(south, west, 'bbox')
+        check_point(north, east, 'bbox')
+        if south > north:
+            raise ValueError("bbox south must not be above north")
+        filters.append(Listing.within_bbox(south, west, north, east))
+
+    if 'near' in request.args:
+        latitude, longitude = coordinates('near', 2)
+        check_point(latitude, longitude, 'near')
+        radius = request.args.get('radius', app.config['DEFAULT_RADIUS_MILES'], type=float)
+        if radius is None or not 0 < radius <= app.config['MAX_RADIUS_MILES']:
+            raise ValueError(
+                f"radius must be a number of miles up to {app.config['MAX_RADIUS_MILES']:g}")
+        filters.append(Listing.within_radius(latitude, longitude, radius))
+
+    for name, compare in (('min_price', Listing.price.__ge__), ('max_price', Listing.price.__le__)):
+        if name in request.args:
+            price = request.args.get(name, type=int)
+            if price is None:
+                raise ValueError(f"{name} must be a whole number")
+            filters.append(compare(price))
+
+    if 'available_from' in request.args or 'available_to' in request.args:
+        start, end = get_date_range(
+            'available_from', 'available_to', app.config['MAX_BOOKING_NIGHTS'])
+        filters.append(Listing.available(start, end))
+
+    return filters
 
 
 @app.route('/listings', methods=["POST"])
@@ -147,91 +486,169 @@ def add_listing():
     """Creates new listing and adds to DB. Uploads photos to AWS S3 and adds to
         listing photos table. Returns serialized listing in JSON.
 
+        With PHOTO_INGEST "async", photos are queued for worker.py and the
+        listing is returned straight away with photo_status pending; poll
+        GET /listings/<id> for progress. With "inline", each photo is decoded
+        once into a small thumbnail and a capped-size large JPEG and uploaded
+        to their buckets concurrently before responding. Photos that failed
+        to process or upload are left out of the listing and reported in
+        failed_uploads.
+
+        latitude and longitude form fields place the listing; without them
+        the address is geocoded if GEOCODER is configured.
+
         Returns: 
-            listing: {id, title, price, details, address, host_id, photos}
+            listing: {id, title, price, details, address, latitude, longitude,
+                      host_id, photos}
             where photos is: 
                 [photo_url, photo_url, photo_url, ...]
+            photo_status: {status, pending, failed}
+            failed_uploads: [{filename, error}, ...]
     """
     
     user = authenticateJWT()
     if user:
+        files = [request.files.get(key) for key in request.files]
+        ingest_async = app.config['PHOTO_INGEST'] == 'async'
+
         small_img_urls = []
         large_img_urls = []
-        for key in request.files:
-            file = request.files.get(key)
-            small_img_output = upload_file_to_s3(file, S3_SMALL_BUCKET)
-            small_img_urls.append(small_img_output)
-            large_img_output = upload_file_to_s3(file, S3_LARGE_BUCKET)
-            large_img_urls.append(large_img_output)
+        failed_uploads = []
+        if not ingest_async:
+            for upload in upload_photos(files):
+                if upload.error:
+                    failed_uploads.append({'filename': upload.filename, 'error': upload.error})
+                else:
+                    small_img_urls.append(upload.urls[S3_SMALL_BUCKET])
+                    large_img_urls.append(upload.urls[S3_LARGE_BUCKET])
 
         title = request.form.getlist("title")[0]
         price = request.form.getlist("price")[0]
         address = request.form.getlist("address")[0]
         details = request.form.getlist("details")[0]
 
+        latitude = request.form.get("latitude", type=float)
+        longitude = request.form.get("longitude", type=float)
+        if latitude is None or longitude is None:
+            latitude, longitude = geocode(address) or (None, None)
+        elif not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return jsonify(error='Invalid coordinates'), 400
+
         new_listing = Listing(
             title=title,
             price=price,
             address=address,
             details=details,
+            latitude=latitude,
+            longitude=longitude,
             host_id=user.id,
         )
 
         db.session.add(new_listing)
-        db.session.commit()
+        db.session.flush()
+
+        if ingest_async:
+            enqueue_photos(new_listing.id, files)
 
-        for i in range(len(small_img_urls)):
-            new_listing_photo = ListingPhoto(
+        db.session.add_all([
+            ListingPhoto(
                 listing_id=new_listing.id,
-                small_photo_url=small_img_urls[i],
-                large_photo_url=large_img_urls[i],
+                small_photo_url=small_img_url,
+                large_photo_url=large_img_url,
             )
-            db.session.add(new_listing_photo)
-            db.session.commit()
+            for small_img_url, large_img_url in zip(small_img_urls, large_img_urls)
+        ])
+
+        # Listing, photos and photo jobs land in one transaction, so a failure
+        # never leaves a half-created listing.
+        db.session.commit()
+        response_cache.invalidate('listings')
+        replica_router.record_writes(user_ids=[user.id], namespaces=['listings'])
         
         serialized = new_listing.serialize()
 
-        return (jsonify(listing=serialized), 201)
+        return (jsonify(
+            listing=serialized,
+            photo_status=PhotoJob.summarize(new_listing.id),
+            failed_uploads=failed_uploads,
+        ), 201)
 
     return jsonify(error='Must be logged in'), 401
 
 
 @app.route('/listings/<int:id>')
+@response_cache.cached('listings')
+@read_replica('listings')
 def get_listing(id): 
-    """Gets listing by id. Returns serialized listing details in JSON.
+    """Gets listing by id. Returns serialized listing details in JSON, with
+        progress of any queued photo uploads.
 
         Returns: 
-            listing: {id, title, price, details, address, host_id, photos}
+            listing: {id, title, price, details, address, latitude, longitude,
+                      host_id, photos}
+            photo_status: {status, pending, failed}
+            where status is "pending", "failed" or "ready"
     """
 
     listing = Listing.query.get_or_404(id)
 
     serialized = listing.serialize()
+    photo_status = PhotoJob.summarize(id)
+
+    # worker.py's invalidations only reach this process through a shared
+    # cache, so don't cache progress clients are polling.
+    if photo_status['status'] == 'pending':
+        response_cache.skip()
 
-    return (jsonify(listing=serialized))
+    return (jsonify(listing=serialized, photo_status=photo_status))
 
 
 ##############################################################################
 # User Routes
 
 @app.route('/users')
+@response_cache.cached('users')
+@read_replica('users')
 def get_users():
     """If search term included, gets filtered users. Otherwise,
-        gets all users. Returns list of serialized users in JSON.
+        gets all users, paginated by id. Returns list of serialized users in
+        JSON. Without q, streams like GET /listings if asked to.
 
         Accepts: 
             q: "term" (optional)
+            limit: page size (optional)
+            cursor: next_cursor from previous page (optional)
+            fields: "username,first_name,..." (optional, id is always included)
+            stream: "true" (optional)
         
         Returns: 
-            users: [{username, first_name, last_name, email, phone}, ...]
+            users: [{username, first_name, last_name, email, phone}, ...],
+            next_cursor: cursor for next page or null on last page
     """
 
     search = request.args.get('q')
 
     if not search: 
-        users = User.query.all()
-        serialized = [user.serialize() for user in users]
-        return (jsonify(users=serialized))
+        stream = wants_stream()
+
+        try:
+            limit, cursor = get_page_args(stream)
+            fields = get_fields(User.SERIALIZED_FIELDS)
+        except ValueError as error:
+            return jsonify(error=str(error)), 400
+
+        query = User.rows(fields)
+
+        if stream:
+            return stream_collection(
+                'users',
+                keyset_stream(query, User.id, cursor, limit, app.config['STREAM_BATCH_SIZE']),
+                lambda rows: [User.serialize_row(row) for row in rows],
+            )
+
+        rows, next_cursor = keyset_page(query, User.id, limit, cursor)
+        serialized = [User.serialize_row(row) for row in rows]
+        return (jsonify(users=serialized, next_cursor=next_cursor))
     else: 
         user = User.query.filter(User.username.like(f"{search}")).one_or_none()
         serialized = user.serialize()
@@ -240,6 +657,8 @@ def get_users():
     
 
 @app.route('/users/<int:id>')
+@response_cache.cached('users')
+@read_replica('users')
 def get_user(id): 
     """Gets user by id. If found, returns serialized user information in JSON.
         Otherwise, 404.
@@ -279,53 +698,434 @@ def send_message(id):
 
         db.session.add(msg)
         db.session.commit()
+        replica_router.record_writes(user_ids=[curr_user.id, id])
+
+        [serialized] = Message.serialize_all([msg])
+
+        # The message is saved; clients that miss the event backfill it
+        # with GET /messages?after=, so don't fail the request.
+        data = json.dumps(serialized)
+        try:
+            broker.publish(id, msg.id, data)
+            if id != curr_user.id:
+                broker.publish(curr_user.id, msg.id, data)
+        except Exception:
+            app.logger.exception("Could not publish message %s", msg.id)
 
-        return jsonify(msg=msg.serialize())
+        return jsonify(msg=serialized)
     
     else:
         return jsonify(error='Unauthorized'), 401
 
 @app.route('/messages')
+@read_replica()
 def get_messages():
-    """Get all of current user's messages. If valid token, returns serialized
-        list of all messages.
+    """Get page of current user's messages. If valid token, returns serialized
+        list of messages, oldest first, with cursors for older and newer
+        pages.
+
+        Without before, after or since, returns the newest messages.
+
+        ?stream=true or Accept: application/x-ndjson streams every message
+        (after the after cursor or since, and up to limit, if included)
+        oldest first, without cursors.
+
+        Accepts:
+            limit: page size (optional)
+            before: before_cursor from previous page, for older (optional)
+            after: after_cursor from previous page, for newer messages in
+                the order they were saved (optional)
+            since: ISO 8601 timestamp, for messages newer than it, in the
+                order they were saved (optional)
 
         Returns: 
-            msgs: [{id, text, timestamp, to_user_id, to_user, from_user_id, from_user}, ...]
+            msgs: [{id, text, timestamp, to_user_id, to_user, from_user_id, from_user, read_at}, ...]
             Where to_user and from_user is: 
                 {username, first_name, last_name, email, phone}
+            before_cursor: cursor for older page, or null
+            after_cursor: cursor to poll for newer messages (the highest
+                message id returned), or null
     """
 
     curr_user = authenticateJWT()
     if curr_user:
-        msgs = Message.query.filter((Message.from_user_id == curr_user.id) | (Message.to_user_id == curr_user.id)).all()
-        serialized = [msg.serialize() for msg in msgs]
-        return jsonify(msgs=serialized)
+        return get_message_page(Message.involving(curr_user.id))
     
     else:
         return jsonify(error='Unauthorized'), 401
 
 @app.route('/messages/<int:id>')
+@read_replica()
 def get_conversion_with_user(id):
-    """Get current user's messages to or from user of id in url params. If
-        valid token, returns serialized list of messages.
+    """Get page of current user's messages to or from user of id in url
+        params. If valid token, returns serialized list of messages, oldest
+        first, with cursors for older and newer pages.
 
-        Returns: 
-            msgs: [{id, text, timestamp, to_user_id, to_user, from_user_id, from_user}, ...]
-            Where to_user and from_user is: 
-                {username, first_name, last_name, email, phone}
+        Accepts and returns the same as GET /messages.
     """
 
     curr_user = authenticateJWT()
     if curr_user:
-        msgs = Message.query.filter(
-            (
-                ((Message.from_user_id == curr_user.id) | (Message.to_user_id == curr_user.id))
-                &
-                ((Message.from_user_id == id) | (Message.to_user_id == id)))
-            ).order_by("timestamp").all()
-        serialized = [msg.serialize() for msg in msgs]
-        return jsonify(msgs=serialized)
+        return get_message_page(Message.between(curr_user.id, id))
     
     else:
-        return jsonify(error='Unauthorized'), 401
\ No newline at end of file
+        return jsonify(error='Unauthorized'), 401
+
+@app.route('/messages/stream')
+def stream_messages():
+    """Server-Sent Events stream of messages sent to or by current user, as
+        they are sent. Accepts token as Authorization header or ?token=.
+
+        Each event is "message" with id this process's event sequence number
+        (not the message id) and data the message as serialized by POST
+        /messages/<id>. Resumes after Last-Event-ID if the client reconnects
+        to the same process with it and the events are still buffered;
+        otherwise backfill with GET /messages?after=. Sends a comment every
+        REALTIME_HEARTBEAT seconds to keep the connection open.
+    """
+
+    curr_user = authenticateJWT(allow_query_token=True)
+    if not curr_user:
+        return jsonify(error='Unauthorized'), 401
+
+    user_id = curr_user.id
+    # Ids past the newest event are from another process or before a
+    # restart; start from now like a new stream.
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None or last_id > broker.last_event_id(user_id):
+        last_id = broker.last_event_id(user_id)
+    heartbeat = app.config['REALTIME_HEARTBEAT']
+
+    def events(last_id):
+        yield "retry: 3000\n\n"
+        while True:
+            batch = broker.wait(user_id, last_id, heartbeat)
+            if not batch:
+                yield ": keepalive\n\n"
+            for event_id, data in batch:
+                last_id = event_id
+                yield f"id: {event_id}\nevent: message\ndata: {data}\n\n"
+
+    return Response(
+        events(last_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/messages/poll')
+def poll_messages():
+    """Long-poll for messages sent to or by current user after last_id. If
+        valid token, responds as soon as there are any, or with none after
+        timeout seconds.
+
+        Accepts:
+            last_id: last_id from previous poll (optional, defaults to now,
+                as do ids this process never issued)
+            timeout: seconds to wait (optional, LONG_POLL_TIMEOUT, capped at
+                MAX_LONG_POLL_TIMEOUT)
+
+        Returns:
+            msgs: [{id, text, timestamp, to_user_id, to_user, from_user_id, from_user, read_at}, ...]
+            last_id: pass to next poll
+    """
+
+    curr_user = authenticateJWT()
+    if curr_user:
+        last_id = request.args.get('last_id', type=int)
+        if last_id is None or last_id > broker.last_event_id(curr_user.id):
+            last_id = broker.last_event_id(curr_user.id)
+
+        timeout = request.args.get('timeout', app.config['LONG_POLL_TIMEOUT'], type=float)
+        timeout = max(0, min(timeout, app.config['MAX_LONG_POLL_TIMEOUT']))
+
+        # Nothing below needs the database, so don't hold a connection while waiting.
+        db.session.remove()
+
+        events = broker.wait(curr_user.id, last_id, timeout)
+        return jsonify(
+            msgs=[json.loads(data) for event_id, data in events],
+            last_id=events[-1][0] if events else last_id,
+        )
+
+    else:
+        return jsonify(error='Unauthorized'), 401
+
+def get_message_page(queries):
+    """Returns JSON response with page of messages from queries (branches
+        for merge_ordered) selected by limit, before, after and since in the
+        query string.
+    """
+
+    stream = wants_stream()
+
+    try:
+        limit, before, after, since = get_timeline_args(stream)
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+
+    if stream:
+        # Newer messages arrive in id order, as for timeline_page.
+        columns = (Message.timestamp, Message.id)
+        if after is not None:
+            queries = [query.filter(Message.id > after) for query in queries]
+            columns = (Message.id,)
+        elif since is not None:
+            queries = [query.filter(Message.timestamp > since) for query in queries]
+            columns = (Message.id,)
+
+        query = merge_ordered(queries, columns, limit)
+
+        return stream_collection(
+            'msgs',
+            query.yield_per(app.config['STREAM_BATCH_SIZE']),
+            Message.serialize_rows,
+        )
+
+    page = timeline_page(
+        queries, Message.timestamp, Message.id, limit,
+        before=before, after=after, since=since,
+    )
+
+    return jsonify(
+        msgs=Message.serialize_rows(page['rows']),
+        before_cursor=page['before_cursor'],
+        after_cursor=page['after_cursor'],
+    )
+
+@app.route('/messages/<int:id>/read', methods=['POST'])
+def mark_conversation_read(id):
+    """Marks all messages from user of id in url params to current user as
+        read. If valid token, returns number of messages marked.
+
+        Returns:
+            marked: number
+    """
+
+    curr_user = authenticateJWT()
+    if curr_user:
+        marked = Message.query.filter(
+            (Message.from_user_id == id)
+            & (Message.to_user_id == curr_user.id)
+            & Message.read_at.is_(None)
+        ).update({Message.read_at: datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        replica_router.record_writes(user_ids=[curr_user.id])
+        return jsonify(marked=marked)
+
+    else:
+        return jsonify(error='Unauthorized'), 401
+
+@app.route('/messages/conversations')
+@read_replica()
+def get_conversations():
+    """Get summary of each of current user's conversations, most recent
+        first. If valid token, returns serialized list of conversations.
+
+        Returns:
+            conversations: [{user, last_message, unread_count}, ...]
+            Where user is the other participant:
+                {username, first_name, last_name, email, phone}
+            and last_message is as in GET /messages
+    """
+
+    curr_user = authenticateJWT()
+    if curr_user:
+        conversations = Message.conversations(curr_user.id)
+        users = Message.load_users(
+            {curr_user.id} | {counterpart_id for msg, counterpart_id, unread in conversations})
+
+        serialized = [
+            {
+                'user': users[counterpart_id],
+                'last_message': msg.serialize(users),
+                'unread_count': int(unread),
+            }
+            for msg, counterpart_id, unread in conversations
+        ]
+        return jsonify(conversations=serialized)
+
+    else:
+        return jsonify(error='Unauthorized'), 401
+
+
+##############################################################################
+# Booking Routes
+
+@app.route('/listings/<int:id>/bookings', methods=['POST'])
+def add_booking(id):
+    """Books listing of id in url params for current user. If valid token and
+        the dates are free, returns serialized booking in JSON, otherwise 409
+        if any night is already booked.
+
+        Accepts JSON:
+            start_date: "YYYY-MM-DD", first night
+            end_date: "YYYY-MM-DD", checkout day
+
+        Returns:
+            booking: {id, listing_id, guest_id, start_date, end_date, status}
+    """
+
+    curr_user = authenticateJWT()
+    if not curr_user:
+        return jsonify(error='Must be logged in'), 401
+
+    try:
+        start, end = get_date_range('start_date', 'end_date', app.config['MAX_BOOKING_NIGHTS'])
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+
+    if start < date.today():
+        return jsonify(error='start_date must not be in the past'), 400
+
+    listing = db.session.query(Listing.host_id).filter(Listing.id == id).one_or_none()
+    if listing is None:
+        return jsonify(error='Listing not found'), 404
+    if listing.host_id == curr_user.id:
+        return jsonify(error='Cannot book your own listing'), 400
+
+    try:
+        booking = Booking.reserve(id, curr_user.id, start, end)
+        db.session.commit()
+    except BookingConflict:
+        db.session.rollback()
+        return jsonify(error='Listing is already booked for some of those dates'), 409
+
+    response_cache.invalidate('listings', 'bookings')
+    replica_router.record_writes(user_ids=[curr_user.id], namespaces=['listings', 'bookings'])
+
+    return (jsonify(booking=booking.serialize()), 201)
+
+
+@app.route('/listings/<int:id>/calendar')
+@response_cache.cached('bookings')
+@read_replica('bookings')
+def get_listing_calendar(id):
+    """Gets booked nights of listing of id in url params between start and
+        end, as ranges in date order. Nights not covered are available.
+
+        Accepts:
+            start: "YYYY-MM-DD" (optional, today)
+            end: "YYYY-MM-DD", exclusive (optional, start plus MAX_BOOKING_NIGHTS)
+
+        Returns:
+            booked: [{start_date, end_date}, ...], end_date exclusive
+    """
+
+    start = request.args.get('start', date.today().isoformat())
+    try:
+        start = date.fromisoformat(start)
+        end = date.fromisoformat(request.args['end']) if 'end' in request.args \
+            else start + timedelta(days=app.config['MAX_BOOKING_NIGHTS'])
+    except ValueError:
+        return jsonify(error='start and end must be YYYY-MM-DD dates'), 400
+
+    if not start < end <= start + timedelta(days=app.config['MAX_CALENDAR_DAYS']):
+        return jsonify(
+            error=f"end must be after start and at most {app.config['MAX_CALENDAR_DAYS']} days"), 400
+
+    if db.session.query(Listing.id).filter(Listing.id == id).one_or_none() is None:
+        return jsonify(error='Listing not found'), 404
+
+    booked = [
+        {"start_date": booked_start.isoformat(), "end_date": booked_end.isoformat()}
+        for booked_start, booked_end in Booking.calendar(id, start, end)
+    ]
+
+    return jsonify(booked=booked)
+
+
+@app.route('/bookings')
+@read_replica()
+def get_bookings():
+    """Get current user's bookings as a guest, paginated by id. If valid
+        token, returns serialized bookings in JSON.
+
+        Accepts:
+            limit: page size (optional)
+            cursor: next_cursor from previous page (optional)
+
+        Returns:
+            bookings: [{id, listing_id, guest_id, start_date, end_date, status}, ...],
+            next_cursor: cursor for next page or null on last page
+    """
+
+    curr_user = authenticateJWT()
+    if not curr_user:
+        return jsonify(error='Unauthorized'), 401
+
+    try:
+        limit, cursor = get_page_args()
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+
+    query = Booking.query.filter(Booking.guest_id == curr_user.id)
+    bookings, next_cursor = keyset_page(query, Booking.id, limit, cursor)
+
+    return jsonify(
+        bookings=[booking.serialize() for booking in bookings],
+        next_cursor=next_cursor,
+    )
+
+
+@app.route('/bookings/<int:id>/cancel', methods=['POST'])
+def cancel_booking(id):
+    """Cancels booking of id in url params, freeing its nights. Only the
+        guest or the listing's host may cancel. Returns serialized booking
+        in JSON.
+
+        Returns:
+            booking: {id, listing_id, guest_id, start_date, end_date, status}
+    """
+
+    curr_user = authenticateJWT()
+    if not curr_user:
+        return jsonify(error='Unauthorized'), 401
+
+    booking = Booking.query.get_or_404(id)
+    if curr_user.id not in (booking.guest_id, booking.listing.host_id):
+        return jsonify(error='Unauthorized'), 401
+
+    booking.status = Booking.CANCELLED
+    db.session.commit()
+
+    response_cache.invalidate('listings', 'bookings')
+    replica_router.record_writes(
+        user_ids=[booking.guest_id, booking.listing.host_id], namespaces=['listings', 'bookings'])
+
+    return jsonify(booking=booking.serialize())
+
+
+##############################################################################
+# Internal Routes
+
+@app.route('/internal/pool')
+def get_pool_stats():
+    """Get this process's database connection pool gauges. If valid admin
+        token, returns pool stats.
+
+        Returns:
+            {pool, status, size, checked_in, checked_out, overflow,
+             max_overflow, checkouts, timeouts, wait_total_ms, wait_avg_ms,
+             wait_max_ms}
+            Queue pool fields are omitted when the database uses another
+            pool, e.g. SQLite.
+    """
+
+    curr_user = authenticateJWT()
+    if curr_user and curr_user.is_admin:
+        return jsonify(pool_stats(db.engine))
+
+    else:
+        return jsonify(error='Unauthorized'), 401
+
+@app.route('/metrics')
+def get_metrics():
+    """Get this process's request and SQL metrics in Prometheus text format.
+        If METRICS_TOKEN is set, it must be sent as the bearer token.
+    """
+
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify(error='Unauthorized'), 401
+
+    return Response(instrumentation.render_metrics(), mimetype='text/plain; version=0.0.4')
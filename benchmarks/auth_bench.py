@@ -0,0 +1,82 @@
+"""Microbenchmark per-request authentication overhead.
+
+Times authenticateJWT inside a request context for:
+
+    before       legacy token, LIKE lookup on users every request (old path)
+    legacy       legacy token through the principal cache
+    claims       access token with sub/exp claims, no database lookup
+
+Run from the repo root:
+
+    python -m benchmarks.auth_bench --iterations 20000
+"""
+
+import argparse
+import time
+
+from benchmarks.common import recreate_tables, use_scratch_database
+
+use_scratch_database('auth_bench')
+
+import jwt  # noqa: E402
+
+from app import app, authenticateJWT, createJWT, db  # noqa: E402
+from models import User  # noqa: E402
+
+
+def before_authenticate():
+    """authenticateJWT as it was before principals: decode, then LIKE query."""
+
+    from flask import request
+
+    token = request.headers['Authorization'].split()[1]
+    data = jwt.decode(token, app.config.get('SECRET_KEY'), algorithms='HS256')
+    return User.query.filter(User.username.like((data['username']))).one_or_none()
+
+
+def bench(fn, token, iterations):
+    """Returns mean microseconds per call of fn with token as bearer."""
+
+    headers = {'Authorization': f'Bearer {token}'}
+    with app.test_request_context(headers=headers):
+        assert fn() is not None
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        elapsed = time.perf_counter() - start
+    return elapsed / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        recreate_tables(app, db)
+        user = User(
+            username='bench', password='x', first_name='b', last_name='b',
+            email='bench@example.com', phone='0',
+        )
+        db.session.add(user)
+        db.session.commit()
+
+        legacy = jwt.encode(
+            {'username': user.username, 'is_admin': user.is_admin},
+            app.config.get('SECRET_KEY'),
+            algorithm='HS256',
+        )
+        claims = createJWT(user)
+
+        results = {
+            'before': bench(before_authenticate, legacy, args.iterations),
+            'legacy': bench(authenticateJWT, legacy, args.iterations),
+            'claims': bench(authenticateJWT, claims, args.iterations),
+        }
+
+    for name, micros in results.items():
+        print(f"{name:<10}{micros:>10.1f}us/request")
+
+
+if __name__ == '__main__':
+    main()
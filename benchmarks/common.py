@@ -0,0 +1,44 @@
+"""Scratch database setup shared by the benchmarks.
+
+Benchmarks drop and recreate every table before seeding, so they never run
+against DATABASE_URL: use_scratch_database points it at BENCH_DATABASE_URL,
+or a SQLite file in the temp directory if that is unset. Call it before
+importing app, which reads DATABASE_URL on import:
+
+    from benchmarks.common import use_scratch_database
+    use_scratch_database('search_bench')
+
+    from app import app, db  # noqa: E402
+"""
+
+import os
+import tempfile
+
+scratch_url = None
+
+
+def use_scratch_database(name):
+    """Sets DATABASE_URL, replacing any configured one, to BENCH_DATABASE_URL
+    or sharebnb_<name>.sqlite in the temp directory. Returns the URL.
+    """
+
+    global scratch_url
+
+    scratch_url = os.environ.get('BENCH_DATABASE_URL') or 'sqlite:///' + os.path.join(
+        tempfile.gettempdir(), f'sharebnb_{name}.sqlite')
+    scratch_url = scratch_url.replace('postgres://', 'postgresql://')
+    os.environ['DATABASE_URL'] = scratch_url
+    return scratch_url
+
+
+def recreate_tables(app, db):
+    """Drops and recreates every table of app's database, once
+    use_scratch_database has pointed app at the scratch database.
+    """
+
+    if scratch_url is None or app.config['SQLALCHEMY_DATABASE_URI'] != scratch_url:
+        raise SystemExit(
+            "Refusing to drop tables: call use_scratch_database before importing app")
+
+    db.drop_all()
+    db.create_all()
@@ -0,0 +1,455 @@
+"""Load test every route with concurrent clients and save the results.
+
+Seeds a dataset shaped like generator/create_csvs.py's (per unit of
+--scale: 30 users, 50 listings, 600 photos, 5,000 messages, 200 bookings;
+--scale 200 is a million messages) into BENCH_DATABASE_URL, SQLite or
+Postgres (a scratch SQLite file if unset; DATABASE_URL is never used),
+unless --no-seed. Then, for each route, --clients threads send --requests
+requests in total, through the Flask test client or, with --url, to a
+running server over HTTP.
+
+Reports throughput, p50/p95/p99 latency, error count and SQL queries per
+request (read from the Server-Timing header) per route, and writes them
+with the git commit to benchmarks/results/<commit>-<time>.json. Pass an
+earlier results file as --compare to print the change per route.
+
+Run from the repo root:
+
+    python -m benchmarks.harness --scale 20 --clients 8
+    BENCH_DATABASE_URL=postgresql:///sharebnb_bench python -m benchmarks.harness --scale 200
+    BENCH_DATABASE_URL=postgresql:///sharebnb_bench python -m benchmarks.harness \
+        --no-seed --url http://localhost:5000
+
+Seeding drops and recreates every table in BENCH_DATABASE_URL, and makes user1
+an admin for GET /internal/pool. Public GET routes are served from the
+response cache after their first request; set RESPONSE_CACHE_TTL=0 to
+measure them uncached.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from benchmarks.common import recreate_tables, use_scratch_database
+
+use_scratch_database('harness')
+
+import bcrypt  # noqa: E402
+
+from app import app, db  # noqa: E402
+from models import Booking, Listing, ListingCard, ListingPhoto, Message, User  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# Rows per unit of --scale, as in generator/create_csvs.py.
+USERS = 30
+LISTINGS = 50
+LISTING_PHOTOS = 600
+MESSAGES = 5000
+BOOKINGS_PER_LISTING = 4
+
+PASSWORD = 'password'
+WORDS = (
+    'backyard pool sunny shade garden patio grill quiet cozy private deck '
+    'hammock lawn view fire pit hot tub fence trees family friendly spacious'
+).split()
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def insert_chunks(model, rows, chunk_size=10000):
+    """Inserts rows, an iterable of dicts, with executemany in chunks."""
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            db.session.execute(model.__table__.insert(), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(model.__table__.insert(), chunk)
+
+
+def seed(scale, seed_value):
+    """Creates scale units of users, listings, photos and messages. Every
+    user's password is PASSWORD; user1 is an admin.
+    """
+
+    rng = random.Random(seed_value)
+    users = USERS * scale
+    listings = LISTINGS * scale
+    password = bcrypt.hashpw(
+        PASSWORD.encode('UTF-8'),
+        bcrypt.gensalt(rounds=app.config['BCRYPT_LOG_ROUNDS']),
+    ).decode('UTF-8')
+    now = datetime.utcnow()
+
+    recreate_tables(app, db)
+
+    insert_chunks(User, (
+        {
+            'email': f'user{i}@example.com',
+            'username': f'user{i}',
+            'password': password,
+            'phone': f'555-{i:07d}',
+            'first_name': words(rng, 1).title(),
+            'last_name': words(rng, 1).title(),
+            'is_admin': i == 1,
+        }
+        for i in range(1, users + 1)
+    ))
+    insert_chunks(Listing, (
+        {
+            'address': f'{i} {words(rng, 1).title()} St, Springfield',
+            'title': words(rng, 2).title(),
+            'details': words(rng, 20),
+            'host_id': rng.randint(1, users),
+            'price': rng.randint(10, 500),
+        }
+        for i in range(1, listings + 1)
+    ))
+    insert_chunks(ListingPhoto, (
+        {
+            'listing_id': rng.randint(1, listings),
+            'small_photo_url': f'http://sharebnb-photos-small.s3.amazonaws.com/photo-{i}.jpg',
+            'large_photo_url': f'http://sharebnb-photos-large.s3.amazonaws.com/photo-{i}.jpg',
+        }
+        for i in range(LISTING_PHOTOS * scale)
+    ))
+    insert_chunks(Message, (
+        {
+            'text': words(rng, 12),
+            'to_user_id': rng.randint(1, users),
+            'from_user_id': rng.randint(1, users),
+            'timestamp': now - timedelta(seconds=rng.randint(0, 365 * 24 * 60 * 60)),
+        }
+        for _ in range(MESSAGES * scale)
+    ))
+    insert_chunks(Booking, booking_rows(rng, users, listings, now.date()))
+    db.session.commit()
+    ListingCard.rebuild()
+
+
+def booking_rows(rng, users, listings, today):
+    """Yields BOOKINGS_PER_LISTING confirmed, non-overlapping bookings of
+    each listing over the coming months.
+    """
+
+    for listing_id in range(1, listings + 1):
+        start = today + timedelta(days=rng.randint(1, 14))
+        for _ in range(BOOKINGS_PER_LISTING):
+            end = start + timedelta(days=rng.randint(1, 7))
+            yield {
+                'listing_id': listing_id,
+                'guest_id': rng.randint(1, users),
+                'start_date': start,
+                'end_date': end,
+                'status': Booking.CONFIRMED,
+                'created_at': datetime.utcnow(),
+            }
+            start = end + timedelta(days=rng.randint(0, 14))
+
+
+class Client:
+    """Sends requests in-process or to base_url. Returns
+    (status, body bytes, headers) for each.
+    """
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url
+
+    def request(self, method, path, json_body=None, headers=None, form=None):
+        headers = dict(headers or {})
+
+        if self.base_url is None:
+            response = app.test_client().open(
+                path, method=method, json=json_body, data=form, headers=headers)
+            return response.status_code, response.get_data(), response.headers
+
+        data = None
+        if json_body is not None:
+            data = json.dumps(json_body).encode('UTF-8')
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode('UTF-8')
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        request = urllib.request.Request(
+            self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read(), response.headers
+        except urllib.error.HTTPError as error:
+            return error.code, error.read(), error.headers
+
+
+def login_users(client, count):
+    """Returns [(user_id, access token, refresh token), ...] for the first
+    count users.
+    """
+
+    sessions = []
+    for user_id in range(1, count + 1):
+        status, body, _ = client.request(
+            'POST', '/login', {'username': f'user{user_id}', 'password': PASSWORD})
+        if status != 200:
+            raise SystemExit(f"Could not log in user{user_id} ({status}); seed first?")
+        tokens = json.loads(body)
+        sessions.append((user_id, tokens['token'], tokens['refresh_token']))
+    return sessions
+
+
+def scenarios(users, listings, sessions, bookings):
+    """Returns {name: request factory}. Each factory takes a Random and
+    returns (method, path, kwargs) for one request. sessions[0] is the admin;
+    bookings is [(guest id, booking id), ...] of bookings of session users.
+    """
+
+    def auth(session):
+        return {'Authorization': f'Bearer {session[1]}'}
+
+    def as_someone(method, path, **kwargs):
+        def factory(rng):
+            session = rng.choice(sessions)
+            other = rng.randint(1, users)
+            return method, path(session, other), dict(kwargs, headers=auth(session))
+        return factory
+
+    def anonymous(path):
+        return lambda rng: ('GET', path(rng), {})
+
+    def dates(rng, first_day, nights):
+        start = date.today() + timedelta(days=first_day)
+        return start.isoformat(), (start + timedelta(days=nights)).isoformat()
+
+    def book(rng):
+        # Far enough out that most requests find the nights free.
+        start, end = dates(rng, rng.randint(400, 4000), rng.randint(1, 3))
+        return 'POST', f'/listings/{rng.randint(1, listings)}/bookings', {
+            'json_body': {'start_date': start, 'end_date': end},
+            'headers': auth(rng.choice(sessions)),
+        }
+
+    sessions_by_user = {session[0]: session for session in sessions}
+
+    def cancel(rng):
+        guest_id, booking_id = rng.choice(bookings)
+        return 'POST', f'/bookings/{booking_id}/cancel', {
+            'headers': auth(sessions_by_user[guest_id])}
+
+    def available(rng):
+        start, end = dates(rng, rng.randint(1, 90), rng.randint(1, 7))
+        return f'/listings?available_from={start}&available_to={end}'
+
+    signups = iter(range(10 ** 9))
+
+    routes = {
+        'GET /listings': anonymous(lambda rng: '/listings'),
+        'GET /listings?cursor': anonymous(
+            lambda rng: f'/listings?cursor={rng.randint(1, listings)}&limit=50'),
+        'GET /listings?view=card': anonymous(lambda rng: '/listings?view=card'),
+        'GET /listings?term': anonymous(lambda rng: f'/listings?term={rng.choice(WORDS)}'),
+        'GET /listings/<id>': anonymous(lambda rng: f'/listings/{rng.randint(1, listings)}'),
+        'GET /users': anonymous(lambda rng: f'/users?cursor={rng.randint(0, users)}&limit=50'),
+        'GET /users/<id>': anonymous(lambda rng: f'/users/{rng.randint(1, users)}'),
+        'GET /messages': as_someone('GET', lambda session, other: '/messages?limit=50'),
+        'GET /messages/<id>': as_someone(
+            'GET', lambda session, other: f'/messages/{other}?limit=50'),
+        'GET /messages/conversations': as_someone(
+            'GET', lambda session, other: '/messages/conversations'),
+        'GET /messages/poll': as_someone(
+            'GET', lambda session, other: '/messages/poll?timeout=0&last_id=0'),
+        'POST /messages/<id>': as_someone(
+            'POST', lambda session, other: f'/messages/{other}',
+            json_body={'message': 'Is the pool free this weekend?'}),
+        'POST /messages/<id>/read': as_someone(
+            'POST', lambda session, other: f'/messages/{other}/read'),
+        'POST /listings': as_someone(
+            'POST', lambda session, other: '/listings',
+            form={'title': 'Shady lawn', 'price': '40', 'address': '1 Elm St',
+                  'details': 'Bring a blanket'}),
+        'POST /users': lambda rng: ('POST', '/users', {'json_body': {
+            'username': f'bench{time.time_ns()}{next(signups)}',
+            'password': PASSWORD, 'first_name': 'Bench', 'last_name': 'Mark',
+            'email': f'bench{time.time_ns()}@example.com', 'phone': '555-0000',
+        }}),
+        'POST /login': lambda rng: ('POST', '/login', {'json_body': {
+            'username': f'user{rng.randint(1, len(sessions))}', 'password': PASSWORD,
+        }}),
+        'POST /token/refresh': lambda rng: ('POST', '/token/refresh', {
+            'json_body': {'refresh_token': rng.choice(sessions)[2]},
+        }),
+        'GET /internal/pool': lambda rng: (
+            'GET', '/internal/pool', {'headers': auth(sessions[0])}),
+        'GET /metrics': anonymous(lambda rng: '/metrics'),
+        'GET /listings?available': anonymous(available),
+        'GET /listings/<id>/calendar': anonymous(
+            lambda rng: f'/listings/{rng.randint(1, listings)}/calendar'),
+        'GET /bookings': as_someone('GET', lambda session, other: '/bookings?limit=50'),
+        'POST /listings/<id>/bookings': book,
+        'POST /bookings/<id>/cancel': cancel,
+    }
+    if not bookings:
+        del routes['POST /bookings/<id>/cancel']
+    return routes
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def run_scenario(client, factory, requests, clients, seed_value):
+    """Sends requests built by factory from clients threads. Returns stats."""
+
+    rng = random.Random(seed_value)
+    planned = [factory(rng) for _ in range(requests)]
+
+    def send(planned_request):
+        method, path, kwargs = planned_request
+        start = time.perf_counter()
+        status, _, headers = client.request(method, path, **kwargs)
+        elapsed = time.perf_counter() - start
+        match = SERVER_TIMING_QUERIES.search(headers.get('Server-Timing') or '')
+        return status, elapsed, int(match.group(1)) if match else None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(send, planned))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(elapsed for _, elapsed, _ in results)
+    queries = [count for _, _, count in results if count is not None]
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    return {
+        'requests': requests,
+        'throughput_rps': requests / wall,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'queries_per_request': sum(queries) / len(queries) if queries else None,
+        'errors': sum(count for status, count in statuses.items() if int(status) >= 500),
+        'statuses': statuses,
+    }
+
+
+def git_commit():
+    """Returns (commit hash, whether the tree has uncommitted changes)."""
+
+    def git(*args):
+        return subprocess.run(
+            ['git', *args], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+
+    return git('rev-parse', '--short', 'HEAD') or 'unknown', bool(git('status', '--porcelain'))
+
+
+def print_results(results, baseline=None):
+    print(f"{'route':<30}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}{'errors':>8}"
+          + (f"{'p50 vs base':>13}" if baseline else ''))
+
+    for name, stats in results['routes'].items():
+        queries = stats['queries_per_request']
+        line = (f"{name:<30}{stats['throughput_rps']:>9.1f}{stats['p50_ms']:>7.1f}ms"
+                f"{stats['p95_ms']:>7.1f}ms{stats['p99_ms']:>7.1f}ms"
+                f"{'-' if queries is None else f'{queries:.1f}':>9}{stats['errors']:>8}")
+        if baseline and name in baseline['routes']:
+            before = baseline['routes'][name]['p50_ms']
+            line += f"{(stats['p50_ms'] - before) / before * 100:>+12.0f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=1, help="dataset units to seed")
+    parser.add_argument('--no-seed', action='store_true', help="use the existing dataset")
+    parser.add_argument('--clients', type=int, default=8, help="concurrent clients")
+    parser.add_argument('--requests', type=int, default=200, help="requests per route")
+    parser.add_argument('--routes', help="comma separated substrings of routes to run")
+    parser.add_argument('--url', help="base URL of a running server, instead of in-process")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    parser.add_argument('--sessions', type=int, default=10, help="users to log in as")
+    parser.add_argument('--output', help="results file (default benchmarks/results/...)")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if not args.no_seed:
+            start = time.perf_counter()
+            seed(args.scale, args.seed)
+            print(f"seeded scale {args.scale} in {time.perf_counter() - start:.1f}s")
+
+        users = db.session.query(db.func.max(User.id)).scalar()
+        listings = db.session.query(db.func.max(Listing.id)).scalar()
+        dataset = {
+            'users': User.query.count(),
+            'listings': Listing.query.count(),
+            'listing_photos': ListingPhoto.query.count(),
+            'messages': Message.query.count(),
+            'bookings': Booking.query.count(),
+        }
+        session_users = min(args.sessions, users)
+        bookings = db.session.query(Booking.guest_id, Booking.id).filter(
+            Booking.guest_id <= session_users).order_by(Booking.id).all()
+        db.session.remove()
+
+    client = Client(args.url)
+    sessions = login_users(client, session_users)
+
+    selected = scenarios(users, listings, sessions, [tuple(booking) for booking in bookings])
+    if args.routes:
+        wanted = args.routes.split(',')
+        selected = {name: factory for name, factory in selected.items()
+                    if any(part in name for part in wanted)}
+
+    commit, dirty = git_commit()
+    results = {
+        'commit': commit,
+        'dirty': dirty,
+        'started_at': datetime.utcnow().isoformat(),
+        'database': db.engine.url.get_backend_name(),
+        'target': args.url or 'in-process',
+        'dataset': dataset,
+        'clients': args.clients,
+        'routes': {},
+    }
+
+    for index, (name, factory) in enumerate(selected.items()):
+        results['routes'][name] = run_scenario(
+            client, factory, args.requests, args.clients, args.seed + index)
+
+    print(f"{results['database']} {dataset} @ {commit}{' (dirty)' if dirty else ''}, "
+          f"{args.clients} clients")
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{commit}-{datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"saved {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark /login throughput under concurrent clients.
+
+Creates one user, then has --clients threads log in --logins times in total
+through the Flask test client. Reports logins per second, latency
+percentiles, and how many requests were shed with 503.
+
+Run from the repo root, e.g. comparing pool sizes:
+
+    PASSWORD_POOL_SIZE=1 python -m benchmarks.login_bench --clients 16
+    PASSWORD_POOL_SIZE=4 python -m benchmarks.login_bench --clients 16
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import recreate_tables, use_scratch_database
+
+use_scratch_database('login_bench')
+
+from app import app, db  # noqa: E402
+from models import User  # noqa: E402
+
+
+def login(credentials):
+    """Logs in once. Returns (status code, seconds taken)."""
+
+    client = app.test_client()
+    start = time.perf_counter()
+    response = client.post('/login', json=credentials)
+    return response.status_code, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--logins', type=int, default=64)
+    args = parser.parse_args()
+
+    credentials = {'username': 'bench', 'password': 'bench-password'}
+
+    with app.app_context():
+        recreate_tables(app, db)
+        User.signup(
+            username=credentials['username'], password=credentials['password'],
+            email='bench@example.com', first_name='b', last_name='b', phone='0',
+        )
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as clients:
+        results = list(clients.map(login, [credentials] * args.logins))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(seconds for status, seconds in results if status == 200)
+    shed = sum(1 for status, seconds in results if status == 503)
+
+    print(f"pool={app.config['PASSWORD_POOL']} size={app.config['PASSWORD_POOL_SIZE']} "
+          f"queue_limit={app.config['PASSWORD_QUEUE_LIMIT']} "
+          f"rounds={app.config['BCRYPT_LOG_ROUNDS']} clients={args.clients}")
+    print(f"{len(latencies)} ok, {shed} shed (503) in {elapsed:.2f}s: "
+          f"{len(latencies) / elapsed:.1f} logins/s")
+    if len(latencies) >= 2:
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"p50 {quantiles[49] * 1000:.0f}ms  p95 {quantiles[94] * 1000:.0f}ms  "
+              f"p99 {quantiles[98] * 1000:.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
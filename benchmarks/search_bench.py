@@ -0,0 +1,94 @@
+"""Benchmark listing search: ILIKE scan vs. the in-process inverted index.
+
+Loads the seed listings scaled up --scale times into a scratch SQLite
+database (or BENCH_DATABASE_URL if set) and times the same searches against the
+old address ILIKE query, an ILIKE over title/address/details, and
+ListingSearch.
+
+Run from the repo root:
+
+    python -m benchmarks.search_bench --scale 1000
+"""
+
+import argparse
+import time
+from csv import DictReader
+
+from benchmarks.common import recreate_tables, use_scratch_database
+
+use_scratch_database('search_bench')
+
+from app import app, db  # noqa: E402
+from models import Listing, User  # noqa: E402
+from search import ListingSearch  # noqa: E402
+
+TERMS = ['pool', 'chadport', 'fl', 'magazine', 'science crime', 'apt 105']
+
+
+def seed(scale):
+    """Recreates schema and loads seed users and listings scale times."""
+
+    recreate_tables(app, db)
+
+    with open('generator/users.csv') as users:
+        db.session.bulk_insert_mappings(User, DictReader(users))
+
+    with open('generator/listings.csv') as listings:
+        rows = list(DictReader(listings))
+    for _ in range(scale):
+        db.session.bulk_insert_mappings(Listing, rows)
+
+    db.session.commit()
+    return len(rows) * scale
+
+
+def timed(fn, repeat):
+    """Returns mean seconds per call of fn over repeat calls."""
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        total = seed(args.scale)
+        print(f"{total} listings")
+
+        app.config['SEARCH_BACKEND'] = 'memory'
+        search = ListingSearch(app)
+        start = time.perf_counter()
+        search.search('warmup', 1)
+        print(f"index build: {time.perf_counter() - start:.3f}s")
+
+        print(f"{'term':<16}{'ilike address':>16}{'ilike all':>16}{'index':>16}")
+        for term in TERMS:
+            pattern = f"%{term}%"
+
+            def ilike_address():
+                Listing.query.filter(Listing.address.ilike(pattern)).limit(args.limit).all()
+
+            def ilike_all():
+                Listing.query.filter(
+                    Listing.title.ilike(pattern)
+                    | Listing.address.ilike(pattern)
+                    | Listing.details.ilike(pattern)
+                ).limit(args.limit).all()
+
+            def indexed():
+                ids = search.search(term, args.limit)
+                Listing.query.filter(Listing.id.in_(ids)).all()
+
+            results = [timed(fn, args.repeat) for fn in (ilike_address, ilike_all, indexed)]
+            print(f"{term:<16}" + "".join(f"{seconds * 1000:>14.2f}ms" for seconds in results))
+
+
+if __name__ == '__main__':
+    main()
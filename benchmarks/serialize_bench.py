@@ -0,0 +1,168 @@
+"""Benchmark ORM vs column-projected serialization of collection responses.
+
+Seeds a scratch SQLite database with the generator CSVs repeated --scale
+times (100 by default: 3,000 users, 5,000 listings, 60,000 photos and
+500,000 messages), then builds each collection both ways and checks they
+serialize identically:
+
+    orm          query.all() of model instances, then serialize()
+    projection   Model.rows() column tuples, then serialize_rows()
+
+Run from the repo root:
+
+    python -m benchmarks.serialize_bench --scale 100
+"""
+
+import argparse
+import os
+import time
+from csv import DictReader
+from datetime import datetime
+
+from benchmarks.common import recreate_tables, use_scratch_database
+
+use_scratch_database('serialize_bench')
+
+from app import app  # noqa: E402
+from models import Listing, ListingPhoto, Message, User, db  # noqa: E402
+
+GENERATOR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'generator')
+
+
+def read_csv(name):
+    with open(os.path.join(GENERATOR, name)) as file:
+        return list(DictReader(file))
+
+
+def seed(scale):
+    """Loads the generator CSVs scale times, offsetting ids per copy."""
+
+    users = read_csv('users.csv')
+    listings = read_csv('listings.csv')
+    photos = read_csv('listing_photos.csv')
+    messages = read_csv('messages.csv')
+
+    recreate_tables(app, db)
+
+    for copy in range(scale):
+        user_offset = copy * len(users)
+        listing_offset = copy * len(listings)
+
+        db.session.bulk_insert_mappings(User, [
+            dict(user, username=f"{user['username']}{copy}", email=f"{copy}{user['email']}")
+            for user in users
+        ])
+        db.session.bulk_insert_mappings(Listing, [
+            dict(listing, host_id=int(listing['host_id']) + user_offset)
+            for listing in listings
+        ])
+        db.session.bulk_insert_mappings(ListingPhoto, [
+            dict(photo, listing_id=int(photo['listing_id']) + listing_offset)
+            for photo in photos
+        ])
+        db.session.bulk_insert_mappings(Message, [
+            dict(
+                message,
+                to_user_id=int(message['to_user_id']) + user_offset,
+                from_user_id=int(message['from_user_id']) + user_offset,
+                timestamp=datetime.fromisoformat(message['timestamp']),
+            )
+            for message in messages
+        ])
+
+    db.session.commit()
+
+
+def orm_feed(fields=None):
+    """Returns query of Listing instances with photos eager loaded by one
+    SELECT ... IN, loading only fields' columns if included.
+    """
+
+    query = Listing.query
+    if fields is not None:
+        query = query.options(db.load_only(*[getattr(Listing, field) for field in fields]))
+    if fields is None or 'photos' in fields:
+        query = query.options(db.selectinload(Listing.photos))
+    return query
+
+
+def cases(limit):
+    """Returns {name: (orm, projection)} callables returning serialized lists."""
+
+    user_id = db.session.query(Message.to_user_id).limit(1).scalar()
+    involving = (Message.from_user_id == user_id) | (Message.to_user_id == user_id)
+    newest = (Message.timestamp.desc(), Message.id.desc())
+
+    return {
+        f'listings x{limit}': (
+            lambda: [listing.serialize() for listing in orm_feed().order_by(Listing.id).limit(limit)],
+            lambda: Listing.serialize_rows(Listing.rows().order_by(Listing.id).limit(limit)),
+        ),
+        'listings (all)': (
+            lambda: [listing.serialize() for listing in orm_feed().order_by(Listing.id)],
+            lambda: Listing.serialize_rows(Listing.rows().order_by(Listing.id)),
+        ),
+        'listings (title,price)': (
+            lambda: [
+                listing.serialize(['id', 'title', 'price'])
+                for listing in orm_feed(['id', 'title', 'price']).order_by(Listing.id)
+            ],
+            lambda: Listing.serialize_rows(
+                Listing.rows(['id', 'title', 'price']).order_by(Listing.id), ['id', 'title', 'price']),
+        ),
+        'users (all)': (
+            lambda: [user.serialize() for user in User.query.order_by(User.id)],
+            lambda: [User.serialize_row(row) for row in User.rows().order_by(User.id)],
+        ),
+        f'messages x{limit}': (
+            lambda: Message.serialize_all(
+                Message.query.filter(involving).order_by(*newest).limit(limit).all()),
+            lambda: Message.serialize_rows(
+                Message.rows().filter(involving).order_by(*newest).limit(limit).all()),
+        ),
+        'messages (all)': (
+            lambda: Message.serialize_all(Message.query.order_by(Message.id).all()),
+            lambda: Message.serialize_rows(Message.rows().order_by(Message.id).all()),
+        ),
+    }
+
+
+def best_of(func, repeat):
+    """Returns (best seconds, result) over repeat runs with a cold session."""
+
+    best = None
+    for _ in range(repeat):
+        db.session.remove()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=100)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-seed', action='store_true', help="reuse the scratch database")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if not args.no_seed:
+            start = time.perf_counter()
+            seed(args.scale)
+            print(f"seeded x{args.scale} in {time.perf_counter() - start:.1f}s")
+
+        print(f"{'collection':<24}{'rows':>8}{'orm':>12}{'projection':>12}{'speedup':>9}")
+        for name, (orm, projection) in cases(args.limit).items():
+            orm_time, expected = best_of(orm, args.repeat)
+            projection_time, actual = best_of(projection, args.repeat)
+            assert actual == expected, f"{name}: projection output differs from ORM output"
+
+            print(f"{name:<24}{len(actual):>8}{orm_time * 1000:>10.1f}ms"
+                  f"{projection_time * 1000:>10.1f}ms{orm_time / projection_time:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
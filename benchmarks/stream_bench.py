@@ -0,0 +1,127 @@
+"""Benchmark peak memory and time to first byte of large /listings responses.
+
+Seeds --rows listings (with --photos photos each) into a scratch SQLite
+database, then fetches them all once per mode, each in a fresh process so
+peak RSS is not shared:
+
+    buffered     GET /listings?limit=N, built in full and sent with jsonify
+    stream       GET /listings?stream=true
+    ndjson       GET /listings with Accept: application/x-ndjson
+
+Run from the repo root:
+
+    python -m benchmarks.stream_bench --rows 100000
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks.common import recreate_tables, use_scratch_database
+
+use_scratch_database('stream_bench')
+
+MODES = {
+    'buffered': ('/listings?limit={rows}', {}),
+    'stream': ('/listings?stream=true', {}),
+    'ndjson': ('/listings', {'Accept': 'application/x-ndjson'}),
+}
+
+
+def peak_rss_mb():
+    """Returns peak resident set size of this process in MB."""
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def seed(rows, photos):
+    from app import app, db
+    from models import Listing, User
+
+    with app.app_context():
+        recreate_tables(app, db)
+        db.session.add(User(
+            username='host', password='x', first_name='h', last_name='h',
+            email='host@example.com', phone='0',
+        ))
+        db.session.flush()
+
+        photo = {
+            'small_photo_url': 'http://sharebnb-photos-small.s3.amazonaws.com/photo.jpg',
+            'large_photo_url': 'http://sharebnb-photos-large.s3.amazonaws.com/photo.jpg',
+        }
+        Listing.bulk_create(
+            {
+                'title': f'Listing {i}',
+                'price': i % 500,
+                'details': 'Sunny backyard with a pool and plenty of shade. ' * 2,
+                'address': f'{i} Main St, Springfield',
+                'host_id': 1,
+                'photos': [photo] * photos,
+            }
+            for i in range(rows)
+        )
+        db.session.commit()
+
+
+def measure(mode, rows):
+    """Fetches all listings in mode; prints JSON result for the parent."""
+
+    from app import app
+
+    app.config['MAX_PAGE_SIZE'] = rows
+    url, headers = MODES[mode]
+    client = app.test_client()
+    baseline = peak_rss_mb()
+
+    start = time.perf_counter()
+    response = client.get(url.format(rows=rows), headers=headers, buffered=False)
+    chunks = iter(response.response)
+    first = next(chunks)
+    ttfb = time.perf_counter() - start
+    size = len(first) + sum(len(chunk) for chunk in chunks)
+    total = time.perf_counter() - start
+    response.close()
+
+    print(json.dumps({
+        'mode': mode,
+        'ttfb_ms': ttfb * 1000,
+        'total_ms': total * 1000,
+        'bytes': size,
+        'peak_rss_mb': peak_rss_mb(),
+        'baseline_rss_mb': baseline,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--photos', type=int, default=2)
+    parser.add_argument('--measure', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.rows)
+        return
+
+    seed(args.rows, args.photos)
+    print(f"{args.rows} listings, {args.photos} photos each")
+    print(f"{'mode':<10}{'ttfb':>12}{'total':>12}{'MB sent':>10}{'peak RSS':>12}{'over base':>12}")
+
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.stream_bench',
+             '--rows', str(args.rows), '--measure', mode],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:<10}{result['ttfb_ms']:>10.0f}ms{result['total_ms']:>10.0f}ms"
+              f"{result['bytes'] / 1e6:>10.1f}{result['peak_rss_mb']:>10.0f}MB"
+              f"{result['peak_rss_mb'] - result['baseline_rss_mb']:>10.0f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Rebuild or check the listing_cards read model.
+
+Cards are maintained incrementally as listings, photos and hosts change
+through the app, and rebuilt by importer.py after bulk loads. Rebuild after
+writing to those tables any other way; check compares every card with its
+value computed from listings, listing_photos and users, and exits 1 if any
+differ (repairing them with --fix).
+
+    python cards.py rebuild
+    python cards.py check --fix
+"""
+
+import argparse
+import logging
+import time
+
+from app import app
+from models import ListingCard, db
+from pooling import lift_statement_timeout
+from response_cache import response_cache
+
+parser = argparse.ArgumentParser(description="Rebuild or check listing cards.")
+parser.add_argument('command', choices=('rebuild', 'check'))
+parser.add_argument('--fix', action='store_true', help="with check, recompute stale cards")
+parser.add_argument('--show', type=int, default=20, help="stale listing ids to print")
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('cards')
+
+with app.app_context():
+    start = time.perf_counter()
+
+    if args.command == 'rebuild':
+        cards = ListingCard.rebuild()
+        logger.info("Rebuilt %s listing cards in %.1fs", cards, time.perf_counter() - start)
+        response_cache.invalidate('listings')
+
+    else:
+        with db.engine.begin() as connection:
+            lift_statement_timeout(connection)
+            stale = ListingCard.stale(connection)
+            if stale and args.fix:
+                ListingCard.refresh(connection, stale)
+
+        logger.info("Checked listing cards in %.1fs: %s stale", time.perf_counter() - start, len(stale))
+        if stale:
+            logger.warning("Stale listing ids: %s%s", ', '.join(map(str, stale[:args.show])),
+                           ', ...' if len(stale) > args.show else '')
+            if args.fix:
+                logger.info("Recomputed %s listing cards", len(stale))
+                response_cache.invalidate('listings')
+            else:
+                parser.exit(1)
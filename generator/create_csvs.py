@@ -1,86 +1,255 @@
+"""Generate synthetic ShareBnB data as CSV (or Parquet) files, offline.
+
+Row counts scale from the original sample (per unit of --scale: 30 users,
+50 listings, 600 listing photos, 5,000 messages), or are set per table.
+Output is deterministic for a given --seed and --end.
+
+Data is skewed the way real usage is: a few hosts own most listings, a few
+listings have most photos, and messages are power-law distributed over
+senders, who mostly write to a handful of regular contacts.
+
+Tables are generated in shards of --shard-rows rows by --workers processes.
+A table that fits in one shard is written to <out>/<table>.csv, the layout
+seed.py and importer.py read; larger ones to <out>/<table>/part-NNNNN.csv,
+which importer.py also loads. --format parquet (needs pyarrow) writes
+part-NNNNN.parquet files instead, for tools like DuckDB or Spark.
+
+Faker text is drawn from pools generated once per process, so rows cost
+a few random draws, not Faker calls. Photo URLs point at the
+backyard-photo-{small,large}-N.jpg keys of the photo buckets without
+listing them.
+
+Run from the repo root:
+
+    python generator/create_csvs.py                      # sample size, into generator/
+    python generator/create_csvs.py --scale 20000 --workers 8 --out /data/capacity
+"""
+
+import argparse
 import csv
-from random import sample, choice
-from itertools import permutations
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import accumulate
+
 from faker import Faker
-from helpers import get_random_datetime
-import json
-from my_secrets import S3_SMALL_BUCKET, S3_LARGE_BUCKET, S3_KEY, S3_SECRET
-import boto3
 
 USERS_CSV_HEADERS = ['email', 'username', 'password', 'phone', 'first_name', 'last_name']
 MESSAGES_CSV_HEADERS = ['text', 'to_user_id', 'from_user_id', 'timestamp']
 LISTINGS_CSV_HEADERS = ['address', 'title', 'details', 'host_id', 'price']
 LISTING_PHOTOS_CSV_HEADERS = ['listing_id', 'small_photo_url', 'large_photo_url']
 
+HEADERS = {
+    'users': USERS_CSV_HEADERS,
+    'listings': LISTINGS_CSV_HEADERS,
+    'listing_photos': LISTING_PHOTOS_CSV_HEADERS,
+    'messages': MESSAGES_CSV_HEADERS,
+}
+
 MAX_MESSAGE_LENGTH = 150
 MAX_TITLE_LENGTH = 20
 MAX_DETAILS_LENGTH = 150
 
+# Rows per unit of --scale.
 NUM_USERS = 30
 NUM_MESSAGES = 5000
 NUM_LISTINGS = 50
 NUM_LISTING_PHOTOS = 600
 
-fake = Faker('en_US')
-
-s3 = boto3.client(
-   "s3",
-   aws_access_key_id=S3_KEY,
-   aws_secret_access_key=S3_SECRET
-)
-
-small_images_response = s3.list_objects(Bucket=S3_SMALL_BUCKET)
-small_images = small_images_response['Contents']
-large_images_response = s3.list_objects(Bucket=S3_LARGE_BUCKET)
-large_images = large_images_response['Contents']
-
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.unique.email(),
-            username=fake.unique.user_name(),
-            first_name=fake.first_name(),
-            last_name=fake.last_name(),
-            password='$2b$12$kHeUjJysDxb9Spvj8IaAPumKaZMsGxgewGGLsdQcPDFzbbQ6P2Gae',
-            phone=fake.unique.phone_number()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-    random_pairs = [choice(all_pairs) for n in range(NUM_MESSAGES)]
-
-    for to_user_id, from_user_id in random_pairs:
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_MESSAGE_LENGTH],
-            timestamp=get_random_datetime(),
-            to_user_id=to_user_id,
-            from_user_id=from_user_id,
-        ))
-
-with open('generator/listings.csv', 'w') as listings_csv: 
-    listings_writer = csv.DictWriter(listings_csv, fieldnames=LISTINGS_CSV_HEADERS)
-    listings_writer.writeheader()
-
-    for i in range(NUM_LISTINGS): 
-        listings_writer.writerow(dict(
-            price=fake.random_int(min=0, max=500),
-            host_id=fake.random_int(min=1, max=NUM_USERS),
-            details=fake.paragraph()[:MAX_DETAILS_LENGTH],
-            title=fake.sentence(nb_words=3),
-            address=fake.address(),
-        ))
-
-with open('generator/listing_photos.csv', 'w') as listing_photos_csv: 
-    listing_photos_writer = csv.DictWriter(listing_photos_csv, fieldnames=LISTING_PHOTOS_CSV_HEADERS)
-    listing_photos_writer.writeheader()
-    for i in range(NUM_LISTING_PHOTOS): 
-        listing_photos_writer.writerow(dict(
-            listing_id=fake.random_int(min=1, max=NUM_LISTINGS),
-            small_photo_url = 'http://{}.s3.amazonaws.com/'.format(S3_SMALL_BUCKET) + choice(small_images)['Key'],
-            large_photo_url = 'http://{}.s3.amazonaws.com/'.format(S3_LARGE_BUCKET) + choice(large_images)['Key'],
-        ))
\ No newline at end of file
+# bcrypt hash every generated user logs in with.
+PASSWORD_HASH = '$2b$12$kHeUjJysDxb9Spvj8IaAPumKaZMsGxgewGGLsdQcPDFzbbQ6P2Gae'
+
+# Distinct values of each Faker field drawn from.
+POOL_SIZE = 2000
+
+# Regular contacts per sender, and photo keys per bucket.
+CONTACTS = 20
+PHOTO_KEYS = 30
+
+# Set in each worker process by init_worker.
+context = None
+
+
+def zipf_weights(count, exponent):
+    """Returns cumulative weights of ranks 1..count under Zipf(exponent)."""
+
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+class Context:
+    """Per-process text pools and skewed id distributions."""
+
+    def __init__(self, args, counts):
+        self.args = args
+        self.counts = counts
+
+        fake = Faker('en_US')
+        fake.seed_instance(args.seed)
+        self.first_names = [fake.first_name() for _ in range(POOL_SIZE)]
+        self.last_names = [fake.last_name() for _ in range(POOL_SIZE)]
+        self.user_names = [fake.user_name() for _ in range(POOL_SIZE)]
+        self.domains = [fake.free_email_domain() for _ in range(50)]
+        self.phones = [fake.phone_number() for _ in range(POOL_SIZE)]
+        self.paragraphs = [fake.paragraph() for _ in range(POOL_SIZE)]
+        self.titles = [fake.sentence(nb_words=3)[:MAX_TITLE_LENGTH] for _ in range(POOL_SIZE)]
+        self.addresses = [fake.address() for _ in range(POOL_SIZE)]
+
+        # Popularity rank -> id, shuffled so popular ids are spread out.
+        self.users_by_rank = list(range(1, counts['users'] + 1))
+        random.Random(args.seed).shuffle(self.users_by_rank)
+        self.listings_by_rank = list(range(1, counts['listings'] + 1))
+        random.Random(args.seed + 1).shuffle(self.listings_by_rank)
+
+        self.user_weights = zipf_weights(counts['users'], args.skew)
+        self.listing_weights = zipf_weights(counts['listings'], args.skew)
+        self.contact_weights = zipf_weights(CONTACTS, args.skew)
+
+        self.end = datetime.fromisoformat(args.end)
+        self.span = int(timedelta(days=365 * args.years).total_seconds())
+
+    def users(self, rng, start, count):
+        for user_id in range(start + 1, start + count + 1):
+            name = rng.choice(self.user_names)
+            yield [
+                f"{name}{user_id}@{rng.choice(self.domains)}",
+                f"{name}{user_id}",
+                PASSWORD_HASH,
+                rng.choice(self.phones),
+                rng.choice(self.first_names),
+                rng.choice(self.last_names),
+            ]
+
+    def listings(self, rng, start, count):
+        hosts = rng.choices(self.users_by_rank, cum_weights=self.user_weights, k=count)
+        for host_id in hosts:
+            yield [
+                rng.choice(self.addresses),
+                rng.choice(self.titles),
+                rng.choice(self.paragraphs)[:MAX_DETAILS_LENGTH],
+                host_id,
+                rng.randint(0, 500),
+            ]
+
+    def listing_photos(self, rng, start, count):
+        small = f"http://{self.args.small_bucket}.s3.amazonaws.com/backyard-photo-small-"
+        large = f"http://{self.args.large_bucket}.s3.amazonaws.com/backyard-photo-large-"
+        listings = rng.choices(self.listings_by_rank, cum_weights=self.listing_weights, k=count)
+        for listing_id in listings:
+            yield [
+                listing_id,
+                f"{small}{rng.randint(1, PHOTO_KEYS)}.jpg",
+                f"{large}{rng.randint(1, PHOTO_KEYS)}.jpg",
+            ]
+
+    def messages(self, rng, start, count):
+        users = self.counts['users']
+        senders = rng.choices(self.users_by_rank, cum_weights=self.user_weights, k=count)
+        contacts = rng.choices(range(1, CONTACTS + 1), cum_weights=self.contact_weights, k=count)
+
+        for sender, contact in zip(senders, contacts):
+            # Each sender's contacts are a fixed pseudo-random set of users.
+            recipient = (sender * 7919 + contact * 104729) % users + 1
+            if recipient == sender:
+                recipient = recipient % users + 1
+            timestamp = self.end - timedelta(seconds=rng.randrange(self.span))
+            yield [
+                rng.choice(self.paragraphs)[:MAX_MESSAGE_LENGTH],
+                recipient,
+                sender,
+                timestamp.isoformat(sep=' '),
+            ]
+
+
+def init_worker(args, counts):
+    global context
+    context = Context(args, counts)
+
+
+def shard_path(args, table, shard, shards):
+    if shards == 1 and args.format == 'csv':
+        return os.path.join(args.out, f"{table}.csv")
+    return os.path.join(args.out, table, f"part-{shard:05d}.{args.format}")
+
+
+def write_shard(table, shard, shards):
+    """Generates and writes one shard of table. Returns (path, rows)."""
+
+    args = context.args
+    start = shard * args.shard_rows
+    count = min(args.shard_rows, context.counts[table] - start)
+    rng = random.Random(f"{args.seed}:{table}:{shard}")
+    rows = getattr(context, table)(rng, start, count)
+    path = shard_path(args, table, shard, shards)
+
+    if args.format == 'parquet':
+        import pyarrow
+        import pyarrow.parquet
+
+        columns = list(zip(*rows)) or [()] * len(HEADERS[table])
+        pyarrow.parquet.write_table(
+            pyarrow.table(dict(zip(HEADERS[table], map(list, columns)))), path)
+    else:
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(HEADERS[table])
+            writer.writerows(rows)
+
+    return path, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1, help="multiple of the sample's row counts")
+    for table in HEADERS:
+        parser.add_argument(f"--{table.replace('_', '-')}", type=int, dest=table,
+                            help=f"{table} rows (overrides --scale)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end', default='2021-10-01', help="latest message timestamp")
+    parser.add_argument('--years', type=float, default=2, help="span of message timestamps")
+    parser.add_argument('--skew', type=float, default=0.8, help="Zipf exponent of popularity")
+    parser.add_argument('--out', default='generator')
+    parser.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+    parser.add_argument('--shard-rows', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--small-bucket', default='sharebnb-photos-small')
+    parser.add_argument('--large-bucket', default='sharebnb-photos-large')
+    args = parser.parse_args()
+
+    if args.format == 'parquet':
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            parser.error("--format parquet needs pyarrow installed")
+
+    base = {
+        'users': NUM_USERS,
+        'listings': NUM_LISTINGS,
+        'listing_photos': NUM_LISTING_PHOTOS,
+        'messages': NUM_MESSAGES,
+    }
+    counts = {
+        table: getattr(args, table) if getattr(args, table) is not None
+        else max(1, round(rows * args.scale))
+        for table, rows in base.items()
+    }
+    if counts['users'] < 2:
+        parser.error("need at least 2 users")
+
+    os.makedirs(args.out, exist_ok=True)
+    tasks = []
+    for table, rows in counts.items():
+        shards = -(-rows // args.shard_rows)
+        if shards > 1 or args.format != 'csv':
+            os.makedirs(os.path.join(args.out, table), exist_ok=True)
+        tasks += [(table, shard, shards) for shard in range(shards)]
+
+    with ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=(args, counts)) as pool:
+        futures = [pool.submit(write_shard, *task) for task in tasks]
+        for future in futures:
+            path, rows = future.result()
+            print(f"wrote {rows} rows to {path}")
+
+
+if __name__ == '__main__':
+    main()
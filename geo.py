@@ -0,0 +1,180 @@
+"""Geohashes, bounding boxes and distances for listing locations.
+
+Listings store latitude, longitude and the geohash of that point. A
+geohash names a cell of a recursive grid, and every point in a cell has a
+geohash starting with the cell's, so a B-tree index on geohash turns "in
+these cells" into a few range scans. bbox_ranges() covers a bounding box
+with cells and merges neighbouring ones into ranges; queries then check
+exact coordinates on the few rows those ranges return. The same index works
+on SQLite and Postgres, no PostGIS needed.
+
+Geocoding is pluggable: GEOCODER config names a function taking an address
+and returning (latitude, longitude) or None, as "module:function".
+"""
+
+import hashlib
+import math
+from importlib import import_module
+
+from flask import current_app
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Characters stored per listing; precision 9 cells are about 5m across.
+PRECISION = 9
+
+# Most cells used to cover a bounding box, before merging into ranges.
+MAX_CELLS = 32
+
+EARTH_RADIUS_MILES = 3958.8
+
+
+def _cell_size(precision):
+    """Returns (height, width) in degrees of cells of precision."""
+
+    bits = 5 * precision
+    return 180 / 2 ** (bits // 2), 360 / 2 ** (bits - bits // 2)
+
+
+def _geohash_of_cell(lat_index, lon_index, precision):
+    """Returns geohash of the cell at grid indexes at precision."""
+
+    bits = 5 * precision
+    lat_bits = bits // 2
+    lon_bits = bits - lat_bits
+
+    code = 0
+    for bit in range(bits):
+        # Bits alternate longitude, latitude, most significant first.
+        if bit % 2 == 0:
+            lon_bits -= 1
+            code = code << 1 | (lon_index >> lon_bits) & 1
+        else:
+            lat_bits -= 1
+            code = code << 1 | (lat_index >> lat_bits) & 1
+
+    return ''.join(
+        BASE32[(code >> shift) & 31] for shift in range(bits - 5, -1, -5))
+
+
+def _cell_index(latitude, longitude, precision):
+    height, width = _cell_size(precision)
+    rows = round(180 / height)
+    columns = round(360 / width)
+    return (
+        min(int((latitude + 90) / height), rows - 1),
+        min(int((longitude + 180) / width), columns - 1),
+    )
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Returns geohash of point."""
+
+    return _geohash_of_cell(*_cell_index(latitude, longitude, precision), precision)
+
+
+def successor(geohash):
+    """Returns the first geohash after every geohash starting with geohash,
+    or None if there is none.
+    """
+
+    stripped = geohash.rstrip(BASE32[-1])
+    if not stripped:
+        return None
+    return stripped[:-1] + BASE32[BASE32.index(stripped[-1]) + 1]
+
+
+def bbox_cells(south, west, north, east, max_cells=MAX_CELLS):
+    """Returns geohashes of the smallest cells, at most max_cells of them,
+    covering bounding box. Boxes crossing the antimeridian have west > east.
+    """
+
+    if west > east:
+        return (bbox_cells(south, west, north, 180, max_cells // 2)
+                + bbox_cells(south, -180, north, east, max_cells // 2))
+
+    for precision in range(PRECISION, 0, -1):
+        (south_row, west_column) = _cell_index(south, west, precision)
+        (north_row, east_column) = _cell_index(north, east, precision)
+        count = (north_row - south_row + 1) * (east_column - west_column + 1)
+        if count <= max_cells or precision == 1:
+            return [
+                _geohash_of_cell(row, column, precision)
+                for row in range(south_row, north_row + 1)
+                for column in range(west_column, east_column + 1)
+            ]
+
+
+def bbox_ranges(south, west, north, east, max_cells=MAX_CELLS):
+    """Returns [(low, high), ...] geohash ranges covering bounding box, where
+    a point is in range if low <= geohash < high (high None is unbounded).
+    """
+
+    ranges = []
+    for cell in sorted(set(bbox_cells(south, west, north, east, max_cells))):
+        high = successor(cell)
+        if ranges and ranges[-1][1] == cell:
+            ranges[-1] = (ranges[-1][0], high)
+        else:
+            ranges.append((cell, high))
+    return ranges
+
+
+def radius_bbox(latitude, longitude, miles):
+    """Returns (south, west, north, east) bounding the circle of radius miles
+    around point.
+    """
+
+    lat_delta = math.degrees(miles / EARTH_RADIUS_MILES)
+    south = max(-90.0, latitude - lat_delta)
+    north = min(90.0, latitude + lat_delta)
+
+    cos_lat = math.cos(math.radians(max(abs(south), abs(north))))
+    if cos_lat < 1e-9 or lat_delta / cos_lat >= 180:
+        return south, -180.0, north, 180.0
+
+    lon_delta = lat_delta / cos_lat
+    west = (longitude - lon_delta + 540) % 360 - 180
+    east = (longitude + lon_delta + 540) % 360 - 180
+    return south, west, north, east
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """Returns great circle distance between two points in miles."""
+
+    if None in (lat1, lon1, lat2, lon2):
+        return None
+
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+
+def load_geocoder(name):
+    """Returns geocoder function named "module:function", or None."""
+
+    if not name:
+        return None
+    module, _, function = name.partition(':')
+    return getattr(import_module(module), function)
+
+
+def geocode(address):
+    """Returns (latitude, longitude) of address from the GEOCODER config's
+    geocoder, or None if there is none or it cannot place address.
+    """
+
+    geocoder = load_geocoder(current_app.config.get('GEOCODER'))
+    return geocoder(address) if geocoder is not None else None
+
+
+def hash_geocoder(address):
+    """Offline geocoder for development and benchmark data: places address at
+    a stable pseudo-random point in the continental US.
+    """
+
+    digest = hashlib.sha256(address.encode('UTF-8')).digest()
+    lat_fraction = int.from_bytes(digest[:8], 'big') / 2 ** 64
+    lon_fraction = int.from_bytes(digest[8:16], 'big') / 2 ** 64
+    return 24.5 + lat_fraction * (49.0 - 24.5), -124.8 + lon_fraction * (-66.9 + 124.8)
@@ -0,0 +1,70 @@
+"""Backfill listing coordinates with the configured geocoder.
+
+Geocodes listings without coordinates (or all of them with --all) in
+batches, committing each batch, and fills in the geohash of listings that
+have coordinates but no geohash, e.g. after writing them outside the ORM
+and importer.py.
+
+    GEOCODER=geo:hash_geocoder python geocode.py
+    python geocode.py --geocoder mypackage.geocoding:lookup --all
+"""
+
+import argparse
+import logging
+
+from sqlalchemy.orm.attributes import flag_modified
+
+from app import app
+from geo import load_geocoder
+from models import Listing, db
+from response_cache import response_cache
+
+parser = argparse.ArgumentParser(description="Backfill listing coordinates.")
+parser.add_argument('--geocoder', help="module:function, instead of GEOCODER config")
+parser.add_argument('--all', action='store_true', help="re-geocode listings that have coordinates")
+parser.add_argument('--batch-size', type=int, default=500)
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('geocode')
+
+with app.app_context():
+    geocoder = load_geocoder(args.geocoder or app.config['GEOCODER'])
+    if geocoder is None:
+        parser.error("no geocoder: set GEOCODER or pass --geocoder")
+
+    if args.all:
+        pending = db.true()
+    else:
+        pending = Listing.latitude.is_(None) | Listing.longitude.is_(None) | Listing.geohash.is_(None)
+
+    last_id = 0
+    located = unlocated = 0
+    while True:
+        batch = (
+            Listing.query
+            .filter(pending, Listing.id > last_id)
+            .order_by(Listing.id)
+            .limit(args.batch_size)
+            .all()
+        )
+        if not batch:
+            break
+
+        for listing in batch:
+            if args.all or listing.latitude is None or listing.longitude is None:
+                location = geocoder(listing.address)
+                if location is None:
+                    unlocated += 1
+                    continue
+                listing.latitude, listing.longitude = location
+            else:
+                # Coordinates loaded without a geohash; flushing derives it.
+                flag_modified(listing, 'latitude')
+            located += 1
+
+        last_id = batch[-1].id
+        db.session.commit()
+        logger.info("Located %s listings, %s unlocated, up to id %s", located, unlocated, last_id)
+
+    response_cache.invalidate('listings')
@@ -1,30 +1,141 @@
+import os
+import re
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
 import boto3, botocore
 from my_secrets import S3_KEY, S3_SECRET
 
 s3 = boto3.client(
    "s3",
    aws_access_key_id=S3_KEY,
-   aws_secret_access_key=S3_SECRET
+   aws_secret_access_key=S3_SECRET,
+   # Point at a local S3 stand-in (moto server, MinIO) for development.
+   endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+)
+
+# Shared by all requests; boto3 clients are safe to use across threads.
+upload_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("S3_UPLOAD_WORKERS", 8)),
+    thread_name_prefix="s3-upload",
 )
 
-def upload_file_to_s3(file, bucket_name, acl="public-read"):
-    """Uploads file to bucket."""
-
-    try:
-        s3.upload_fileobj(
-            file,
-            bucket_name,
-            file.filename,
-            ExtraArgs={
-                "ACL": acl,
-                "ContentType": file.content_type
+# Outcome of uploading one file: urls maps bucket name to url, error is None
+# if every bucket succeeded or a message describing the first failure.
+# retryable is False when trying again cannot help, e.g. the file could not
+# be decoded as an image.
+UploadResult = namedtuple(
+    "UploadResult", ["filename", "urls", "error", "retryable"], defaults=[True])
+
+
+def get_s3_url(bucket_name, key):
+    """Returns public url of key in bucket."""
+
+    return "{}{}".format('http://{}.s3.amazonaws.com/'.format(bucket_name), key)
+
+
+def safe_extension(extension):
+    """Returns extension lowercased if it is a plain one like ".jpg", else
+    an empty string.
+    """
+
+    extension = extension.lower()
+    return extension if re.fullmatch(r"\.[a-z0-9]{1,10}", extension) else ""
+
+
+def upload_bytes_to_s3(data, bucket_name, key, content_type, acl="public-read", client=None):
+    """Uploads bytes to key in bucket. Returns url; raises on failure."""
+
+    (client or s3).upload_fileobj(
+        BytesIO(data),
+        bucket_name,
+        key,
+        ExtraArgs={
+            "ACL": acl,
+            "ContentType": content_type,
+        }
+    )
+
+    return get_s3_url(bucket_name, key)
+
+
+def upload_files_to_s3(files, bucket_names, acl="public-read", client=None, derive=None):
+    """Uploads every file to every bucket concurrently.
+
+    Each file stream is read once. Without derive, the same bytes are sent to
+    all buckets. With derive, derive(data) is run for each file in parallel
+    and must return {bucket_name: (data, content_type, extension)}; each
+    bucket then gets its own variant.
+
+    Keys are generated, never taken from the client's filename, which could
+    overwrite another upload: each file gets a random stem shared by all its
+    buckets, plus the variant's extension.
+
+    Returns list of UploadResult in files order; a file that could not be
+    derived or whose upload failed for any bucket has error set.
+    """
+
+    payloads = [(file.filename, file.content_type, file.read()) for file in files]
+
+    if derive:
+        derived = [upload_pool.submit(derive, data) for filename, content_type, data in payloads]
+    else:
+        derived = [
+            {
+                bucket_name: (data, content_type, os.path.splitext(filename)[1])
+                for bucket_name in bucket_names
             }
-        )
+            for filename, content_type, data in payloads
+        ]
+
+    # Collect every derivative before queuing uploads, so upload tasks never
+    # wait behind derive tasks they depend on.
+    variants_by_file = []
+    for (filename, content_type, data), variants in zip(payloads, derived):
+        try:
+            variants_by_file.append(variants.result() if derive else variants)
+        except Exception as e:
+            variants_by_file.append(e)
+
+    futures = []
+    for (filename, content_type, data), variants in zip(payloads, variants_by_file):
+        if isinstance(variants, Exception):
+            futures.append(variants)
+            continue
+
+        stem = uuid.uuid4().hex
+        futures.append({
+            bucket_name: upload_pool.submit(
+                upload_bytes_to_s3,
+                variants[bucket_name][0],
+                bucket_name,
+                stem + safe_extension(variants[bucket_name][2]),
+                variants[bucket_name][1],
+                acl,
+                client,
+            )
+            for bucket_name in bucket_names
+        })
 
-        return "{}{}".format('http://{}.s3.amazonaws.com/'.format(bucket_name), file.filename)
+    results = []
+    for (filename, content_type, data), by_bucket in zip(payloads, futures):
+        if isinstance(by_bucket, Exception):
+            # Only errors that say so (images.UndecodableImage) are permanent;
+            # anything else, e.g. a missing image library, may pass on retry.
+            results.append(UploadResult(
+                filename, {}, f"Could not process image: {by_bucket}",
+                retryable=getattr(by_bucket, 'retryable', True)))
+            continue
 
+        urls = {}
+        error = None
+        for bucket_name, future in by_bucket.items():
+            try:
+                urls[bucket_name] = future.result()
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                error = error or f"{bucket_name}: {e}"
+        results.append(UploadResult(filename, urls, error))
 
-    except Exception as e:
-        # This is a catch all exception, edit this part to fit your needs.
-        print("Something Happened: ", e)
-        return e
\ No newline at end of file
+    return results
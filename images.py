@@ -0,0 +1,61 @@
+"""Resized, recompressed derivatives of uploaded listing photos."""
+
+from collections import namedtuple
+
+class UndecodableImage(ValueError):
+    """Data is not an image ImageMagick can read. Retrying cannot help."""
+
+    retryable = False
+
+
+# One encoded variant of an image, ready to upload.
+Derivative = namedtuple("Derivative", ["data", "content_type", "extension"])
+
+
+def parse_size(size):
+    """Parses "WIDTHxHEIGHT" into (width, height)."""
+
+    width, height = size.lower().split("x")
+    return int(width), int(height)
+
+
+def make_derivatives(data, specs):
+    """Decodes image bytes once and returns {name: Derivative} for each spec.
+
+    specs is {name: {"size": "WIDTHxHEIGHT", "quality": 1-100}}. Each variant
+    is auto-oriented, shrunk to fit within size keeping its aspect ratio
+    (never enlarged), stripped of metadata, flattened onto white and encoded
+    as progressive JPEG.
+
+    Raises UndecodableImage if data is corrupt or in an unsupported format.
+    """
+
+    # Imported here, not at module level, so the app runs without the
+    # MagickWand library when photos are processed elsewhere (worker.py).
+    from wand.exceptions import CorruptImageError, MissingDelegateError
+    from wand.image import Image
+
+    derivatives = {}
+
+    try:
+        original = Image(blob=data)
+    except (CorruptImageError, MissingDelegateError) as error:
+        raise UndecodableImage(str(error)) from error
+
+    with original:
+        original.auto_orient()
+
+        for name, spec in specs.items():
+            width, height = parse_size(spec["size"])
+
+            with original.clone() as image:
+                image.transform(resize=f"{width}x{height}>")
+                image.strip()
+                image.background_color = "white"
+                image.alpha_channel = "remove"
+                image.format = "jpeg"
+                image.interlace_scheme = "plane"
+                image.compression_quality = spec["quality"]
+                derivatives[name] = Derivative(image.make_blob(), "image/jpeg", ".jpg")
+
+    return derivatives
@@ -0,0 +1,360 @@
+"""Bulk import of CSV files into the database.
+
+Each CSV is named after its table (users.csv, listings.csv, ...), or is one
+of the part-*.csv files in a directory named after it, as written by
+generator/create_csvs.py for large tables. Files have a header row of
+column names. Files are streamed, never held in memory: on
+Postgres with COPY FROM STDIN, elsewhere (SQLite) with executemany in
+chunks of --chunk-size rows. Each table loads in its own transaction, free
+of DB_STATEMENT_TIMEOUT.
+
+Modes:
+    replace   drop and recreate the schema, then load (what seed.py does)
+    append    insert rows into the existing tables
+    upsert    insert rows, updating existing ones with the same key: id if
+              the CSV has an id column, username for users
+
+In replace mode (or with --defer-indexes) a table's secondary indexes, and
+on Postgres its foreign keys, are dropped before loading it and recreated
+afterwards, which is much faster than maintaining them row by row. Tables
+are analyzed after loading, and listing cards rebuilt if their source
+tables were loaded. Loading listing coordinates derives their geohashes, as
+set_geohash does for ORM writes. Rows with the wrong number of columns are
+rejected with CSVImportError.
+
+    python importer.py                              # replace, all of generator/
+    python importer.py --mode append --dir exports messages
+"""
+
+import argparse
+import csv
+import logging
+import os
+import time
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import Boolean, DateTime, Integer, bindparam, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import geo
+from models import ListingCard, db
+from pooling import lift_statement_timeout
+
+logger = logging.getLogger(__name__)
+
+# In foreign key order.
+TABLES = ('users', 'listings', 'listing_photos', 'messages')
+
+MODES = ('replace', 'append', 'upsert')
+
+# Natural keys to upsert on when a CSV has no id column.
+UPSERT_KEYS = {'users': 'username'}
+
+
+class CSVImportError(ValueError):
+    """CSV does not fit its table."""
+
+
+def read_header(file):
+    """Returns column names from file's header row, leaving file positioned
+    at the first data row.
+    """
+
+    return next(csv.reader([file.readline()]))
+
+
+def converters(table, columns):
+    """Returns functions converting CSV strings to values for columns."""
+
+    def convert(column):
+        nullable = column.nullable
+
+        if isinstance(column.type, Integer):
+            parse = int
+        elif isinstance(column.type, DateTime):
+            parse = datetime.fromisoformat
+        elif isinstance(column.type, Boolean):
+            parse = lambda value: value.lower() in ('1', 't', 'true')  # noqa: E731
+        else:
+            return (lambda value: value or None) if nullable else (lambda value: value)
+
+        return lambda value: parse(value) if value != '' else None
+
+    return [convert(table.c[name]) for name in columns]
+
+
+def upsert_key(table, columns):
+    key = 'id' if 'id' in columns else UPSERT_KEYS.get(table.name)
+    if key is None or key not in columns:
+        alternative = f" or {UPSERT_KEYS[table.name]}" if table.name in UPSERT_KEYS else ""
+        raise CSVImportError(f"{table.name}: upsert needs an id column{alternative}")
+    return key
+
+
+def copy_postgres(connection, table, columns, file, mode):
+    """Streams file's rows into table with COPY. Raises CSVImportError if
+    Postgres rejects a row, e.g. one with the wrong number of columns.
+    """
+
+    try:
+        return _copy_postgres(connection, table, columns, file, mode)
+    except connection.dialect.dbapi.DataError as error:
+        raise CSVImportError(f"{file.name}: {str(error).strip()}") from error
+
+
+def _copy_postgres(connection, table, columns, file, mode):
+    cursor = connection.connection.cursor()
+    column_list = ', '.join(f'"{name}"' for name in columns)
+
+    if mode != 'upsert':
+        cursor.copy_expert(
+            f'COPY "{table.name}" ({column_list}) FROM STDIN WITH (FORMAT csv)', file)
+        return cursor.rowcount
+
+    key = upsert_key(table, columns)
+    staging = f'import_{table.name}'
+    cursor.execute(
+        f'CREATE TEMP TABLE "{staging}" (LIKE "{table.name}" INCLUDING DEFAULTS) ON COMMIT DROP')
+    cursor.copy_expert(f'COPY "{staging}" ({column_list}) FROM STDIN WITH (FORMAT csv)', file)
+    updates = ', '.join(f'"{name}" = EXCLUDED."{name}"' for name in columns if name != key)
+    cursor.execute(
+        f'INSERT INTO "{table.name}" ({column_list}) SELECT {column_list} FROM "{staging}" '
+        f'ON CONFLICT ("{key}") DO '
+        + (f'UPDATE SET {updates}' if updates else 'NOTHING'))
+    loaded = cursor.rowcount
+    cursor.execute(f'DROP TABLE "{staging}"')
+    return loaded
+
+
+def checked_rows(file, width):
+    """Yields file's CSV rows, skipping blank lines. Raises CSVImportError on
+    a row without exactly width columns.
+    """
+
+    rows = csv.reader(file)
+    for row in rows:
+        if not row:
+            continue
+        if len(row) != width:
+            # line_num doesn't count the header, read by read_header.
+            raise CSVImportError(
+                f"{file.name}, line {rows.line_num + 1}: "
+                f"expected {width} columns, got {len(row)}")
+        yield row
+
+
+def fill_geohashes(connection, table, batch_size=10000):
+    """Derives the geohash of every listing with coordinates, in batches by
+    id. Returns listings updated.
+    """
+
+    update = (
+        table.update()
+        .where(table.c.id == bindparam('listing_id'))
+        .values(geohash=bindparam('listing_geohash'))
+    )
+    located = (
+        select(table.c.id, table.c.latitude, table.c.longitude)
+        .where(table.c.latitude.isnot(None), table.c.longitude.isnot(None))
+        .order_by(table.c.id)
+        .limit(batch_size)
+    )
+
+    last_id = 0
+    updated = 0
+    while True:
+        batch = connection.execute(located.where(table.c.id > last_id)).all()
+        if not batch:
+            return updated
+        connection.execute(update, [
+            {'listing_id': id, 'listing_geohash': geo.encode(latitude, longitude)}
+            for id, latitude, longitude in batch
+        ])
+        updated += len(batch)
+        last_id = batch[-1].id
+
+
+def insert_chunks(connection, table, columns, file, mode, chunk_size):
+    """Inserts file's rows into table with executemany, chunk_size at a time."""
+
+    convert = converters(table, columns)
+    statement = table.insert()
+    if mode == 'upsert':
+        key = upsert_key(table, columns)
+        statement = sqlite_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[key],
+            set_={name: statement.excluded[name] for name in columns if name != key},
+        )
+
+    rows = checked_rows(file, len(columns))
+    loaded = 0
+    while True:
+        chunk = [
+            {name: parse(value) for name, parse, value in zip(columns, convert, row)}
+            for row in islice(rows, chunk_size)
+        ]
+        if not chunk:
+            return loaded
+        connection.execute(statement, chunk)
+        loaded += len(chunk)
+
+
+def drop_deferred(connection, table):
+    """Drops table's secondary indexes, and on Postgres its foreign keys.
+    Returns callables that recreate them.
+    """
+
+    if connection.dialect.name != 'postgresql':
+        indexes = list(table.indexes)
+        for index in indexes:
+            index.drop(connection)
+        return [lambda index=index: index.create(connection) for index in indexes]
+
+    name = table.name
+    indexes = connection.execute(text(
+        "SELECT indexname, indexdef FROM pg_indexes i "
+        "WHERE schemaname = current_schema() AND tablename = :table "
+        "AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname)"
+    ), {'table': name}).all()
+    foreign_keys = connection.execute(text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'"
+    ), {'table': name}).all()
+
+    for constraint, _ in foreign_keys:
+        connection.execute(text(f'ALTER TABLE "{name}" DROP CONSTRAINT "{constraint}"'))
+    for index, _ in indexes:
+        connection.execute(text(f'DROP INDEX "{index}"'))
+
+    statements = (
+        [definition for _, definition in indexes]
+        + [f'ALTER TABLE "{name}" ADD CONSTRAINT "{constraint}" {definition}'
+           for constraint, definition in foreign_keys]
+    )
+    return [lambda statement=statement: connection.execute(text(statement))
+            for statement in statements]
+
+
+def reset_sequence(connection, table):
+    """Moves table's id sequence past ids loaded explicitly, on Postgres."""
+
+    connection.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+        f"COALESCE((SELECT MAX(id) FROM \"{table.name}\"), 0) + 1, false)"))
+
+
+def csv_paths(directory, name):
+    """Returns paths of table name's CSV files in directory."""
+
+    parts = os.path.join(directory, name)
+    if os.path.isdir(parts):
+        return sorted(
+            os.path.join(parts, file) for file in os.listdir(parts)
+            if file.startswith('part-') and file.endswith('.csv')
+        )
+    return [os.path.join(directory, f'{name}.csv')]
+
+
+def import_table(table, paths, mode='append', chunk_size=10000, defer_indexes=False):
+    """Loads CSVs at paths into table in one transaction. Returns rows loaded."""
+
+    postgres = db.engine.dialect.name == 'postgresql'
+    loaded = 0
+
+    with db.engine.begin() as connection:
+        lift_statement_timeout(connection)
+        deferred = drop_deferred(connection, table) if defer_indexes else []
+        loaded_ids = False
+        loaded_coordinates = False
+
+        for path in paths:
+            with open(path, newline='') as file:
+                columns = read_header(file)
+                unknown = set(columns) - set(table.c.keys())
+                if unknown:
+                    raise CSVImportError(
+                        f"{path}: no such columns in {table.name}: {', '.join(sorted(unknown))}")
+
+                if postgres:
+                    loaded += copy_postgres(connection, table, columns, file, mode)
+                else:
+                    loaded += insert_chunks(connection, table, columns, file, mode, chunk_size)
+                loaded_ids = loaded_ids or 'id' in columns
+                loaded_coordinates = loaded_coordinates or bool(
+                    {'latitude', 'longitude'} & set(columns))
+
+        # Loads bypass set_geohash; derive them before ix_listings_geohash
+        # is recreated.
+        if table.name == 'listings' and loaded_coordinates:
+            fill_geohashes(connection, table, chunk_size)
+
+        for recreate in deferred:
+            recreate()
+        if postgres and loaded_ids:
+            reset_sequence(connection, table)
+
+    with db.engine.begin() as connection:
+        lift_statement_timeout(connection)
+        connection.execute(text(f'ANALYZE "{table.name}"'))
+
+    return loaded
+
+
+def import_csvs(directory, tables=TABLES, mode='replace', chunk_size=10000, defer_indexes=None):
+    """Loads directory/<table>.csv, or directory/<table>/part-*.csv, for each
+    of tables, in order. Returns {table: rows loaded}.
+
+    defer_indexes defaults to True in replace mode, when the tables are empty.
+    """
+
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    if defer_indexes is None:
+        defer_indexes = mode == 'replace'
+
+    if mode == 'replace':
+        db.drop_all()
+        db.create_all()
+
+    loaded = {}
+    for name in tables:
+        table = db.metadata.tables[name]
+        start = time.perf_counter()
+        loaded[name] = import_table(
+            table, csv_paths(directory, name), mode, chunk_size, defer_indexes)
+        elapsed = time.perf_counter() - start
+        logger.info("Loaded %s rows into %s in %.1fs (%.0f rows/s)",
+                    loaded[name], name, elapsed, loaded[name] / elapsed if elapsed else 0)
+
+    # Loads bypass the mapper events that maintain listing cards.
+    if {'users', 'listings', 'listing_photos'} & set(tables):
+        start = time.perf_counter()
+        cards = ListingCard.rebuild()
+        logger.info("Rebuilt %s listing cards in %.1fs", cards, time.perf_counter() - start)
+
+    return loaded
+
+
+if __name__ == '__main__':
+    from app import app
+    from response_cache import response_cache
+
+    parser = argparse.ArgumentParser(description="Import CSV files into the database.")
+    parser.add_argument('tables', nargs='*', default=TABLES, help="tables to load, in order")
+    parser.add_argument('--dir', default='generator', help="directory of <table>.csv files")
+    parser.add_argument('--mode', choices=MODES, default='replace')
+    parser.add_argument('--chunk-size', type=int, default=10000, help="rows per executemany")
+    parser.add_argument('--defer-indexes', action='store_true', default=None,
+                        help="rebuild indexes after loading (default in replace mode)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    with app.app_context():
+        try:
+            import_csvs(args.dir, args.tables, args.mode, args.chunk_size, args.defer_indexes)
+        except CSVImportError as error:
+            parser.exit(1, f"{error}\n")
+        response_cache.invalidate('listings', 'users')
@@ -0,0 +1,253 @@
+"""Per-request timing, SQL instrumentation, metrics and profiling.
+
+Every request records its wall time and, through engine cursor events, the
+number and total time of its SQL statements plus the slowest few. These are
+sent back in a Server-Timing header, logged as a warning when the request
+is slower than SLOW_REQUEST_MS, and aggregated per route into Prometheus
+text metrics (see render_metrics). Metrics are per process.
+
+Admins can send "X-Profile: 1" to get a profile of the request instead of
+its body: pyinstrument's if installed (PROFILER "auto" or "pyinstrument"),
+otherwise cProfile's top functions by cumulative time.
+
+Streamed responses are timed until the view returns, not until the last
+chunk is sent.
+"""
+
+import cProfile
+import heapq
+import io
+import pstats
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+# Upper bounds, in seconds, of the request latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RequestStats:
+    """Timing and SQL stats of one request."""
+
+    def __init__(self, keep_statements):
+        self.start = time.perf_counter()
+        self.keep_statements = keep_statements
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.slowest = []
+
+    def record_statement(self, statement, duration):
+        self.sql_count += 1
+        self.sql_time += duration
+        entry = (duration, self.sql_count, statement)
+        if len(self.slowest) < self.keep_statements:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+
+    def slowest_statements(self):
+        """Returns [(duration, statement), ...], slowest first."""
+
+        return [(duration, statement) for duration, _, statement in sorted(self.slowest, reverse=True)]
+
+
+class RouteMetrics:
+    """Latency histogram and SQL totals for one route and method."""
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.statuses = defaultdict(int)
+        self.sql_count = 0
+        self.sql_time = 0.0
+
+    def observe(self, duration, status, sql_count, sql_time):
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if duration <= bound:
+                self.buckets[index] += 1
+        self.count += 1
+        self.total += duration
+        self.statuses[status] += 1
+        self.sql_count += sql_count
+        self.sql_time += sql_time
+
+
+class Instrumentation:
+    """Records request and SQL timings for app.
+
+    Config:
+        SLOW_REQUEST_MS: log requests slower than this, 0 to disable (500)
+        SLOW_STATEMENTS: slowest statements kept per request (3)
+        PROFILER: "auto", "pyinstrument" or "cprofile" ("auto")
+    """
+
+    def __init__(self, app=None, can_profile=None):
+        self.app = None
+        self.can_profile = can_profile or (lambda: False)
+        self.lock = threading.Lock()
+        self.routes = defaultdict(RouteMetrics)
+        self.profile_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, can_profile)
+
+    def init_app(self, app, can_profile=None):
+        """Registers request hooks on app, and cursor hooks on every engine.
+
+        can_profile returns whether the current user may profile requests.
+        """
+
+        app.config.setdefault('SLOW_REQUEST_MS', 500)
+        app.config.setdefault('SLOW_STATEMENTS', 3)
+        app.config.setdefault('PROFILER', 'auto')
+
+        self.app = app
+        if can_profile is not None:
+            self.can_profile = can_profile
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+        # On Engine rather than db.engine, so replica binds are counted too.
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = conn.info['query_start'].pop()
+        stats = g.get('request_stats') if has_request_context() else None
+        if stats is not None:
+            stats.record_statement(statement, time.perf_counter() - start)
+
+    def before_request(self):
+        g.request_stats = RequestStats(self.app.config['SLOW_STATEMENTS'])
+
+        if request.headers.get('X-Profile') == '1' and self.can_profile():
+            # cProfile cannot run in two threads at once; profile one at a time.
+            if self.profile_lock.acquire(blocking=False):
+                g.profiler = self._start_profiler()
+
+    def after_request(self, response):
+        stats = g.pop('request_stats', None)
+        if stats is None:
+            return response
+
+        duration = time.perf_counter() - stats.start
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+
+        with self.lock:
+            self.routes[(route, request.method)].observe(
+                duration, response.status_code, stats.sql_count, stats.sql_time)
+
+        response.headers['Server-Timing'] = (
+            f'app;dur={duration * 1000:.1f}, '
+            f'db;dur={stats.sql_time * 1000:.1f};desc="{stats.sql_count} queries"'
+        )
+
+        slow_ms = self.app.config['SLOW_REQUEST_MS']
+        if slow_ms and duration * 1000 >= slow_ms:
+            self.app.logger.warning(
+                "Slow request %s %s: %.0fms, %d queries in %.0fms; slowest: %s",
+                request.method, request.full_path.rstrip('?'), duration * 1000,
+                stats.sql_count, stats.sql_time * 1000,
+                "; ".join(
+                    f"{statement_duration * 1000:.0f}ms {' '.join(statement.split())[:200]}"
+                    for statement_duration, statement in stats.slowest_statements()
+                ) or "none",
+            )
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            try:
+                report = self._stop_profiler(profiler)
+            finally:
+                self.profile_lock.release()
+            profiled = Response(report, mimetype='text/plain')
+            profiled.headers['X-Profiled-Status'] = str(response.status_code)
+            profiled.headers['Server-Timing'] = response.headers['Server-Timing']
+            return profiled
+
+        return response
+
+    def _start_profiler(self):
+        if pyinstrument is not None and self.app.config['PROFILER'] in ('auto', 'pyinstrument'):
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler
+
+    def _stop_profiler(self, profiler):
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(40)
+            return output.getvalue()
+
+        profiler.stop()
+        return profiler.output_text()
+
+    def render_metrics(self):
+        """Returns metrics in Prometheus text exposition format."""
+
+        lines = [
+            '# HELP sharebnb_request_duration_seconds Request latency by route.',
+            '# TYPE sharebnb_request_duration_seconds histogram',
+        ]
+        with self.lock:
+            routes = sorted(self.routes.items())
+
+            for (route, method), metrics in routes:
+                labels = f'route="{route}",method="{method}"'
+                for bound, count in zip(LATENCY_BUCKETS, metrics.buckets):
+                    lines.append(
+                        f'sharebnb_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(
+                    f'sharebnb_request_duration_seconds_bucket{{{labels},le="+Inf"}} {metrics.count}')
+                lines.append(f'sharebnb_request_duration_seconds_sum{{{labels}}} {metrics.total}')
+                lines.append(f'sharebnb_request_duration_seconds_count{{{labels}}} {metrics.count}')
+
+            lines += [
+                '# HELP sharebnb_requests_total Requests by route and status.',
+                '# TYPE sharebnb_requests_total counter',
+            ]
+            for (route, method), metrics in routes:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append(
+                        f'sharebnb_requests_total{{route="{route}",method="{method}",'
+                        f'status="{status}"}} {count}')
+
+            lines += [
+                '# HELP sharebnb_sql_queries_total SQL statements executed by route.',
+                '# TYPE sharebnb_sql_queries_total counter',
+            ]
+            for (route, method), metrics in routes:
+                lines.append(
+                    f'sharebnb_sql_queries_total{{route="{route}",method="{method}"}} '
+                    f'{metrics.sql_count}')
+
+            lines += [
+                '# HELP sharebnb_sql_duration_seconds_total Time spent in SQL by route.',
+                '# TYPE sharebnb_sql_duration_seconds_total counter',
+            ]
+            for (route, method), metrics in routes:
+                lines.append(
+                    f'sharebnb_sql_duration_seconds_total{{route="{route}",method="{method}"}} '
+                    f'{metrics.sql_time}')
+
+        return '\n'.join(lines) + '\n'
+
+
+instrumentation = Instrumentation()
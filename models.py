@@ -1,21 +1,37 @@
 """ SQLAlchemy models for ShareBnB. """
 
+import sqlite3
+from collections import defaultdict
 from datetime import datetime
+from itertools import islice
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+import geo
+
+from passwords import PasswordHasher
+from pooling import engine_options, lift_statement_timeout
+from replicas import RoutingSQLAlchemy
+
+hasher = PasswordHasher()
+db = RoutingSQLAlchemy()
 
 def connect_db(app):
     """Connect this database to provided Flask app.
 
-    You should call this in your Flask app.
+    You should call this in your Flask app. Pool and statement timeout
+    settings come from DB_* config, see pooling.engine_options.
     """
 
+    app.config.setdefault(
+        'SQLALCHEMY_ENGINE_OPTIONS',
+        engine_options(app.config, app.config['SQLALCHEMY_DATABASE_URI']),
+    )
     db.app = app
     db.init_app(app)
+    hasher.init_app(app)
 
 
 class User(db.Model): 
@@ -23,6 +39,8 @@ class User(db.Model):
 
     __tablename__ = "users"
 
+    SERIALIZED_FIELDS = ("id", "username", "first_name", "last_name", "email", "phone")
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -91,10 +109,11 @@ class User(db.Model):
     def signup(cls, username, email, password, first_name, last_name, phone):
         """Sign up user.
 
-        Hashes password and adds user to system.
+        Hashes password and adds user to system. Raises HashingOverloaded if
+        the password pool is full or the hash times out.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -113,28 +132,48 @@ class User(db.Model):
     def authenticate(cls, username, password):
         """Find user with `username` and `password`.
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made at a different cost than configured,
+        rehashes the password now that we know it. Raises HashingOverloaded if
+        the password pool is full or the hash times out.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
+                    db.session.commit()
                 return user
 
         return False
     
-    def serialize(self): 
-        """Serializes self to dictionary."""
+    def serialize(self, fields=None): 
+        """Serializes self to dictionary. If fields included, only serializes
+        those keys.
+        """
 
-        return {
-            "id": self.id,
-            "username": self.username,
-            "first_name": self.first_name,
-            "last_name": self.last_name,
-            "email": self.email,
-            "phone": self.phone,
-        }
+        fields = fields or self.SERIALIZED_FIELDS
+
+        return {field: getattr(self, field) for field in fields}
+
+    @classmethod
+    def rows(cls, fields=None):
+        """Returns query selecting just the columns for fields, yielding rows
+        instead of User instances. Serialize them with serialize_row.
+        """
+
+        fields = fields or cls.SERIALIZED_FIELDS
+
+        return db.session.query(*[getattr(cls, field) for field in fields])
+
+    @staticmethod
+    def serialize_row(row):
+        """Serializes row from User.rows to the same dictionary as serialize."""
+
+        return dict(row._mapping)
 
 
 class Message(db.Model):
@@ -142,6 +181,24 @@ class Message(db.Model):
 
     __tablename__ = 'messages'
 
+    # Timelines are read as branches (see involving and between), each one
+    # range of one of these indexes already in (timestamp, id) order, so a
+    # page seeks and reads limit rows per branch: a thread is a->b plus b->a
+    # on the first, an inbox is sent on the second plus received on the third.
+    __table_args__ = (
+        db.Index(
+            'ix_messages_from_to_timestamp_id', 'from_user_id', 'to_user_id', 'timestamp', 'id'),
+        db.Index('ix_messages_from_timestamp_id', 'from_user_id', 'timestamp', 'id'),
+        db.Index('ix_messages_to_timestamp_id', 'to_user_id', 'timestamp', 'id'),
+        db.Index(
+            'ix_messages_unread',
+            'to_user_id',
+            'from_user_id',
+            postgresql_where=db.text('read_at IS NULL'),
+            sqlite_where=db.text('read_at IS NULL'),
+        ),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -170,20 +227,147 @@ class Message(db.Model):
         nullable=False,
     )
 
+    read_at = db.Column(
+        db.DateTime,
+        nullable=True,
+    )
+
     def __repr__(self):
         return f"<Message #{self.id}: {self.text} by {self.user_id}>"
 
-    def serialize(self):
+    def serialize(self, users=None):
+        """Serializes message. If users included, takes serialized to_user and
+        from_user from it ({id: serialized user}) instead of loading them.
+        """
+
+        if users is None:
+            to_user = self.to_user.serialize()
+            from_user = self.from_user.serialize()
+        else:
+            to_user = users[self.to_user_id]
+            from_user = users[self.from_user_id]
+
         return {
             'id':self.id,
             'text':self.text,
             'timestamp':self.timestamp,
             'to_user_id':self.to_user_id,
-            'to_user': self.to_user.serialize(),
+            'to_user': to_user,
             'from_user_id':self.from_user_id,
-            'from_user': self.from_user.serialize(),
+            'from_user': from_user,
+            'read_at':self.read_at,
+        }
+
+    @staticmethod
+    def load_users(user_ids):
+        """Returns {id: serialized user} for user_ids, in one query."""
+
+        if not user_ids:
+            return {}
+
+        return {
+            row.id: User.serialize_row(row)
+            for row in User.rows().filter(User.id.in_(user_ids))
         }
 
+    @classmethod
+    def serialize_all(cls, messages):
+        """Serializes messages, loading every participant in one query."""
+
+        users = cls.load_users(
+            {msg.to_user_id for msg in messages} | {msg.from_user_id for msg in messages})
+
+        return [msg.serialize(users) for msg in messages]
+
+    @classmethod
+    def rows(cls):
+        """Returns query selecting just the serialized columns of messages,
+        yielding rows instead of Message instances. Serialize them with
+        serialize_rows.
+        """
+
+        return db.session.query(
+            cls.id, cls.text, cls.timestamp, cls.to_user_id, cls.from_user_id, cls.read_at)
+
+    @classmethod
+    def serialize_rows(cls, rows):
+        """Serializes rows from Message.rows to the same dictionaries as
+        serialize_all, loading every participant in one query.
+        """
+
+        users = cls.load_users(
+            {row.to_user_id for row in rows} | {row.from_user_id for row in rows})
+
+        return [
+            dict(row._mapping, to_user=users[row.to_user_id], from_user=users[row.from_user_id])
+            for row in rows
+        ]
+
+    @classmethod
+    def involving(cls, user_id):
+        """Returns rows queries for messages sent by user and for messages
+        received from others, for pagination.merge_ordered.
+        """
+
+        return [
+            cls.rows().filter(cls.from_user_id == user_id),
+            cls.rows().filter(cls.to_user_id == user_id, cls.from_user_id != user_id),
+        ]
+
+    @classmethod
+    def between(cls, user_id, other_id):
+        """Returns rows queries for messages between two users, one per
+        direction, for pagination.merge_ordered.
+        """
+
+        if user_id == other_id:
+            return [cls.rows().filter(cls.from_user_id == user_id, cls.to_user_id == user_id)]
+
+        return [
+            cls.rows().filter(cls.from_user_id == user_id, cls.to_user_id == other_id),
+            cls.rows().filter(cls.from_user_id == other_id, cls.to_user_id == user_id),
+        ]
+
+    @classmethod
+    def conversations(cls, user_id):
+        """Returns [(last message, counterpart id, unread count), ...] for each
+        user that user has messaged with, most recent conversation first.
+
+        Ranks and counts in SQL with window functions partitioned by
+        counterpart, so only one row per conversation comes back.
+        """
+
+        counterpart_id = db.case(
+            (cls.from_user_id == user_id, cls.to_user_id),
+            else_=cls.from_user_id,
+        )
+        unread = db.case(
+            ((cls.to_user_id == user_id) & cls.read_at.is_(None), 1),
+            else_=0,
+        )
+
+        ranked = (
+            db.session.query(
+                cls.id.label('id'),
+                counterpart_id.label('counterpart_id'),
+                db.func.row_number().over(
+                    partition_by=counterpart_id,
+                    order_by=(cls.timestamp.desc(), cls.id.desc()),
+                ).label('position'),
+                db.func.sum(unread).over(partition_by=counterpart_id).label('unread_count'),
+            )
+            .filter((cls.from_user_id == user_id) | (cls.to_user_id == user_id))
+            .subquery()
+        )
+
+        return (
+            db.session.query(cls, ranked.c.counterpart_id, ranked.c.unread_count)
+            .join(ranked, cls.id == ranked.c.id)
+            .filter(ranked.c.position == 1)
+            .order_by(cls.timestamp.desc(), cls.id.desc())
+            .all()
+        )
+
 
 
 class Listing(db.Model):
@@ -191,6 +375,18 @@ class Listing(db.Model):
 
     __tablename__ = "listings"
 
+    SERIALIZED_FIELDS = (
+        "id", "title", "price", "details", "address", "latitude", "longitude", "host_id", "photos")
+
+    CARD_FIELDS = (
+        "id", "title", "price", "address", "latitude", "longitude", "host_id",
+        "host_name", "cover_photo_url", "photo_count")
+
+    __table_args__ = (
+        db.Index('ix_listings_price', 'price'),
+        db.Index('ix_listings_geohash', 'geohash'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -222,19 +418,239 @@ class Listing(db.Model):
         nullable=False,
     )
 
-    def serialize(self): 
-        """ Serializes class instance to dictionary. """
+    latitude = db.Column(
+        db.Float,
+    )
 
-        return {
-            "id": self.id,
-            "title": self.title,
-            "price": self.price,
-            "details": self.details,
-            "address": self.address,
-            "host_id": self.host_id,
-            "photos": [photo.serialize() for photo in self.photos],
+    longitude = db.Column(
+        db.Float,
+    )
+
+    # Kept in sync with latitude and longitude on flush, see set_geohash.
+    geohash = db.Column(
+        db.String(geo.PRECISION),
+    )
+
+    def serialize(self, fields=None): 
+        """ Serializes class instance to dictionary. If fields included, only
+            serializes those keys; photos are not loaded unless requested.
+        """
+
+        fields = fields or self.SERIALIZED_FIELDS
+
+        serialized = {
+            field: getattr(self, field) for field in fields if field != "photos"
         }
 
+        if "photos" in fields:
+            serialized["photos"] = [photo.serialize() for photo in self.photos]
+
+        return serialized
+
+    @classmethod
+    def rows(cls, fields=None):
+        """Returns query selecting just the columns for fields, yielding rows
+        instead of Listing instances. Serialize them with serialize_rows.
+        """
+
+        fields = fields or cls.SERIALIZED_FIELDS
+
+        return db.session.query(*[getattr(cls, field) for field in fields if field != "photos"])
+
+    @classmethod
+    def serialize_rows(cls, rows, fields=None):
+        """Serializes rows from Listing.rows to the same dictionaries as
+        serialize, loading photos for all of them in one query if requested.
+        """
+
+        fields = fields or cls.SERIALIZED_FIELDS
+        serialized = [dict(row._mapping) for row in rows]
+
+        if "photos" in fields:
+            photos = ListingPhoto.serialize_for([listing["id"] for listing in serialized])
+            for listing in serialized:
+                listing["photos"] = photos.get(listing["id"], [])
+
+        return serialized
+
+    @classmethod
+    def card_rows(cls, fields=None):
+        """Returns query of listing cards, selecting fields (default
+        CARD_FIELDS) from listings and listing_cards: one row per listing and
+        no photo query. Serialize rows with dict(row._mapping).
+        """
+
+        fields = fields or cls.CARD_FIELDS
+
+        return (
+            db.session.query(*[
+                getattr(ListingCard, field) if field in ListingCard.SERIALIZED_FIELDS
+                else getattr(cls, field)
+                for field in fields
+            ])
+            .join(ListingCard, ListingCard.listing_id == cls.id)
+        )
+
+    @classmethod
+    def within_bbox(cls, south, west, north, east):
+        """Returns filter for listings inside bounding box. West > east wraps
+        around the antimeridian.
+
+        Candidates come from a few range scans of ix_listings_geohash; exact
+        coordinates are only checked on those.
+        """
+
+        cells = db.or_(*[
+            (cls.geohash >= low) & (cls.geohash < high) if high else cls.geohash >= low
+            for low, high in geo.bbox_ranges(south, west, north, east)
+        ])
+
+        if west <= east:
+            longitude = cls.longitude.between(west, east)
+        else:
+            longitude = (cls.longitude >= west) | (cls.longitude <= east)
+
+        return cells & cls.latitude.between(south, north) & longitude
+
+    @classmethod
+    def within_radius(cls, latitude, longitude, miles):
+        """Returns filter for listings within miles of point, using the
+        geohash index on the circle's bounding box.
+        """
+
+        return (
+            cls.within_bbox(*geo.radius_bbox(latitude, longitude, miles))
+            & (db.func.haversine_miles(cls.latitude, cls.longitude, latitude, longitude) <= miles)
+        )
+
+    @classmethod
+    def available(cls, start_date, end_date):
+        """Returns filter for listings with no confirmed booking overlapping
+        the nights from start_date up to end_date.
+
+        A correlated NOT EXISTS, so the database anti-joins each candidate
+        listing against ix_bookings_listing_dates in the same query that
+        applies the other filters.
+        """
+
+        return ~db.exists().where(
+            (Booking.listing_id == cls.id) & Booking.overlapping(start_date, end_date)
+        )
+
+    @classmethod
+    def bulk_create(cls, listings, chunk_size=1000):
+        """Creates many listings with their photos. Caller commits, so the
+        whole import is one transaction.
+
+        listings is an iterable of dicts of listing columns, each with an
+        optional photos list of {small_photo_url, large_photo_url}. Listings
+        are flushed chunk_size at a time and photos inserted with a single
+        executemany per chunk, then expunged so memory stays bounded. Listing
+        cards are computed once per chunk.
+
+        Returns list of new listing ids in input order.
+        """
+
+        ids = []
+        listings = iter(listings)
+
+        # Cards of each chunk are computed at once below, not per listing.
+        db.session.info['defer_listing_cards'] = True
+        try:
+            while True:
+                chunk = list(islice(listings, chunk_size))
+                if not chunk:
+                    return ids
+                ids += cls._create_chunk(chunk)
+        finally:
+            db.session.info.pop('defer_listing_cards', None)
+
+    @classmethod
+    def _create_chunk(cls, chunk):
+        new_listings = [
+            cls(**{key: value for key, value in row.items() if key != "photos"})
+            for row in chunk
+        ]
+        db.session.add_all(new_listings)
+        db.session.flush()
+
+        photo_rows = [
+            {
+                "listing_id": listing.id,
+                "small_photo_url": photo["small_photo_url"],
+                "large_photo_url": photo["large_photo_url"],
+            }
+            for listing, row in zip(new_listings, chunk)
+            for photo in row.get("photos", ())
+        ]
+        if photo_rows:
+            db.session.execute(ListingPhoto.__table__.insert(), photo_rows)
+
+        ids = [listing.id for listing in new_listings]
+        ListingCard.refresh(db.session.connection(), ids)
+
+        for listing in new_listings:
+            db.session.expunge(listing)
+        return ids
+
+
+# Weighted full text document for listing search. Queries must use this exact
+# expression for Postgres to match it against ix_listings_search.
+LISTING_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', title), 'A') || "
+    "setweight(to_tsvector('english', address), 'B') || "
+    "setweight(to_tsvector('english', details), 'C')"
+)
+
+event.listen(
+    db.metadata,
+    'before_create',
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect='postgresql'),
+)
+
+@event.listens_for(Listing, 'before_insert')
+@event.listens_for(Listing, 'before_update')
+def set_geohash(mapper, connection, listing):
+    """Derives listing's geohash from its coordinates."""
+
+    if listing.latitude is None or listing.longitude is None:
+        listing.geohash = None
+    else:
+        listing.geohash = geo.encode(listing.latitude, listing.longitude)
+
+@event.listens_for(Engine, 'connect')
+def register_sqlite_functions(dbapi_connection, connection_record):
+    """Adds the SQL functions defined on Postgres below to SQLite connections."""
+
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function(
+            'haversine_miles', 4, geo.haversine_miles, deterministic=True)
+
+event.listen(
+    Listing.__table__,
+    'after_create',
+    DDL(
+        "CREATE OR REPLACE FUNCTION haversine_miles("
+        "lat1 float8, lon1 float8, lat2 float8, lon2 float8) RETURNS float8 "
+        "LANGUAGE sql IMMUTABLE AS $$ "
+        "SELECT 2 * %(radius)s * asin(least(1, sqrt("
+        "sin(radians(lat2 - lat1) / 2) ^ 2 "
+        "+ cos(radians(lat1)) * cos(radians(lat2)) * sin(radians(lon2 - lon1) / 2) ^ 2))) $$"
+        % {'radius': geo.EARTH_RADIUS_MILES}
+    ).execute_if(dialect='postgresql'),
+)
+
+for ddl in (
+    f"CREATE INDEX ix_listings_search ON listings USING gin (({LISTING_SEARCH_VECTOR}))",
+    "CREATE INDEX ix_listings_title_trgm ON listings USING gin (title gin_trgm_ops)",
+    "CREATE INDEX ix_listings_address_trgm ON listings USING gin (address gin_trgm_ops)",
+):
+    event.listen(
+        Listing.__table__,
+        'after_create',
+        DDL(ddl).execute_if(dialect='postgresql'),
+    )
+
 
 
 
@@ -249,10 +665,17 @@ class ListingPhoto(db.Model):
         nullable=False,
     )
 
-    listing_id = db.Column(
-        db.Integer, 
-        db.ForeignKey('listings.id', ondelete='CASCADE'),
-        nullable=False,
+    # Indexed for the per-listing photo lookups of serialize_for and cards.
+    # Active history loads the old value before a change, even once expired,
+    # so refresh_card_photos can refresh the card of the listing it left.
+    listing_id = db.column_property(
+        db.Column(
+            db.Integer,
+            db.ForeignKey('listings.id', ondelete='CASCADE'),
+            nullable=False,
+            index=True,
+        ),
+        active_history=True,
     )
 
     small_photo_url = db.Column(
@@ -279,4 +702,478 @@ class ListingPhoto(db.Model):
             "listing_id": self.listing_id,
             "small_photo_url": self.small_photo_url,
             "large_photo_url": self.large_photo_url,
-        }
\ No newline at end of file
+        }
+
+    @classmethod
+    def serialize_for(cls, listing_ids):
+        """Returns {listing_id: [serialized photo, ...]} for listing_ids,
+        selecting just the serialized columns in one query.
+        """
+
+        photos = defaultdict(list)
+        if not listing_ids:
+            return photos
+
+        rows = (
+            db.session.query(cls.id, cls.listing_id, cls.small_photo_url, cls.large_photo_url)
+            .filter(cls.listing_id.in_(listing_ids))
+            .order_by(cls.id)
+        )
+        for row in rows:
+            photos[row.listing_id].append(dict(row._mapping))
+
+        return photos
+
+
+class ListingCard(db.Model):
+    """Denormalized summary of a listing for feeds and search results: its
+    cover photo, photo count and host's name, so a card is one narrow row
+    instead of a join to listing_photos and users.
+
+    Kept up to date incrementally by the mapper events below when listings,
+    photos or hosts change through the ORM. Writes that bypass the ORM
+    (bulk_create's photos, importer.py, COPY) call refresh or rebuild
+    afterwards; cards.py rebuilds and checks the table.
+    """
+
+    __tablename__ = "listing_cards"
+
+    SERIALIZED_FIELDS = ("cover_photo_url", "photo_count", "host_name")
+
+    listing_id = db.Column(
+        db.Integer,
+        db.ForeignKey('listings.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    # small_photo_url of the listing's first photo, by id.
+    cover_photo_url = db.Column(
+        db.Text,
+    )
+
+    photo_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    host_name = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    @classmethod
+    def computed(cls):
+        """Returns select of (listing_id, cover_photo_url, photo_count,
+        host_name) for every listing, computed from the source tables.
+        """
+
+        photos = ListingPhoto.__table__
+        cover = (
+            db.select(photos.c.small_photo_url)
+            .where(photos.c.listing_id == Listing.id)
+            .order_by(photos.c.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        count = (
+            db.select(db.func.count())
+            .where(photos.c.listing_id == Listing.id)
+            .scalar_subquery()
+        )
+
+        return (
+            db.select(
+                Listing.id.label('listing_id'),
+                cover.label('cover_photo_url'),
+                count.label('photo_count'),
+                (User.first_name + ' ' + User.last_name).label('host_name'),
+            )
+            .select_from(Listing.__table__.join(User.__table__, User.id == Listing.host_id))
+        )
+
+    @classmethod
+    def refresh(cls, connection, listing_ids=None):
+        """Recomputes cards of listing_ids, or of every listing if None, with
+        one DELETE and one INSERT ... SELECT on connection.
+        """
+
+        table = cls.__table__
+        delete = table.delete()
+        computed = cls.computed()
+
+        if listing_ids is not None:
+            listing_ids = list(listing_ids)
+            if not listing_ids:
+                return
+            delete = delete.where(table.c.listing_id.in_(listing_ids))
+            computed = computed.where(Listing.id.in_(listing_ids))
+
+        connection.execute(delete)
+        connection.execute(table.insert().from_select(
+            ['listing_id', 'cover_photo_url', 'photo_count', 'host_name'], computed))
+
+    @classmethod
+    def rebuild(cls):
+        """Recomputes every card in its own transaction, free of
+        DB_STATEMENT_TIMEOUT. Returns card count.
+        """
+
+        with db.engine.begin() as connection:
+            lift_statement_timeout(connection)
+            cls.refresh(connection)
+            return connection.execute(db.select(db.func.count()).select_from(cls.__table__)).scalar()
+
+    @classmethod
+    def stale(cls, connection):
+        """Returns ids of listings whose card is missing or differs from its
+        computed value, and of cards without a listing.
+        """
+
+        table = cls.__table__
+        computed = cls.computed().subquery()
+
+        differs = (
+            db.select(computed.c.listing_id)
+            .select_from(computed.outerjoin(table, table.c.listing_id == computed.c.listing_id))
+            .where(
+                table.c.listing_id.is_(None)
+                | table.c.photo_count.is_distinct_from(computed.c.photo_count)
+                | table.c.cover_photo_url.is_distinct_from(computed.c.cover_photo_url)
+                | table.c.host_name.is_distinct_from(computed.c.host_name)
+            )
+        )
+        orphaned = (
+            db.select(table.c.listing_id)
+            .where(~db.exists().where(computed.c.listing_id == table.c.listing_id))
+        )
+
+        return sorted(
+            connection.execute(differs).scalars().all()
+            + connection.execute(orphaned).scalars().all()
+        )
+
+
+@event.listens_for(Listing, 'after_insert')
+def create_listing_card(mapper, connection, listing):
+    if not inspect(listing).session.info.get('defer_listing_cards'):
+        ListingCard.refresh(connection, [listing.id])
+
+
+@event.listens_for(Listing, 'after_update')
+def move_listing_card(mapper, connection, listing):
+    if inspect(listing).attrs.host_id.history.has_changes():
+        ListingCard.refresh(connection, [listing.id])
+
+
+@event.listens_for(Listing, 'after_delete')
+def delete_listing_card(mapper, connection, listing):
+    # Postgres cascades this itself; SQLite doesn't enforce foreign keys.
+    ListingCard.refresh(connection, [listing.id])
+
+
+@event.listens_for(ListingPhoto, 'after_insert')
+def add_card_photo(mapper, connection, photo):
+    # New photos have the highest id, so only a listing without photos gets
+    # a new cover.
+    table = ListingCard.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.listing_id == photo.listing_id)
+        .values(
+            photo_count=table.c.photo_count + 1,
+            cover_photo_url=db.func.coalesce(table.c.cover_photo_url, photo.small_photo_url),
+        )
+    )
+
+
+@event.listens_for(ListingPhoto, 'after_update')
+@event.listens_for(ListingPhoto, 'after_delete')
+def refresh_card_photos(mapper, connection, photo):
+    history = inspect(photo).attrs.listing_id.history
+    ListingCard.refresh(connection, {photo.listing_id, *history.deleted})
+
+
+@event.listens_for(User, 'after_update')
+def rename_host_cards(mapper, connection, user):
+    state = inspect(user)
+    if state.attrs.first_name.history.has_changes() or state.attrs.last_name.history.has_changes():
+        listing_ids = connection.execute(
+            db.select(Listing.id).where(Listing.host_id == user.id)).scalars().all()
+        ListingCard.refresh(connection, listing_ids)
+
+class PhotoJob(db.Model):
+    """A queued upload of one listing photo, processed by worker.py."""
+
+    __tablename__ = "photo_jobs"
+
+    __table_args__ = (
+        db.Index('ix_photo_jobs_status_run_after', 'status', 'run_after'),
+    )
+
+    PENDING = "pending"
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    listing_id = db.Column(
+        db.Integer,
+        db.ForeignKey('listings.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True,
+    )
+
+    # listing id plus hash of photo bytes, so the same photo is only ever
+    # queued once per listing.
+    idempotency_key = db.Column(
+        db.Text,
+        nullable=False,
+        unique=True,
+    )
+
+    filename = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    content_type = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # Original upload, cleared once processed. Deferred so status queries
+    # don't load it.
+    data = db.deferred(db.Column(
+        db.LargeBinary,
+        nullable=True,
+    ))
+
+    status = db.Column(
+        db.Text,
+        nullable=False,
+        default=PENDING,
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    last_error = db.Column(
+        db.Text,
+        nullable=True,
+    )
+
+    run_after = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    locked_at = db.Column(
+        db.DateTime,
+        nullable=True,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    @classmethod
+    def summarize(cls, listing_id):
+        """Returns photo processing status of listing:
+
+            {status, pending, failed}
+
+        where status is "pending" while any job is queued or running, else
+        "failed" if any job gave up, else "ready".
+        """
+
+        counts = dict(
+            db.session.query(cls.status, db.func.count())
+            .filter(cls.listing_id == listing_id)
+            .group_by(cls.status)
+        )
+        pending = counts.get(cls.PENDING, 0) + counts.get(cls.PROCESSING, 0)
+        failed = counts.get(cls.FAILED, 0)
+
+        if pending:
+            status = "pending"
+        elif failed:
+            status = "failed"
+        else:
+            status = "ready"
+
+        return {"status": status, "pending": pending, "failed": failed}
+
+
+class BookingConflict(Exception):
+    """Requested dates overlap a confirmed booking of the listing."""
+
+
+class Booking(db.Model):
+    """A guest's reservation of a listing for a range of nights.
+
+    end_date is exclusive (the checkout day), so back to back bookings
+    don't overlap. Confirmed bookings of a listing never overlap: reserve
+    locks the listing row while checking, and on Postgres the
+    bookings_no_overlap exclusion constraint below enforces it as well.
+    """
+
+    __tablename__ = "bookings"
+
+    # Serves both the overlap check in reserve and the NOT EXISTS of
+    # Listing.available: one range scan per listing over its confirmed
+    # bookings, in date order.
+    __table_args__ = (
+        db.Index(
+            'ix_bookings_listing_dates',
+            'listing_id',
+            'start_date',
+            'end_date',
+            postgresql_where=db.text("status = 'confirmed'"),
+            sqlite_where=db.text("status = 'confirmed'"),
+        ),
+        db.Index('ix_bookings_guest', 'guest_id', 'id'),
+        db.CheckConstraint('start_date < end_date', name='ck_bookings_dates'),
+    )
+
+    CONFIRMED = "confirmed"
+    CANCELLED = "cancelled"
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    listing_id = db.Column(
+        db.Integer,
+        db.ForeignKey('listings.id', ondelete='CASCADE'),
+        nullable=False,
+    )
+
+    guest_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+    )
+
+    start_date = db.Column(
+        db.Date,
+        nullable=False,
+    )
+
+    end_date = db.Column(
+        db.Date,
+        nullable=False,
+    )
+
+    status = db.Column(
+        db.Text,
+        nullable=False,
+        default=CONFIRMED,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    listing = db.relationship('Listing')
+
+    def serialize(self):
+        """ Serializes class instance to dictionary, dates as YYYY-MM-DD. """
+
+        return {
+            "id": self.id,
+            "listing_id": self.listing_id,
+            "guest_id": self.guest_id,
+            "start_date": self.start_date.isoformat(),
+            "end_date": self.end_date.isoformat(),
+            "status": self.status,
+        }
+
+    @classmethod
+    def overlapping(cls, start_date, end_date):
+        """Returns filter for confirmed bookings overlapping the nights from
+        start_date up to end_date.
+        """
+
+        return (
+            (cls.status == cls.CONFIRMED)
+            & (cls.start_date < end_date)
+            & (cls.end_date > start_date)
+        )
+
+    @classmethod
+    def reserve(cls, listing_id, guest_id, start_date, end_date):
+        """Adds confirmed booking to the session and flushes it. Caller
+        commits, which releases the listing lock.
+
+        Raises BookingConflict if the dates overlap a confirmed booking.
+        """
+
+        # Serializes reservations of this listing on Postgres, so the check
+        # below sees any booking committed before ours. SQLite ignores FOR
+        # UPDATE; there only the check guards against overlaps.
+        db.session.query(Listing.id).filter(Listing.id == listing_id).with_for_update().one()
+
+        conflict = db.session.query(
+            db.exists().where(cls.overlapping(start_date, end_date) & (cls.listing_id == listing_id))
+        ).scalar()
+        if conflict:
+            raise BookingConflict()
+
+        booking = cls(
+            listing_id=listing_id,
+            guest_id=guest_id,
+            start_date=start_date,
+            end_date=end_date,
+        )
+        db.session.add(booking)
+        try:
+            db.session.flush()
+        except IntegrityError as error:
+            if 'bookings_no_overlap' in str(error.orig):
+                raise BookingConflict() from error
+            raise
+        return booking
+
+    @classmethod
+    def calendar(cls, listing_id, start_date, end_date):
+        """Returns [(start_date, end_date), ...] of listing's confirmed
+        bookings overlapping the range, in date order.
+        """
+
+        return (
+            db.session.query(cls.start_date, cls.end_date)
+            .filter(cls.listing_id == listing_id, cls.overlapping(start_date, end_date))
+            .order_by(cls.start_date)
+            .all()
+        )
+
+
+event.listen(
+    db.metadata,
+    'before_create',
+    DDL("CREATE EXTENSION IF NOT EXISTS btree_gist").execute_if(dialect='postgresql'),
+)
+
+event.listen(
+    Booking.__table__,
+    'after_create',
+    DDL(
+        "ALTER TABLE bookings ADD CONSTRAINT bookings_no_overlap "
+        "EXCLUDE USING gist (listing_id WITH =, daterange(start_date, end_date) WITH &&) "
+        "WHERE (status = 'confirmed')"
+    ).execute_if(dialect='postgresql'),
+)
@@ -0,0 +1,231 @@
+"""Keyset pagination and field projection helpers for collection routes."""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from flask import current_app, request
+from sqlalchemy import select, tuple_, union_all
+
+
+def get_page_args(stream=False):
+    """Reads limit and cursor from the query string.
+
+    Returns (limit, cursor). limit defaults to PAGE_SIZE config and is capped
+    at MAX_PAGE_SIZE; if stream, it is uncapped and None unless included.
+    cursor is the id of the last row on the previous page, or None for the
+    first page. Raises ValueError if either is malformed.
+    """
+
+    limit = request.args.get('limit')
+    if limit is not None or not stream:
+        try:
+            limit = int(limit or current_app.config['PAGE_SIZE'])
+        except ValueError:
+            raise ValueError('limit must be a positive integer')
+        if limit < 1:
+            raise ValueError('limit must be a positive integer')
+        if not stream:
+            limit = min(limit, current_app.config['MAX_PAGE_SIZE'])
+
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        try:
+            cursor = int(cursor)
+        except ValueError:
+            raise ValueError('Invalid cursor')
+
+    return limit, cursor
+
+
+def get_fields(allowed):
+    """Reads comma separated `fields` from the query string.
+
+    Returns None if not included, meaning every field. Otherwise returns list
+    of requested fields, always starting with id. Raises ValueError on fields
+    not in allowed.
+    """
+
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    return ['id'] + [field for field in requested if field != 'id']
+
+
+def keyset_page(query, column, limit, cursor=None):
+    """Returns (rows, next_cursor) for one page of query ordered by column.
+
+    Seeks past cursor with WHERE column > cursor instead of OFFSET, so every
+    page costs one index range scan of limit + 1 rows no matter how deep it
+    is. next_cursor is None on the last page.
+    """
+
+    if cursor is not None:
+        query = query.filter(column > cursor)
+
+    rows = query.order_by(column).limit(limit + 1).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, getattr(rows[-1], column.key)
+
+    return rows, None
+
+
+def keyset_stream(query, column, cursor=None, limit=None, batch_size=1000):
+    """Returns query for every row after cursor (or the first limit of them)
+    ordered by column, fetched from the database batch_size rows at a time.
+    """
+
+    if cursor is not None:
+        query = query.filter(column > cursor)
+
+    query = query.order_by(column)
+    if limit is not None:
+        query = query.limit(limit)
+
+    return query.yield_per(batch_size)
+
+
+def encode_timeline_cursor(timestamp, id):
+    """Returns opaque cursor for the (timestamp, id) position of a row."""
+
+    position = f"{timestamp.isoformat()}|{id}"
+    return urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_timeline_cursor(cursor):
+    """Returns (timestamp, id) from cursor. Raises ValueError if malformed."""
+
+    try:
+        timestamp, id = urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+
+def get_timeline_args(stream=False):
+    """Reads limit, before, after and since from the query string. limit is
+    as for get_page_args.
+
+    Returns (limit, before, after, since) where before is a decoded
+    (timestamp, id) cursor, after is an id and since is a datetime, each
+    None if not included. Raises ValueError if malformed or more than one of
+    before, after and since is included.
+    """
+
+    limit, _ = get_page_args(stream)
+
+    before = request.args.get('before')
+    after = request.args.get('after')
+    since = request.args.get('since')
+
+    if sum(arg is not None for arg in (before, after, since)) > 1:
+        raise ValueError('Only one of before, after and since is allowed')
+
+    if before is not None:
+        before = decode_timeline_cursor(before)
+    if after is not None:
+        try:
+            after = int(after)
+        except ValueError:
+            # (timestamp, id) cursors from before after_cursor was an id.
+            after = decode_timeline_cursor(after)[1]
+    if since is not None:
+        try:
+            since = datetime.fromisoformat(since)
+        except ValueError:
+            raise ValueError('since must be an ISO 8601 timestamp')
+
+    return limit, before, after, since
+
+
+def merge_ordered(queries, columns, limit=None, descending=False):
+    """Returns query of the first limit rows of queries combined, ordered by
+    columns (ascending unless descending). queries is a query or a list of
+    queries over disjoint rows, each of which an index returns in that order.
+
+    Each branch is ordered and limited on its own, so each is one index
+    range scan of at most limit rows, and only those are merged; sorting
+    the OR of the branches would read all their rows instead.
+    """
+
+    def ordering(columns):
+        return [column.desc() if descending else column for column in columns]
+
+    if not isinstance(queries, (list, tuple)):
+        queries = [queries]
+
+    if len(queries) == 1:
+        query = queries[0].order_by(*ordering(columns))
+        return query.limit(limit) if limit is not None else query
+
+    branches = []
+    for query in queries:
+        query = query.order_by(*ordering(columns))
+        if limit is not None:
+            query = query.limit(limit)
+        branches.append(select(query.subquery()))
+
+    merged = union_all(*branches).subquery()
+    query = queries[0].session.query(merged).order_by(
+        *ordering([merged.c[column.key] for column in columns]))
+    return query.limit(limit) if limit is not None else query
+
+
+def timeline_page(query, timestamp_column, id_column, limit, before=None, after=None, since=None):
+    """Returns one page of query, oldest first, as a dict:
+
+        {rows, before_cursor, after_cursor}
+
+    query may be a list of queries over disjoint rows, as for merge_ordered.
+
+    With after, the page is the first limit rows with ids above it, in id
+    order; with since, the first limit rows newer than it, in id order too.
+    Otherwise it is the newest limit rows, older than before if given,
+    seeking on (timestamp, id) rather than OFFSET.
+
+    before_cursor fetches the page of older rows, or is None when paging
+    backwards reached the oldest row. after_cursor fetches newer rows, for
+    polling; it is the highest id returned, else the after id passed in,
+    else None. Polling by id rather than timestamp doesn't skip a row whose
+    timestamp is older than the cursor's, as one stamped by an app server
+    with a slow clock or committed late would be; ids come from one
+    database sequence as rows are inserted.
+    """
+
+    position = tuple_(timestamp_column, id_column)
+    columns = (timestamp_column, id_column)
+    queries = query if isinstance(query, (list, tuple)) else [query]
+
+    if after is not None or since is not None:
+        if after is not None:
+            queries = [query.filter(id_column > after) for query in queries]
+        else:
+            queries = [query.filter(timestamp_column > since) for query in queries]
+        rows = merge_ordered(queries, (id_column,), limit).all()
+        has_older = True
+    else:
+        if before is not None:
+            queries = [query.filter(position < tuple_(*before)) for query in queries]
+        rows = merge_ordered(queries, columns, limit + 1, descending=True).all()
+        has_older = len(rows) > limit
+        rows = rows[:limit][::-1]
+
+    def position_of(row):
+        return getattr(row, timestamp_column.key), getattr(row, id_column.key)
+
+    if rows:
+        oldest = min(position_of(row) for row in rows)
+        before_cursor = encode_timeline_cursor(*oldest) if has_older else None
+        after_cursor = max(getattr(row, id_column.key) for row in rows)
+    else:
+        before_cursor = None
+        after_cursor = after
+
+    return {'rows': rows, 'before_cursor': before_cursor, 'after_cursor': after_cursor}
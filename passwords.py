@@ -0,0 +1,114 @@
+"""Password hashing and verification on a bounded worker pool.
+
+bcrypt is deliberately slow, so hashing on the request thread lets a burst of
+logins stall every other route. PasswordHasher runs it on a thread (bcrypt
+releases the GIL) or process pool instead, and refuses new work with
+HashingOverloaded once PASSWORD_QUEUE_LIMIT hashes are already in flight, or
+when a hash takes longer than PASSWORD_TIMEOUT to come back.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import bcrypt
+
+
+class HashingOverloaded(Exception):
+    """Raised when too many password hashes are already queued."""
+
+
+class HashingTimeout(HashingOverloaded):
+    """Raised when a password hash did not finish within PASSWORD_TIMEOUT."""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('UTF-8'), bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password.encode('UTF-8'), hashed.encode('UTF-8'))
+
+
+def hash_rounds(hashed):
+    """Returns bcrypt cost factor of hashed, e.g. 12 for $2b$12$..."""
+
+    return int(hashed.split('$')[2])
+
+
+class PasswordHasher:
+    """Hashes and checks passwords on a worker pool configured from app.
+
+    Config:
+        BCRYPT_LOG_ROUNDS: cost factor for new hashes (12)
+        PASSWORD_POOL: "thread" or "process" ("thread")
+        PASSWORD_POOL_SIZE: number of workers (CPU count)
+        PASSWORD_QUEUE_LIMIT: max hashes running or waiting (4 per worker)
+        PASSWORD_TIMEOUT: seconds to wait for a result (30)
+    """
+
+    def __init__(self, app=None):
+        self.executor = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        workers = os.cpu_count() or 1
+
+        self.rounds = int(app.config.setdefault('BCRYPT_LOG_ROUNDS', 12))
+        self.pool = app.config.setdefault('PASSWORD_POOL', 'thread')
+        self.pool_size = int(app.config.setdefault('PASSWORD_POOL_SIZE', workers))
+        self.queue_limit = int(app.config.setdefault('PASSWORD_QUEUE_LIMIT', 4 * self.pool_size))
+        self.timeout = float(app.config.setdefault('PASSWORD_TIMEOUT', 30))
+        self.slots = threading.BoundedSemaphore(self.queue_limit)
+
+    def _get_executor(self):
+        """Returns pool, starting it on first use so it is created after any
+        fork by the WSGI server.
+        """
+
+        with self.lock:
+            if self.executor is None:
+                if self.pool == 'process':
+                    self.executor = ProcessPoolExecutor(max_workers=self.pool_size)
+                else:
+                    self.executor = ThreadPoolExecutor(
+                        max_workers=self.pool_size,
+                        thread_name_prefix='password',
+                    )
+        return self.executor
+
+    def _run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HashingOverloaded()
+
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda future: self.slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # Frees the slot now if it never started; otherwise on finishing.
+            future.cancel()
+            raise HashingTimeout()
+
+    def hash(self, password):
+        """Returns bcrypt hash of password at the configured cost."""
+
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, hashed, password):
+        """Returns whether password matches hashed."""
+
+        return self._run(_check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Returns whether hashed was made with a different cost than configured."""
+
+        return hash_rounds(hashed) != self.rounds
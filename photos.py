@@ -0,0 +1,211 @@
+"""Listing photo ingestion: inline uploads and the background job queue.
+
+With PHOTO_INGEST = "async" (the default), add_listing only queues a
+PhotoJob per photo; worker.py claims jobs, derives and uploads the small and
+large variants, and records the ListingPhoto. Failed jobs are retried with
+exponential backoff up to PHOTO_JOB_MAX_ATTEMPTS times; photos that cannot
+be decoded fail at once.
+"""
+
+import hashlib
+import time
+from datetime import datetime, timedelta
+from io import BytesIO
+
+from flask import current_app
+from werkzeug.datastructures import FileStorage
+
+from helpers import upload_files_to_s3
+from images import make_derivatives
+from models import ListingPhoto, PhotoJob, db
+from my_secrets import S3_SMALL_BUCKET, S3_LARGE_BUCKET
+from response_cache import response_cache
+
+
+def photo_deriver(specs):
+    """Returns derive callback for upload_files_to_s3 producing the small and
+    large derivatives in specs, keyed by the bucket each belongs in.
+    """
+
+    def derive(data):
+        derivatives = make_derivatives(data, specs)
+        return {
+            S3_SMALL_BUCKET: derivatives['small'],
+            S3_LARGE_BUCKET: derivatives['large'],
+        }
+
+    return derive
+
+
+def upload_photos(files):
+    """Derives and uploads files to the small and large buckets. Returns list
+    of UploadResult in files order.
+    """
+
+    return upload_files_to_s3(
+        files,
+        [S3_SMALL_BUCKET, S3_LARGE_BUCKET],
+        derive=photo_deriver(current_app.config['PHOTO_DERIVATIVES']),
+    )
+
+
+def enqueue_photos(listing_id, files):
+    """Adds a pending PhotoJob to the session for each file not already queued
+    for listing. Returns the jobs added; caller commits.
+    """
+
+    jobs = []
+    seen = set()
+    for file in files:
+        data = file.read()
+        key = f"{listing_id}:{hashlib.sha256(data).hexdigest()}"
+        if key in seen:
+            continue
+        seen.add(key)
+
+        if PhotoJob.query.filter_by(idempotency_key=key).count():
+            continue
+
+        job = PhotoJob(
+            listing_id=listing_id,
+            idempotency_key=key,
+            filename=file.filename,
+            content_type=file.content_type or 'application/octet-stream',
+            data=data,
+        )
+        db.session.add(job)
+        jobs.append(job)
+
+    return jobs
+
+
+def claim_job():
+    """Claims the next runnable job, marking it processing. Returns the job,
+    or None if there is nothing to do.
+
+    Also reclaims jobs stuck in processing for longer than PHOTO_JOB_LEASE
+    seconds, e.g. after a worker crash, unless that was their last attempt:
+    those are marked failed, so a job that kills its worker cannot be retried
+    forever. On Postgres, concurrent workers skip rows locked by each other.
+    """
+
+    now = datetime.utcnow()
+    lease_expired = now - timedelta(seconds=current_app.config['PHOTO_JOB_LEASE'])
+
+    abandoned = (
+        PhotoJob.query
+        .filter(
+            PhotoJob.status == PhotoJob.PROCESSING,
+            PhotoJob.locked_at < lease_expired,
+            PhotoJob.attempts >= current_app.config['PHOTO_JOB_MAX_ATTEMPTS'],
+        )
+        .update({
+            PhotoJob.status: PhotoJob.FAILED,
+            PhotoJob.locked_at: None,
+            PhotoJob.last_error: db.func.coalesce(
+                PhotoJob.last_error, "Worker did not finish the job"),
+        }, synchronize_session=False)
+    )
+    if abandoned:
+        db.session.commit()
+        response_cache.invalidate('listings')
+
+    query = (
+        PhotoJob.query
+        .filter(
+            ((PhotoJob.status == PhotoJob.PENDING) & (PhotoJob.run_after <= now))
+            | ((PhotoJob.status == PhotoJob.PROCESSING) & (PhotoJob.locked_at < lease_expired))
+        )
+        .order_by(PhotoJob.run_after, PhotoJob.id)
+    )
+    if db.engine.dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+
+    job = query.first()
+    if job is None:
+        db.session.rollback()
+        return None
+
+    job.status = PhotoJob.PROCESSING
+    job.attempts += 1
+    job.locked_at = now
+    db.session.commit()
+    return job
+
+
+def run_job(job):
+    """Uploads job's photo and records the ListingPhoto in the same commit that
+    marks the job done. On failure, schedules a retry or marks job failed.
+    """
+
+    file = FileStorage(
+        stream=BytesIO(job.data),
+        filename=job.filename,
+        content_type=job.content_type,
+    )
+    [upload] = upload_photos([file])
+
+    if upload.error is None:
+        db.session.add(ListingPhoto(
+            listing_id=job.listing_id,
+            small_photo_url=upload.urls[S3_SMALL_BUCKET],
+            large_photo_url=upload.urls[S3_LARGE_BUCKET],
+        ))
+        job.status = PhotoJob.DONE
+        job.data = None
+        job.last_error = None
+        job.locked_at = None
+        db.session.commit()
+
+        # Photos and photo_status changed. Only reaches other processes when
+        # the cache is shared; otherwise their entries expire with
+        # RESPONSE_CACHE_TTL.
+        response_cache.invalidate('listings')
+
+    else:
+        retry_or_fail(job, upload.error, upload.retryable)
+
+
+def retry_or_fail(job, error, retryable=True):
+    """Records error on job and commits. Schedules a retry with exponential
+    backoff, or marks job failed if not retryable or out of attempts.
+    """
+
+    if not retryable or job.attempts >= current_app.config['PHOTO_JOB_MAX_ATTEMPTS']:
+        job.status = PhotoJob.FAILED
+    else:
+        backoff = current_app.config['PHOTO_JOB_BACKOFF'] * 2 ** (job.attempts - 1)
+        job.status = PhotoJob.PENDING
+        job.run_after = datetime.utcnow() + timedelta(seconds=backoff)
+
+    job.last_error = error
+    job.locked_at = None
+    db.session.commit()
+    response_cache.invalidate('listings')
+
+
+def run_worker(poll_interval=1.0, once=False):
+    """Processes jobs until interrupted. If once, stops when queue is empty."""
+
+    while True:
+        job = claim_job()
+
+        if job is not None:
+            current_app.logger.info(
+                "Processing photo job %s for listing %s (attempt %s)",
+                job.id, job.listing_id, job.attempts)
+            try:
+                run_job(job)
+            except Exception as error:
+                db.session.rollback()
+                current_app.logger.exception("Photo job %s crashed", job.id)
+                try:
+                    retry_or_fail(job, f"Crashed: {error}")
+                except Exception:
+                    # Left in processing; reclaimed once its lease expires.
+                    db.session.rollback()
+                    current_app.logger.exception("Could not record photo job %s crash", job.id)
+        elif once:
+            return
+        else:
+            time.sleep(poll_interval)
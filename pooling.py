@@ -0,0 +1,127 @@
+"""Database connection pool settings and checkout metrics.
+
+engine_options() turns DB_* config into SQLALCHEMY_ENGINE_OPTIONS: pool
+size and overflow, how long a request may wait for a connection, recycling
+and pre-ping so connections dropped by Postgres or a proxy are replaced
+rather than erroring, and a statement_timeout so runaway queries are
+cancelled by the server.
+
+Size the pool so that processes * (DB_POOL_SIZE + DB_MAX_OVERFLOW), plus
+workers and the realtime listener, stays under Postgres max_connections.
+pool_stats() reports what each process actually uses.
+"""
+
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            with self.stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self.stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def recreate(self):
+        # Called on dispose and after invalidation; keep counting on the new pool.
+        pool = super().recreate()
+        pool.checkouts = self.checkouts
+        pool.timeouts = self.timeouts
+        pool.wait_total = self.wait_total
+        pool.wait_max = self.wait_max
+        return pool
+
+
+def engine_options(config, database_url):
+    """Returns SQLALCHEMY_ENGINE_OPTIONS for DB_* config.
+
+    Config:
+        DB_POOL_SIZE: connections kept open per process (5)
+        DB_MAX_OVERFLOW: extra connections opened under load (10)
+        DB_POOL_TIMEOUT: seconds to wait for a connection before failing (10)
+        DB_POOL_RECYCLE: seconds before a connection is replaced (1800)
+        DB_POOL_PRE_PING: test connections on checkout (True)
+        DB_STATEMENT_TIMEOUT: milliseconds a statement may run, 0 for none (15000)
+
+    SQLite keeps SQLAlchemy's default pool; only Postgres gets a
+    statement_timeout.
+    """
+
+    if database_url.startswith('sqlite'):
+        return {}
+
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+    if database_url.startswith('postgresql') and config['DB_STATEMENT_TIMEOUT']:
+        options['connect_args'] = {
+            'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT']}",
+        }
+
+    return options
+
+
+def lift_statement_timeout(connection):
+    """Lets statements in connection's current transaction run without
+    DB_STATEMENT_TIMEOUT, for bulk loads and rebuilds. Resets at commit.
+    """
+
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text("SET LOCAL statement_timeout = 0"))
+
+
+def pool_stats(engine):
+    """Returns dict of engine's pool gauges and checkout wait counters."""
+
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__, 'status': pool.status()}
+
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            max_overflow=pool._max_overflow,
+        )
+
+    if isinstance(pool, InstrumentedQueuePool):
+        with pool.stats_lock:
+            stats.update(
+                checkouts=pool.checkouts,
+                timeouts=pool.timeouts,
+                wait_total_ms=round(pool.wait_total * 1000, 3),
+                wait_avg_ms=round(pool.wait_total * 1000 / pool.checkouts, 3) if pool.checkouts else 0,
+                wait_max_ms=round(pool.wait_max * 1000, 3),
+            )
+
+    return stats
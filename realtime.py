@@ -0,0 +1,172 @@
+"""Push delivery of new messages to connected clients.
+
+Brokers keep a short buffer of recent events per user and wake anyone
+waiting on that user when one arrives, so SSE streams and long-polls are
+served from memory instead of re-reading conversations.
+
+LocalBroker only reaches clients connected to the same process, which is
+all a single local process (or tests) need. PostgresBroker relays events
+between processes with LISTEN/NOTIFY. REALTIME_BACKEND picks one.
+
+Event ids are sequence numbers a broker assigns as events reach it, so
+clients resume with the last id they saw and never skip an event that
+arrives after a newer one, as a message committed late would. They are
+per process: a client resuming against another process (or after a
+restart) should backfill with GET /messages?after= instead.
+"""
+
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict, deque
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBroker:
+    """In-process pub/sub of events per user."""
+
+    def __init__(self, buffer_size=100):
+        self.buffer_size = buffer_size
+        self.lock = threading.Lock()
+        self.buffers = defaultdict(lambda: deque(maxlen=self.buffer_size))
+        self.conditions = {}
+        self.sequence = 0
+
+    def _condition(self, user_id):
+        """Returns condition for user's buffer. Caller holds self.lock."""
+
+        if user_id not in self.conditions:
+            self.conditions[user_id] = threading.Condition(self.lock)
+        return self.conditions[user_id]
+
+    def _deliver(self, user_id, data):
+        with self.lock:
+            self.sequence += 1
+            self.buffers[user_id].append((self.sequence, data))
+            self._condition(user_id).notify_all()
+
+    def publish(self, user_id, message_id, data):
+        """Publishes message of message_id to user. data is the message
+            serialized as a JSON string.
+        """
+
+        self._deliver(user_id, data)
+
+    def last_event_id(self, user_id):
+        """Returns id of newest buffered event for user, or 0."""
+
+        with self.lock:
+            buffer = self.buffers.get(user_id)
+            return buffer[-1][0] if buffer else 0
+
+    def wait(self, user_id, last_id, timeout):
+        """Returns [(event_id, data), ...] of user's buffered events newer
+        than last_id, waiting up to timeout seconds for one if there are none.
+        """
+
+        deadline = time.monotonic() + timeout
+
+        with self.lock:
+            condition = self._condition(user_id)
+            while True:
+                events = [
+                    event for event in self.buffers.get(user_id, ())
+                    if event[0] > last_id
+                ]
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                condition.wait(remaining)
+
+
+class PostgresBroker(LocalBroker):
+    """Broker relaying events between processes with Postgres LISTEN/NOTIFY.
+
+    publish sends a NOTIFY; every process, including this one, delivers it to
+    its local waiters from a listener thread holding one dedicated connection.
+    NOTIFY payloads are limited to 8000 bytes, so they carry only the user
+    and message ids; the listener reloads each batch of messages with
+    load_events, which returns {message_id: data} for the ids it finds.
+    """
+
+    CHANNEL = "sharebnb_events"
+
+    def __init__(self, engine, load_events, buffer_size=100):
+        super().__init__(buffer_size)
+        self.engine = engine
+        self.load_events = load_events
+        self.listener = None
+        self.listener_lock = threading.Lock()
+
+    def publish(self, user_id, message_id, data):
+        payload = json.dumps({"user_id": user_id, "message_id": message_id})
+        with self.engine.begin() as connection:
+            connection.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": self.CHANNEL, "payload": payload},
+            )
+
+    def wait(self, user_id, last_id, timeout):
+        self._start_listener()
+        return super().wait(user_id, last_id, timeout)
+
+    def _start_listener(self):
+        with self.listener_lock:
+            if self.listener is None:
+                self.listener = threading.Thread(
+                    target=self._listen, name="realtime-listener", daemon=True)
+                self.listener.start()
+
+    def _listen(self):
+        """Delivers notifications forever, reconnecting after errors."""
+
+        while True:
+            connection = None
+            try:
+                fairy = self.engine.raw_connection()
+                fairy.detach()
+                connection = fairy.connection
+                connection.autocommit = True
+                connection.cursor().execute(f"LISTEN {self.CHANNEL}")
+
+                while True:
+                    if select.select([connection], [], [], 5) == ([], [], []):
+                        continue
+                    connection.poll()
+                    events = [json.loads(notify.payload) for notify in connection.notifies]
+                    del connection.notifies[:]
+                    if not events:
+                        continue
+
+                    loaded = self.load_events({event["message_id"] for event in events})
+                    for event in events:
+                        # Missing if deleted since it was sent.
+                        if event["message_id"] in loaded:
+                            self._deliver(event["user_id"], loaded[event["message_id"]])
+
+            except Exception:
+                logger.exception("Realtime listener failed; reconnecting")
+                time.sleep(1)
+
+            finally:
+                if connection is not None:
+                    connection.close()
+
+
+def create_broker(app, engine, load_events):
+    """Returns broker for REALTIME_BACKEND config: "local" or "postgres".
+
+    load_events(message_ids) returns {message_id: data} for the PostgresBroker
+    listener; it runs on the listener thread, outside any request.
+    """
+
+    buffer_size = app.config.get('REALTIME_BUFFER_SIZE', 100)
+
+    if app.config.get('REALTIME_BACKEND', 'local') == 'postgres':
+        return PostgresBroker(engine, load_events, buffer_size)
+    return LocalBroker(buffer_size)
@@ -0,0 +1,130 @@
+"""Routing of read-only requests to database replicas.
+
+REPLICA_DATABASE_URLS lists replicas, comma separated. Each becomes a
+Flask-SQLAlchemy bind ("replica0", "replica1", ...); views decorated with
+read_replica run their queries against a randomly chosen one, while
+everything else, and every flush, stays on the primary.
+
+Replicas lag the primary, so a request still goes to the primary when its
+user wrote within REPLICA_LAG_WINDOW seconds, or when a namespace the view
+reads was written within that window (so a cached response is never
+refilled with data older than the write that invalidated it). Writes are
+recorded with record_writes. The window is per process.
+
+To try it locally, point DATABASE_URL and REPLICA_DATABASE_URLS at two
+SQLite files and copy the primary file over the replica to "replicate".
+"""
+
+import random
+from functools import wraps
+
+from flask import g, has_app_context
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
+
+from caching import LRUCache
+
+
+class RoutingSession(SignallingSession):
+    """Session sending reads to a replica while g.read_replica is set."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_app_context() and g.get('read_replica'):
+            return replica_router.choose_engine()
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy whose sessions are RoutingSessions."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class ReplicaRouter:
+    """Chooses replica or primary for read_replica views.
+
+    Config:
+        REPLICA_DATABASE_URLS: comma separated replica URLs (unset)
+        REPLICA_LAG_WINDOW: seconds after a write reads stay on primary (5)
+    """
+
+    def __init__(self):
+        self.db = None
+        self.app = None
+        self.bind_keys = []
+        self.identify = lambda: None
+        self.recent_writes = None
+
+    def init_app(self, app, db, identify=None):
+        """Registers replica binds on app; call before connect_db.
+
+        identify returns the current user's id, or None if anonymous.
+        """
+
+        urls = app.config.setdefault('REPLICA_DATABASE_URLS', None)
+        window = app.config.setdefault('REPLICA_LAG_WINDOW', 5)
+
+        self.db = db
+        self.app = app
+        self.bind_keys = []
+        if identify is not None:
+            self.identify = identify
+        self.recent_writes = LRUCache(maxsize=100000, ttl=window)
+
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', None) or {}
+        for index, url in enumerate(filter(None, (urls or '').split(','))):
+            key = f"replica{index}"
+            binds[key] = url.strip().replace('postgres://', 'postgresql://')
+            self.bind_keys.append(key)
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+
+    @property
+    def enabled(self):
+        return bool(self.bind_keys)
+
+    def choose_engine(self):
+        """Returns engine of a random replica."""
+
+        return self.db.get_engine(self.app, bind=random.choice(self.bind_keys))
+
+    def record_writes(self, user_ids=(), namespaces=()):
+        """Keeps reads by user_ids, and of namespaces, on the primary for
+        REPLICA_LAG_WINDOW seconds.
+        """
+
+        if not self.enabled:
+            return
+        for user_id in user_ids:
+            self.recent_writes.set(('user', user_id), True)
+        for namespace in namespaces:
+            self.recent_writes.set(('namespace', namespace), True)
+
+    def fresh(self, namespaces):
+        """Returns whether a replica may serve the current request."""
+
+        if any(self.recent_writes.get(('namespace', namespace)) for namespace in namespaces):
+            return False
+        user_id = self.identify()
+        return user_id is None or not self.recent_writes.get(('user', user_id))
+
+    def read_replica(self, *namespaces):
+        """Decorator running view's queries on a replica, unless the current
+        user or any of namespaces was written recently.
+        """
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                # Left set for the rest of the request, so streamed
+                # responses keep reading from the replica.
+                g.read_replica = self.enabled and self.fresh(namespaces)
+                return view(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+
+replica_router = ReplicaRouter()
+read_replica = replica_router.read_replica
@@ -0,0 +1,171 @@
+"""Response cache with ETag / Last-Modified revalidation for public reads.
+
+Cached views are grouped into namespaces ("listings", "users"). Each
+namespace has a version, the time it last changed; invalidate() bumps it,
+which orphans every entry cached under the old version, so writes never
+need to find the keys they affect.
+
+Entries live in a per-process LRU, or in Redis when RESPONSE_CACHE_REDIS_URL
+is set so invalidations from any process (including worker.py) are seen
+everywhere. Either way they expire after RESPONSE_CACHE_TTL seconds.
+"""
+
+import hashlib
+import math
+import pickle
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import Response, g, make_response, request
+
+from caching import LRUCache
+
+
+class LocalBackend:
+    """Entries and namespace versions held in this process."""
+
+    def __init__(self, maxsize, ttl):
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.versions = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value):
+        self.entries.set(key, value)
+
+    def get_version(self, namespace):
+        return self.versions.get(namespace, self.started)
+
+    def bump_version(self, namespace):
+        with self.lock:
+            self.versions[namespace] = max(time.time(), self.get_version(namespace) + 1e-6)
+
+
+class RedisBackend:
+    """Entries and namespace versions shared through Redis."""
+
+    def __init__(self, url, ttl):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(f"response:{key}")
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self.client.set(f"response:{key}", pickle.dumps(value), ex=self.ttl)
+
+    def get_version(self, namespace):
+        version = self.client.get(f"version:{namespace}")
+        if version is None:
+            self.client.set(f"version:{namespace}", time.time(), nx=True)
+            version = self.client.get(f"version:{namespace}")
+        return float(version)
+
+    def bump_version(self, namespace):
+        self.client.set(f"version:{namespace}", time.time())
+
+
+class ResponseCache:
+    """Caches successful GET responses of decorated views.
+
+    Config:
+        RESPONSE_CACHE_SIZE: max entries in the local LRU (1024)
+        RESPONSE_CACHE_TTL: seconds before an entry expires (60)
+        RESPONSE_CACHE_REDIS_URL: use Redis instead of the local LRU (unset)
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        size = app.config.setdefault('RESPONSE_CACHE_SIZE', 1024)
+        ttl = app.config.setdefault('RESPONSE_CACHE_TTL', 60)
+        redis_url = app.config.setdefault('RESPONSE_CACHE_REDIS_URL', None)
+
+        if redis_url:
+            self.backend = RedisBackend(redis_url, ttl)
+        else:
+            self.backend = LocalBackend(size, ttl)
+
+    def invalidate(self, *namespaces):
+        """Marks namespaces changed, dropping their cached responses."""
+
+        if self.backend is None:
+            return
+        for namespace in namespaces:
+            self.backend.bump_version(namespace)
+
+    def skip(self):
+        """Keeps the current request's response out of the cache, for views
+        whose response may change without their namespace being invalidated
+        in this process.
+        """
+
+        g.response_cache_skip = True
+
+    def cached(self, namespace):
+        """Decorator caching a view's 200 responses under namespace, keyed by
+        path, query string and Accept header, and answering conditional
+        requests with 304. Streamed responses, and those of requests that
+        called skip(), are passed through uncached.
+
+        Last-Modified is the second after the namespace's version, sent only
+        once that second is over, so a later write always gets a later date
+        and a bare If-Modified-Since never matches a stale copy.
+        """
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                version = self.backend.get_version(namespace)
+                query = "&".join(
+                    f"{key}={value}" for key, value in sorted(request.args.items(multi=True)))
+                accept = request.headers.get('Accept', '')
+                key = f"{namespace}:{version}:{request.path}?{query}:{accept}"
+
+                entry = self.backend.get(key)
+                if entry is None:
+                    response = make_response(view(*args, **kwargs))
+                    skip = g.pop('response_cache_skip', False)
+                    if response.status_code != 200 or response.is_streamed or skip:
+                        return response
+
+                    body = response.get_data()
+                    entry = (body, response.mimetype, hashlib.sha1(body).hexdigest())
+                    self.backend.set(key, entry)
+
+                body, mimetype, etag = entry
+                modified_second = math.floor(version) + 1
+                last_modified = datetime.fromtimestamp(modified_second, timezone.utc)
+                second_over = time.time() >= modified_second
+
+                if request.if_none_match:
+                    not_modified = request.if_none_match.contains(etag)
+                else:
+                    since = request.if_modified_since
+                    not_modified = since is not None and second_over and last_modified <= since
+
+                response = Response(status=304) if not_modified else Response(body, mimetype=mimetype)
+                response.set_etag(etag)
+                if second_over:
+                    response.last_modified = last_modified
+                response.cache_control.no_cache = True
+                response.vary.add('Accept')
+                return response
+
+            return wrapper
+
+        return decorator
+
+
+response_cache = ResponseCache()
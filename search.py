@@ -0,0 +1,271 @@
+"""Ranked listing search over title, address and details.
+
+On Postgres, matches the weighted tsvector behind ix_listings_search, plus
+trigram ILIKE on title and address so partial words still hit an index.
+Elsewhere (SQLite, tests), searches an in-process inverted index built from
+the listings table on first use.
+
+The index follows this process's ORM writes. It is rebuilt when the listings
+table's row count or highest id changes otherwise (other processes, imports),
+checked at most every SEARCH_INDEX_CHECK_INTERVAL seconds; call invalidate
+after changing existing rows outside the ORM. Matches are checked against the
+table before they are returned, so deleted listings never are.
+"""
+
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from sqlalchemy import event, func, literal_column, or_
+
+from models import LISTING_SEARCH_VECTOR, Listing, db
+
+FIELD_WEIGHTS = {"title": 3.0, "address": 2.0, "details": 1.0}
+
+# Score multiplier for query words only matched as a prefix of an indexed word.
+PREFIX_WEIGHT = 0.5
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Ranked in-process matches checked against filters per query.
+FILTER_CHUNK_SIZE = 500
+
+
+def escape_like(term, escape="\\"):
+    """Returns term with LIKE wildcards (% and _) and escape escaped."""
+
+    return (
+        term.replace(escape, escape * 2)
+        .replace("%", escape + "%")
+        .replace("_", escape + "_")
+    )
+
+
+def tokenize(text):
+    """Splits text into lowercase word tokens."""
+
+    return TOKEN_RE.findall(text.lower())
+
+
+class InvertedIndex:
+    """In-process inverted index of listings.
+
+    Maps each token to {listing_id: weighted term frequency}. A query matches
+    listings containing every query word, either exactly or as a prefix of an
+    indexed word, and ranks them by summed weight.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.vocabulary = []
+        self.lock = threading.RLock()
+
+    def add(self, listing_id, title, address, details):
+        """Indexes listing, replacing any previous version."""
+
+        with self.lock:
+            self.remove(listing_id)
+
+            weights = defaultdict(float)
+            for field, text in (("title", title), ("address", address), ("details", details)):
+                for token in tokenize(text or ""):
+                    weights[token] += FIELD_WEIGHTS[field]
+
+            for token, weight in weights.items():
+                if token not in self.postings:
+                    self.vocabulary.insert(bisect_left(self.vocabulary, token), token)
+                self.postings[token][listing_id] = weight
+
+            self.documents[listing_id] = list(weights)
+
+    def remove(self, listing_id):
+        """Removes listing from index if present."""
+
+        with self.lock:
+            for token in self.documents.pop(listing_id, ()):
+                posting = self.postings[token]
+                posting.pop(listing_id, None)
+                if not posting:
+                    del self.postings[token]
+                    del self.vocabulary[bisect_left(self.vocabulary, token)]
+
+    def _matches(self, word):
+        """Returns {listing_id: score} of listings matching one query word."""
+
+        scores = dict(self.postings.get(word, {}))
+
+        i = bisect_left(self.vocabulary, word)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(word):
+            token = self.vocabulary[i]
+            if token != word:
+                for listing_id, weight in self.postings[token].items():
+                    scores[listing_id] = scores.get(listing_id, 0) + weight * PREFIX_WEIGHT
+            i += 1
+
+        return scores
+
+    def search(self, term, limit=None):
+        """Returns ids of up to limit (default all) best matching listings,
+        best first.
+        """
+
+        words = tokenize(term)
+        if not words:
+            return []
+
+        with self.lock:
+            scores = None
+            for word in words:
+                matches = self._matches(word)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {
+                        listing_id: score + matches[listing_id]
+                        for listing_id, score in scores.items()
+                        if listing_id in matches
+                    }
+                if not scores:
+                    return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [listing_id for listing_id, score in ranked[:limit]]
+
+
+class ListingSearch:
+    """Listing search, dispatching to Postgres or the in-process index.
+
+    SEARCH_BACKEND config picks the backend: "postgres", "memory" or "auto"
+    (the default), which uses Postgres when the database is Postgres.
+    """
+
+    def __init__(self, app=None):
+        self.index = None
+        self.signature = None
+        self.checked_at = 0
+        self.lock = threading.RLock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_BACKEND', 'auto')
+        app.config.setdefault('SEARCH_INDEX_CHECK_INTERVAL', 5)
+        self.app = app
+
+        event.listen(Listing, 'after_insert', self._on_insert)
+        event.listen(Listing, 'after_update', self._on_change)
+        event.listen(Listing, 'after_delete', self._on_delete)
+
+    def invalidate(self):
+        """Drops the in-process index, to be rebuilt on next use."""
+
+        with self.lock:
+            self.index = None
+
+    @property
+    def backend(self):
+        backend = self.app.config['SEARCH_BACKEND']
+        if backend == 'auto':
+            return 'postgres' if db.engine.dialect.name == 'postgresql' else 'memory'
+        return backend
+
+    def search(self, term, limit, filters=()):
+        """Returns ids of up to limit listings matching term and filters
+        (Listing query criteria), best first.
+        """
+
+        if self.backend == 'postgres':
+            return self._search_postgres(term, limit, filters)
+
+        # Rank every match, then keep the best that still exist and pass
+        # filters, checking candidates in SQL a chunk at a time until limit
+        # are found.
+        ranked = self._get_index().search(term)
+        found = []
+        for start in range(0, len(ranked), FILTER_CHUNK_SIZE):
+            chunk = ranked[start:start + FILTER_CHUNK_SIZE]
+            matching = {
+                listing_id for (listing_id,) in
+                db.session.query(Listing.id).filter(Listing.id.in_(chunk), *filters)
+            }
+            found += [listing_id for listing_id in chunk if listing_id in matching]
+            if len(found) >= limit:
+                break
+        return found[:limit]
+
+    def _search_postgres(self, term, limit, filters=()):
+        vector = literal_column(f"({LISTING_SEARCH_VECTOR})")
+        query = func.plainto_tsquery('english', term)
+        pattern = f"%{escape_like(term)}%"
+
+        rank = (
+            func.ts_rank_cd(vector, query)
+            + func.greatest(
+                func.similarity(Listing.title, term),
+                func.similarity(Listing.address, term),
+            )
+        )
+
+        rows = (
+            db.session.query(Listing.id)
+            .filter(or_(
+                vector.op('@@')(query),
+                Listing.title.ilike(pattern, escape="\\"),
+                Listing.address.ilike(pattern, escape="\\"),
+            ), *filters)
+            .order_by(rank.desc(), Listing.id)
+            .limit(limit)
+        )
+        return [listing_id for (listing_id,) in rows]
+
+    def _get_signature(self):
+        """Returns (row count, highest id) of listings."""
+
+        return tuple(db.session.query(func.count(Listing.id), func.max(Listing.id)).one())
+
+    def _get_index(self):
+        """Returns in-process index, building it from the database on first
+        use, and again when the listings table changed behind its back.
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            if (self.index is not None
+                    and now - self.checked_at >= self.app.config['SEARCH_INDEX_CHECK_INTERVAL']):
+                self.checked_at = now
+                if self._get_signature() != self.signature:
+                    self.index = None
+
+            if self.index is None:
+                self.signature = self._get_signature()
+                self.checked_at = now
+                index = InvertedIndex()
+                rows = (
+                    db.session.query(Listing.id, Listing.title, Listing.address, Listing.details)
+                    .yield_per(1000)
+                )
+                for row in rows:
+                    index.add(*row)
+                self.index = index
+        return self.index
+
+    def _on_insert(self, mapper, connection, listing):
+        with self.lock:
+            if self.index is not None:
+                count, last_id = self.signature
+                self.signature = (count + 1, max(last_id or 0, listing.id))
+        self._on_change(mapper, connection, listing)
+
+    def _on_change(self, mapper, connection, listing):
+        if self.index is not None:
+            self.index.add(listing.id, listing.title, listing.address, listing.details)
+
+    def _on_delete(self, mapper, connection, listing):
+        with self.lock:
+            if self.index is not None:
+                count, last_id = self.signature
+                self.signature = (count - 1, last_id)
+                self.index.remove(listing.id)
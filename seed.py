@@ -1,22 +1,11 @@
 """Seed database with sample data from CSV Files."""
 
-from csv import DictReader
-from app import db
-from models import User, Message, Listing, ListingPhoto
+import logging
 
-db.drop_all()
-db.create_all()
+from app import app
+from importer import import_csvs
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+logging.basicConfig(level=logging.INFO)
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
-
-with open('generator/listings.csv') as listings:
-    db.session.bulk_insert_mappings(Listing, DictReader(listings))
-
-with open('generator/listing_photos.csv') as listing_photos:
-    db.session.bulk_insert_mappings(ListingPhoto, DictReader(listing_photos))
-
-db.session.commit()
\ No newline at end of file
+with app.app_context():
+    import_csvs('generator')
@@ -0,0 +1,116 @@
+"""Streaming JSON responses for large collections, and a pluggable encoder.
+
+Streamed responses are written a batch of rows at a time from a query
+iterated with yield_per, so peak memory is one batch rather than every ORM
+object, dict and the final string at once. Clients opt in with ?stream=true
+(one JSON object, same shape as the buffered response) or
+Accept: application/x-ndjson (one JSON document per line).
+
+JSON_ENCODER config picks the encoder: "orjson", "json", or "auto" (the
+default), which uses orjson when it is installed.
+"""
+
+import json
+from itertools import islice
+
+from flask import Response, current_app, request, stream_with_context
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NDJSON = 'application/x-ndjson'
+
+# Flush to the client once this many bytes are buffered.
+CHUNK_SIZE = 64 * 1024
+
+
+def _default(obj):
+    """Encodes datetimes the way jsonify does, as HTTP dates."""
+
+    if hasattr(obj, 'utctimetuple'):
+        return http_date(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """Returns obj encoded as compact JSON with sorted keys, like jsonify."""
+
+    encoder = current_app.config.get('JSON_ENCODER', 'auto')
+
+    if orjson is not None and encoder in ('auto', 'orjson'):
+        return orjson.dumps(
+            obj,
+            default=_default,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+        ).decode('UTF-8')
+
+    return json.dumps(obj, default=_default, sort_keys=True, separators=(',', ':'))
+
+
+def wants_stream():
+    """Returns whether client asked for a streamed response."""
+
+    return (
+        request.args.get('stream', '').lower() in ('1', 'true')
+        or request.accept_mimetypes.best == NDJSON
+    )
+
+
+def batched(rows, size):
+    """Yields lists of up to size rows."""
+
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def stream_collection(key, rows, serialize_batch, batch_size=None):
+    """Returns streamed response of rows.
+
+    serialize_batch is called with each list of up to batch_size rows
+    (STREAM_BATCH_SIZE config by default) and returns their serialized dicts.
+    Writes NDJSON if the client accepts it, otherwise {key: [...]}.
+    """
+
+    batch_size = batch_size or current_app.config.get('STREAM_BATCH_SIZE', 1000)
+    ndjson = request.accept_mimetypes.best == NDJSON
+
+    def generate():
+        buffer = []
+        buffered = 0
+        first = True
+
+        if not ndjson:
+            buffer.append(f'{{"{key}":[')
+
+        for batch in batched(rows, batch_size):
+            for item in serialize_batch(batch):
+                encoded = dumps(item)
+                if ndjson:
+                    encoded += '\n'
+                elif not first:
+                    encoded = ',' + encoded
+                first = False
+
+                buffer.append(encoded)
+                buffered += len(encoded)
+                if buffered >= CHUNK_SIZE:
+                    yield ''.join(buffer)
+                    buffer = []
+                    buffered = 0
+
+        if not ndjson:
+            buffer.append(']}')
+        if buffer:
+            yield ''.join(buffer)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=NDJSON if ndjson else 'application/json',
+    )
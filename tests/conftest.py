@@ -0,0 +1,46 @@
+"""Fixtures for tests against an in-memory SQLite database.
+
+Run from the repo root with python -m pytest.
+"""
+
+import os
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+
+import pytest  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+
+from app import app as flask_app  # noqa: E402
+from models import db  # noqa: E402
+from response_cache import response_cache  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+    response_cache.invalidate('listings', 'users', 'bookings')
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def queries():
+    """Returns list collecting the SQL statements executed during the test."""
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(Engine, 'before_cursor_execute', record)
@@ -0,0 +1,51 @@
+"""Legacy tokens, with only a username and no expiry, authenticate only
+until JWT_ACCEPT_LEGACY_UNTIL.
+"""
+
+from datetime import datetime, timedelta
+
+import jwt
+import pytest
+
+from app import createJWT
+from models import User, db
+
+
+@pytest.fixture
+def user(app):
+    user = User(
+        username='legacy', email='legacy@example.com', password='x', phone='555-0000',
+        first_name='Legacy', last_name='User',
+    )
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def status(client, token):
+    return client.get('/messages', headers={'Authorization': f'Bearer {token}'}).status_code
+
+
+def legacy_token(app, user):
+    return jwt.encode(
+        {'username': user.username, 'is_admin': user.is_admin},
+        app.config['SECRET_KEY'], algorithm='HS256')
+
+
+@pytest.mark.parametrize('until, expected', [
+    (None, 401),
+    (timedelta(days=1), 200),
+    (timedelta(days=-1), 401),
+])
+def test_legacy_tokens_accepted_until_cutoff(app, client, monkeypatch, user, until, expected):
+    if until is not None:
+        until = datetime.utcnow() + until
+    monkeypatch.setitem(app.config, 'JWT_ACCEPT_LEGACY_UNTIL', until)
+
+    assert status(client, legacy_token(app, user)) == expected
+
+
+def test_access_tokens_ignore_legacy_cutoff(app, client, monkeypatch, user):
+    monkeypatch.setitem(app.config, 'JWT_ACCEPT_LEGACY_UNTIL', None)
+
+    assert status(client, createJWT(user)) == 200
@@ -0,0 +1,158 @@
+"""Confirmed bookings of a listing never overlap, cancelling frees their
+nights, and availability filters leave out listings booked in the range.
+"""
+
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app import createJWT
+from models import Booking, BookingConflict, Listing, User, db
+
+START = date.today() + timedelta(days=30)
+
+
+def night(offset):
+    return START + timedelta(days=offset)
+
+
+@pytest.fixture
+def people(app):
+    users = [
+        User(
+            username=name, email=f'{name}@example.com', password='x', phone='555-0000',
+            first_name=name.title(), last_name='User',
+        )
+        for name in ('host', 'guest', 'other')
+    ]
+    db.session.add_all(users)
+    db.session.commit()
+    return {user.username: (user.id, {'Authorization': f'Bearer {createJWT(user)}'})
+            for user in users}
+
+
+@pytest.fixture
+def listings(people):
+    host_id = people['host'][0]
+    listings = [
+        Listing(title=f'Lawn {i}', price=10, details='Shady', address=f'{i} Elm St', host_id=host_id)
+        for i in range(2)
+    ]
+    db.session.add_all(listings)
+    db.session.commit()
+    return [listing.id for listing in listings]
+
+
+def book(client, headers, listing_id, start, end):
+    return client.post(
+        f'/listings/{listing_id}/bookings',
+        json={'start_date': start.isoformat(), 'end_date': end.isoformat()},
+        headers=headers,
+    )
+
+
+def test_reserve_locks_listing_then_checks_overlap(queries, people, listings):
+    del queries[:]
+
+    booking = Booking.reserve(listings[0], people['guest'][0], night(0), night(3))
+    db.session.commit()
+
+    # SQLite drops FOR UPDATE, so only the overlap check guards it here.
+    lock, check, insert = [statement.lstrip().split()[0] for statement in queries[:3]]
+    assert (lock, check, insert) == ('SELECT', 'SELECT', 'INSERT')
+    assert 'FROM listings' in queries[0] and 'FROM bookings' in queries[1]
+    assert (booking.status, booking.start_date, booking.end_date) == (
+        Booking.CONFIRMED, night(0), night(3))
+
+
+@pytest.mark.parametrize('start, end', [(0, 3), (2, 4), (-1, 1), (1, 2), (-2, 5)])
+def test_reserve_rejects_overlapping_nights(people, listings, start, end):
+    Booking.reserve(listings[0], people['guest'][0], night(0), night(3))
+    db.session.commit()
+
+    with pytest.raises(BookingConflict):
+        Booking.reserve(listings[0], people['other'][0], night(start), night(end))
+
+
+def test_reserve_allows_back_to_back_and_other_listings(people, listings):
+    guest_id = people['guest'][0]
+    Booking.reserve(listings[0], guest_id, night(0), night(3))
+    Booking.reserve(listings[0], guest_id, night(3), night(5))
+    Booking.reserve(listings[0], guest_id, night(-2), night(0))
+    Booking.reserve(listings[1], guest_id, night(0), night(3))
+    db.session.commit()
+
+    assert Booking.query.count() == 4
+
+
+@pytest.fixture
+def raising_trigger(app):
+    """Returns function making inserts into bookings fail with message, as
+    Postgres's bookings_no_overlap constraint does when a concurrent
+    reservation commits between reserve's check and its insert.
+    """
+
+    def install(message):
+        db.session.execute(
+            "CREATE TRIGGER fail_bookings BEFORE INSERT ON bookings "
+            f"BEGIN SELECT RAISE(ABORT, '{message}'); END")
+        db.session.commit()
+
+    yield install
+    db.session.rollback()
+    db.session.execute("DROP TRIGGER IF EXISTS fail_bookings")
+    db.session.commit()
+
+
+def test_exclusion_violation_is_a_conflict(people, listings, raising_trigger):
+    raising_trigger('conflicting key value violates exclusion constraint "bookings_no_overlap"')
+
+    with pytest.raises(BookingConflict):
+        Booking.reserve(listings[0], people['guest'][0], night(0), night(3))
+
+
+def test_other_integrity_errors_propagate(people, listings, raising_trigger):
+    raising_trigger('some other constraint')
+
+    with pytest.raises(IntegrityError):
+        Booking.reserve(listings[0], people['guest'][0], night(0), night(3))
+
+
+def test_booking_route_returns_conflict(client, people, listings):
+    guest = people['guest'][1]
+
+    assert book(client, guest, listings[0], night(0), night(3)).status_code == 201
+    response = book(client, people['other'][1], listings[0], night(2), night(4))
+
+    assert response.status_code == 409
+    assert client.get('/bookings', headers=guest).json['bookings'][0]['status'] == 'confirmed'
+
+
+def test_cancel_frees_nights(client, people, listings):
+    booking = book(client, people['guest'][1], listings[0], night(0), night(3)).json['booking']
+
+    assert client.post(
+        f"/bookings/{booking['id']}/cancel", headers=people['other'][1]).status_code == 401
+    response = client.post(f"/bookings/{booking['id']}/cancel", headers=people['host'][1])
+    assert response.json['booking']['status'] == Booking.CANCELLED
+
+    calendar = client.get(
+        f'/listings/{listings[0]}/calendar?start={night(0)}&end={night(10)}').json
+    assert calendar == {'booked': []}
+    assert book(client, people['other'][1], listings[0], night(1), night(2)).status_code == 201
+
+
+def test_availability_filter_excludes_booked_listings(client, people, listings):
+    booking = book(client, people['guest'][1], listings[0], night(0), night(3)).json['booking']
+
+    def available(start, end):
+        body = client.get(f'/listings?available_from={start}&available_to={end}').json
+        return [listing['id'] for listing in body['listings']]
+
+    assert available(night(1), night(2)) == [listings[1]]
+    assert available(night(3), night(5)) == listings
+    assert available(night(-3), night(0)) == listings
+
+    client.post(f"/bookings/{booking['id']}/cancel", headers=people['guest'][1])
+    assert available(night(1), night(2)) == listings
@@ -0,0 +1,129 @@
+"""importer.py loads CSVs, rejects rows with the wrong number of columns,
+and derives geohashes and listing cards for what it loads.
+
+The COPY path runs against Postgres only when TEST_POSTGRES_URL names a
+scratch database, whose tables it drops.
+"""
+
+import csv
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+
+import geo
+from importer import CSVImportError, import_csvs
+from models import Listing, ListingCard, User, db
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+USERS = [
+    ['username', 'email', 'password', 'phone', 'first_name', 'last_name'],
+    ['alice', 'alice@example.com', 'x', '0', 'Alice', 'Host'],
+    ['bob', 'bob@example.com', 'x', '0', 'Bob', 'Guest'],
+]
+LISTINGS = [
+    ['title', 'price', 'details', 'address', 'host_id', 'latitude', 'longitude'],
+    ['Pool', '10', 'Wet', '1 Elm St', '1', '37.7749', '-122.4194'],
+    ['Lawn', '20', 'Shady', '2 Elm St', '2', '', ''],
+]
+
+
+def write_csvs(directory, **tables):
+    for name, rows in tables.items():
+        with open(directory / f'{name}.csv', 'w', newline='') as file:
+            csv.writer(file).writerows(rows)
+    return str(directory)
+
+
+def test_replace_loads_tables_with_geohashes_and_cards(app, tmp_path):
+    directory = write_csvs(tmp_path, users=USERS, listings=LISTINGS)
+
+    loaded = import_csvs(directory, ('users', 'listings'))
+
+    assert loaded == {'users': 2, 'listings': 2}
+    hashes = dict(db.session.query(Listing.title, Listing.geohash))
+    assert hashes == {'Pool': geo.encode(37.7749, -122.4194), 'Lawn': None}
+    assert db.session.query(ListingCard.host_name).order_by(ListingCard.listing_id).all() == [
+        ('Alice Host',), ('Bob Guest',)]
+
+
+def test_upsert_rederives_moved_listing_geohash(app, tmp_path):
+    import_csvs(write_csvs(tmp_path, users=USERS, listings=LISTINGS), ('users', 'listings'))
+    moved = [['id'] + LISTINGS[0], ['1'] + LISTINGS[1][:-2] + ['40.7128', '-74.0060']]
+
+    import_csvs(write_csvs(tmp_path, listings=moved), ('listings',), mode='upsert')
+
+    assert db.session.get(Listing, 1).geohash == geo.encode(40.7128, -74.0060)
+
+
+@pytest.mark.parametrize('row', [
+    ['Pool', '10', 'Wet', '1 Elm St', '1'],
+    ['Pool', '10', 'Wet', '1 Elm St', '1', '37.7749', '-122.4194', 'extra'],
+])
+def test_rows_with_wrong_column_count_are_rejected(app, tmp_path, row):
+    import_csvs(write_csvs(tmp_path, users=USERS), ('users',))
+    directory = write_csvs(tmp_path, listings=[LISTINGS[0], LISTINGS[1], row])
+
+    with pytest.raises(CSVImportError, match=r'listings\.csv, line 3: expected 7 columns'):
+        import_csvs(directory, ('listings',), mode='append')
+
+    assert Listing.query.count() == 0
+
+
+def test_blank_lines_are_skipped(app, tmp_path):
+    directory = write_csvs(tmp_path, users=[USERS[0], USERS[1], [], USERS[2], []])
+
+    assert import_csvs(directory, ('users',)) == {'users': 2}
+    assert User.query.count() == 2
+
+
+@pytest.fixture
+def postgres_url():
+    url = os.environ.get('TEST_POSTGRES_URL')
+    if not url:
+        pytest.skip("set TEST_POSTGRES_URL to a scratch Postgres database to test COPY")
+    return url.replace('postgres://', 'postgresql://')
+
+
+def run_importer(url, directory, *args):
+    return subprocess.run(
+        [sys.executable, 'importer.py', '--dir', directory, *args],
+        cwd=REPO, env=dict(os.environ, DATABASE_URL=url),
+        capture_output=True, text=True,
+    )
+
+
+def test_postgres_copy(postgres_url, tmp_path):
+    directory = write_csvs(tmp_path, users=USERS, listings=LISTINGS)
+
+    result = run_importer(postgres_url, directory, 'users', 'listings')
+    assert result.returncode == 0, result.stderr
+
+    (tmp_path / 'upsert').mkdir()
+    upsert = write_csvs(tmp_path / 'upsert', listings=[
+        ['id'] + LISTINGS[0], ['2', 'Big lawn'] + LISTINGS[2][1:]])
+    result = run_importer(postgres_url, upsert, '--mode', 'upsert', 'listings')
+    assert result.returncode == 0, result.stderr
+
+    engine = create_engine(postgres_url)
+    with engine.connect() as connection:
+        rows = connection.execute(
+            Listing.__table__.select().order_by(Listing.__table__.c.id)).mappings().all()
+        cards = connection.execute(ListingCard.__table__.select()).all()
+    engine.dispose()
+
+    assert [(row['title'], row['geohash']) for row in rows] == [
+        ('Pool', geo.encode(37.7749, -122.4194)), ('Big lawn', None)]
+    assert len(cards) == 2
+
+
+def test_postgres_copy_rejects_short_rows(postgres_url, tmp_path):
+    directory = write_csvs(tmp_path, users=USERS + [['carol', 'carol@example.com']])
+
+    result = run_importer(postgres_url, directory, 'users')
+
+    assert result.returncode == 1
+    assert 'users.csv' in result.stderr
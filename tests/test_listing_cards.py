@@ -0,0 +1,142 @@
+"""Listing cards follow ORM writes to listings, photos and hosts, and
+cards.py check reports cards that don't.
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+
+from models import Listing, ListingCard, ListingPhoto, User, db
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_user(name):
+    return User(
+        username=name, email=f'{name}@example.com', password='x', phone='555-0000',
+        first_name=name.title(), last_name='Host',
+    )
+
+
+@pytest.fixture
+def hosts(app):
+    hosts = [make_user('alice'), make_user('bob')]
+    db.session.add_all(hosts)
+    db.session.commit()
+    return hosts
+
+
+@pytest.fixture
+def listing(hosts):
+    listing = Listing(title='Lawn', price=10, details='Shady', address='1 Elm St', host_id=hosts[0].id)
+    db.session.add(listing)
+    db.session.commit()
+    return listing
+
+
+def card(listing_id):
+    """Returns (cover_photo_url, photo_count, host_name) of listing's card,
+    or None, after checking no card is stale.
+    """
+
+    with db.engine.connect() as connection:
+        assert ListingCard.stale(connection) == []
+    row = db.session.query(
+        ListingCard.cover_photo_url, ListingCard.photo_count, ListingCard.host_name,
+    ).filter(ListingCard.listing_id == listing_id).one_or_none()
+    return None if row is None else tuple(row)
+
+
+def add_photo(listing_id, name):
+    photo = ListingPhoto(
+        listing_id=listing_id, small_photo_url=f'small-{name}.jpg', large_photo_url=f'large-{name}.jpg')
+    db.session.add(photo)
+    db.session.commit()
+    return photo
+
+
+def test_insert_listing_creates_card(listing):
+    assert card(listing.id) == (None, 0, 'Alice Host')
+
+
+def test_photos_update_count_and_cover(listing):
+    first = add_photo(listing.id, 'first')
+    add_photo(listing.id, 'second')
+    assert card(listing.id) == ('small-first.jpg', 2, 'Alice Host')
+
+    first.small_photo_url = 'small-edited.jpg'
+    db.session.commit()
+    assert card(listing.id) == ('small-edited.jpg', 2, 'Alice Host')
+
+    db.session.delete(first)
+    db.session.commit()
+    assert card(listing.id) == ('small-second.jpg', 1, 'Alice Host')
+
+
+def test_moving_photo_updates_both_cards(hosts, listing):
+    other = Listing(title='Pool', price=20, details='Wet', address='2 Elm St', host_id=hosts[1].id)
+    db.session.add(other)
+    db.session.commit()
+    photo = add_photo(listing.id, 'moved')
+
+    photo.listing_id = other.id
+    db.session.commit()
+
+    assert card(listing.id) == (None, 0, 'Alice Host')
+    assert card(other.id) == ('small-moved.jpg', 1, 'Bob Host')
+
+
+def test_host_changes_update_host_name(hosts, listing):
+    listing.host_id = hosts[1].id
+    db.session.commit()
+    assert card(listing.id) == (None, 0, 'Bob Host')
+
+    hosts[1].first_name = 'Robert'
+    db.session.commit()
+    assert card(listing.id) == (None, 0, 'Robert Host')
+
+
+def test_delete_listing_deletes_card(listing):
+    db.session.delete(listing)
+    db.session.commit()
+
+    assert card(listing.id) is None
+    assert db.session.query(ListingCard).count() == 0
+
+
+def run_cards(url, *args):
+    return subprocess.run(
+        [sys.executable, 'cards.py', *args],
+        cwd=REPO, env=dict(os.environ, DATABASE_URL=url),
+        capture_output=True, text=True,
+    )
+
+
+def test_check_reports_and_fixes_stale_card(tmp_path):
+    url = f"sqlite:///{tmp_path / 'cards.sqlite'}"
+    engine = create_engine(url)
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [
+            dict(username='alice', email='a@example.com', password='x', phone='0',
+                 first_name='Alice', last_name='Host', is_admin=False),
+        ])
+        connection.execute(Listing.__table__.insert(), [
+            dict(title=f'Lawn {i}', price=10, details='Shady', address=f'{i} Elm St', host_id=1)
+            for i in range(3)
+        ])
+        ListingCard.refresh(connection)
+        connection.execute(
+            ListingCard.__table__.update().where(ListingCard.listing_id == 2).values(photo_count=5))
+
+    check = run_cards(url, 'check')
+    assert check.returncode == 1, check.stderr
+    assert 'Stale listing ids: 2' in check.stderr
+
+    fixed = run_cards(url, 'check', '--fix')
+    assert fixed.returncode == 0, fixed.stderr
+    assert run_cards(url, 'check').returncode == 0
+    engine.dispose()
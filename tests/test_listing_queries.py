@@ -0,0 +1,72 @@
+"""GET /listings loads listings and their photos in a constant number of
+queries, however many listings there are.
+"""
+
+import pytest
+
+from models import Listing, User, db
+from response_cache import response_cache
+
+
+@pytest.fixture
+def host(app):
+    user = User(
+        username='host', email='host@example.com', password='x', phone='555-0000',
+        first_name='Host', last_name='User',
+    )
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def add_listings(host_id, count, photos_per_listing=3):
+    Listing.bulk_create(
+        dict(
+            title=f'Listing {i}', price=i, details='Shady lawn', address=f'{i} Elm St',
+            host_id=host_id,
+            photos=[
+                {'small_photo_url': f'small-{i}-{n}.jpg', 'large_photo_url': f'large-{i}-{n}.jpg'}
+                for n in range(photos_per_listing)
+            ],
+        )
+        for i in range(count)
+    )
+    db.session.commit()
+    response_cache.invalidate('listings')
+
+
+def selects(client, queries, path):
+    """Returns (response JSON, SELECT statements) of GET path."""
+
+    del queries[:]
+    response = client.get(path)
+    assert response.status_code == 200
+    return response.json, [
+        statement for statement in queries if statement.lstrip().upper().startswith('SELECT')]
+
+
+@pytest.mark.parametrize('path', ['/listings', '/listings?limit=500', '/listings?view=card'])
+def test_feed_query_count_does_not_grow(client, queries, host, path):
+    add_listings(host, 5)
+    body, few = selects(client, queries, path)
+    assert len(body['listings']) == 5
+
+    add_listings(host, 95)
+    body, many = selects(client, queries, path)
+    assert len(body['listings']) == 100
+    assert len(many) == len(few), many
+
+
+def test_feed_includes_every_photo(client, host):
+    add_listings(host, 2, photos_per_listing=2)
+
+    listings = client.get('/listings').json['listings']
+
+    assert [len(listing['photos']) for listing in listings] == [2, 2]
+
+
+def test_photo_lookup_uses_listing_index(app):
+    plan = db.session.execute(
+        'EXPLAIN QUERY PLAN SELECT id FROM listing_photos WHERE listing_id IN (1, 2, 3)').all()
+
+    assert any('ix_listing_photos_listing_id' in row[-1] for row in plan), plan
@@ -0,0 +1,140 @@
+"""Message timelines page by seeking an index in (timestamp, id) order, so a
+page reads limit rows however long the thread or inbox is.
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import tuple_
+
+from app import createJWT
+from models import Message, User, db
+from pagination import merge_ordered
+
+START = datetime(2021, 1, 1)
+
+
+@pytest.fixture
+def users(app):
+    users = [
+        User(
+            username=f'user{i}', email=f'user{i}@example.com', password='x',
+            phone='555-0000', first_name='User', last_name=str(i),
+        )
+        for i in range(3)
+    ]
+    db.session.add_all(users)
+    db.session.flush()
+
+    # Pairs repeat timestamps, so pages must break ties on id.
+    pairs = [(0, 1), (1, 0), (0, 2), (2, 0), (1, 2), (0, 0)]
+    db.session.execute(Message.__table__.insert(), [
+        {
+            'text': f'message {n}',
+            'from_user_id': users[sender].id,
+            'to_user_id': users[recipient].id,
+            'timestamp': START + timedelta(minutes=n // 2),
+        }
+        for n in range(120)
+        for sender, recipient in [pairs[n % len(pairs)]]
+    ])
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def query_plan(query):
+    sql = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    return [row[-1] for row in db.session.execute(f'EXPLAIN QUERY PLAN {sql}')]
+
+
+def branch_pages(branches):
+    """Yields one seeking page query per branch, as timeline_page builds them."""
+
+    position = tuple_(Message.timestamp, Message.id)
+    for branch in branches:
+        branch = branch.filter(position < tuple_(START + timedelta(minutes=30), 10 ** 6))
+        yield merge_ordered([branch], (Message.timestamp, Message.id), 20, descending=True)
+
+
+@pytest.mark.parametrize('timeline', ['involving', 'between'])
+def test_timeline_branches_seek_an_index_in_order(users, timeline):
+    if timeline == 'involving':
+        branches = Message.involving(users[0])
+    else:
+        branches = Message.between(users[0], users[1])
+
+    for page in branch_pages(branches):
+        plan = query_plan(page)
+        assert any(
+            step.startswith('SEARCH messages USING') and 'INDEX ix_messages_' in step
+            for step in plan
+        ), plan
+        assert not any('TEMP B-TREE' in step for step in plan), plan
+
+
+def test_merged_page_does_not_scan_messages(users):
+    page = merge_ordered(
+        Message.involving(users[0]), (Message.timestamp, Message.id), 20, descending=True)
+
+    plan = query_plan(page)
+
+    assert not any(step.startswith('SCAN messages') for step in plan), plan
+
+
+@pytest.mark.parametrize('path, other', [('/messages', None), ('/messages/{other}', 1)])
+def test_pages_cover_timeline_in_order(client, users, path, other):
+    me = users[0]
+    with client.application.app_context():
+        token = createJWT(db.session.get(User, me))
+    headers = {'Authorization': f'Bearer {token}'}
+
+    if other is None:
+        criteria = (Message.from_user_id == me) | (Message.to_user_id == me)
+    else:
+        other = users[other]
+        criteria = (
+            ((Message.from_user_id == me) & (Message.to_user_id == other))
+            | ((Message.from_user_id == other) & (Message.to_user_id == me))
+        )
+    expected = [
+        id for (id,) in
+        db.session.query(Message.id).filter(criteria).order_by(Message.timestamp, Message.id)
+    ]
+
+    path = path.format(other=other)
+    seen = []
+    body = client.get(f'{path}?limit=7', headers=headers).json
+    while True:
+        seen = [msg['id'] for msg in body['msgs']] + seen
+        if body['before_cursor'] is None:
+            break
+        body = client.get(f"{path}?limit=7&before={body['before_cursor']}", headers=headers).json
+
+    assert seen == expected
+
+
+def test_polling_after_cursor_includes_late_timestamps(client, users):
+    me, other = users[0], users[1]
+    with client.application.app_context():
+        token = createJWT(db.session.get(User, me))
+    headers = {'Authorization': f'Bearer {token}'}
+
+    body = client.get('/messages?limit=5', headers=headers).json
+    after = body['after_cursor']
+
+    # Saved after the poll, but stamped before the newest message seen, as
+    # by an app server whose clock is behind.
+    db.session.execute(Message.__table__.insert(), [
+        {'text': 'late', 'from_user_id': other, 'to_user_id': me, 'timestamp': START},
+        {'text': 'later', 'from_user_id': me, 'to_user_id': other, 'timestamp': START},
+    ])
+    db.session.commit()
+
+    body = client.get(f'/messages?after={after}', headers=headers).json
+    assert [msg['text'] for msg in body['msgs']] == ['late', 'later']
+
+    body = client.get(f"/messages?after={body['after_cursor']}", headers=headers).json
+    assert body['msgs'] == []
+
+    streamed = client.get(f'/messages?after={after}&stream=true', headers=headers).json
+    assert [msg['text'] for msg in streamed['msgs']] == ['late', 'later']
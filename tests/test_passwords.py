@@ -0,0 +1,64 @@
+"""Logins are shed with 503 and Retry-After when the password pool is full
+or a hash takes longer than PASSWORD_TIMEOUT.
+"""
+
+import threading
+
+import pytest
+
+import passwords
+from models import User, hasher
+
+
+@pytest.fixture
+def user(app):
+    return User.signup(
+        username='guest', email='guest@example.com', password='secret', phone='555-0000',
+        first_name='Guest', last_name='User',
+    )
+
+
+@pytest.fixture
+def stalled(monkeypatch):
+    """Makes password checks block until the returned event is set."""
+
+    release = threading.Event()
+    check = passwords._check
+
+    def slow_check(hashed, password):
+        release.wait(5)
+        return check(hashed, password)
+
+    monkeypatch.setattr(passwords, '_check', slow_check)
+    yield release
+    release.set()
+
+
+def login(client):
+    return client.post('/login', json={'username': 'guest', 'password': 'secret'})
+
+
+def test_login_succeeds(client, user):
+    assert login(client).status_code == 200
+
+
+def test_hash_timeout_is_busy(client, monkeypatch, user, stalled):
+    monkeypatch.setattr(hasher, 'timeout', 0.05)
+
+    response = login(client)
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_full_queue_is_busy(client, monkeypatch, user, stalled):
+    monkeypatch.setattr(hasher, 'slots', threading.BoundedSemaphore(1))
+    monkeypatch.setattr(hasher, 'timeout', 0.05)
+    assert login(client).status_code == 503
+
+    # The timed out check still holds the only slot.
+    response = login(client)
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    stalled.set()
@@ -0,0 +1,68 @@
+"""Photo jobs fail at once on undecodable images and retry on anything else."""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import photos
+from images import UndecodableImage
+from models import Listing, PhotoJob, User, db
+
+
+@pytest.fixture
+def job(app):
+    host = User(
+        username='host', email='host@example.com', password='x', phone='555-0000',
+        first_name='Host', last_name='User',
+    )
+    db.session.add(host)
+    db.session.flush()
+    listing = Listing(title='Lawn', price=10, details='Shady', address='1 Elm St', host_id=host.id)
+    db.session.add(listing)
+    db.session.flush()
+    db.session.add(PhotoJob(
+        listing_id=listing.id, idempotency_key=f'{listing.id}:photo', filename='photo.jpg',
+        content_type='image/jpeg', data=b'photo bytes',
+    ))
+    db.session.commit()
+    return photos.claim_job()
+
+
+def fail_derivatives(monkeypatch, error):
+    def make_derivatives(data, specs):
+        raise error
+    monkeypatch.setattr(photos, 'make_derivatives', make_derivatives)
+
+
+def test_undecodable_image_fails_on_first_attempt(monkeypatch, job):
+    fail_derivatives(monkeypatch, UndecodableImage('improper image header'))
+
+    photos.run_job(job)
+
+    job = db.session.get(PhotoJob, job.id)
+    assert (job.status, job.attempts) == (PhotoJob.FAILED, 1)
+    assert 'improper image header' in job.last_error
+
+
+@pytest.mark.parametrize('error', [
+    ImportError('MagickWand shared library not found'),
+    MemoryError(),
+])
+def test_environment_errors_are_retried(monkeypatch, app, job, error):
+    fail_derivatives(monkeypatch, error)
+
+    photos.run_job(job)
+
+    job = db.session.get(PhotoJob, job.id)
+    assert (job.status, job.attempts) == (PhotoJob.PENDING, 1)
+    assert job.run_after > datetime.utcnow()
+    assert PhotoJob.summarize(job.listing_id)['status'] == 'pending'
+
+
+def test_expired_lease_on_last_attempt_fails(app, job):
+    job.attempts = app.config['PHOTO_JOB_MAX_ATTEMPTS']
+    job.locked_at = datetime.utcnow() - timedelta(seconds=app.config['PHOTO_JOB_LEASE'] + 1)
+    db.session.commit()
+
+    assert photos.claim_job() is None
+    assert db.session.get(PhotoJob, job.id).status == PhotoJob.FAILED
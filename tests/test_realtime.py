@@ -0,0 +1,130 @@
+"""Messages reach long-polls and event streams as they are sent, and clients
+resume from the last event id they saw.
+"""
+
+import json
+import threading
+import time
+
+import pytest
+
+import app as app_module
+from app import createJWT
+from models import User, db
+from realtime import LocalBroker
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = LocalBroker()
+    monkeypatch.setattr(app_module, 'broker', broker)
+    return broker
+
+
+@pytest.fixture
+def tokens(app):
+    users = [
+        User(
+            username=f'user{i}', email=f'user{i}@example.com', password='x',
+            phone='555-0000', first_name='User', last_name=str(i),
+        )
+        for i in range(2)
+    ]
+    db.session.add_all(users)
+    db.session.commit()
+    return [(user.id, {'Authorization': f'Bearer {createJWT(user)}'}) for user in users]
+
+
+def send(client, sender, recipient_id, text):
+    response = client.post(f'/messages/{recipient_id}', json={'message': text}, headers=sender)
+    assert response.status_code == 200
+    return response.json['msg']
+
+
+def test_wait_returns_event_published_while_waiting():
+    broker = LocalBroker()
+    timer = threading.Timer(0.05, broker.publish, (1, 10, '"hello"'))
+    timer.start()
+
+    start = time.monotonic()
+    events = broker.wait(1, 0, timeout=5)
+
+    assert events == [(1, '"hello"')]
+    assert time.monotonic() - start < 5
+    timer.join()
+
+
+def test_wait_times_out_without_events():
+    broker = LocalBroker()
+    broker.publish(2, 10, '"for someone else"')
+
+    assert broker.wait(1, 0, timeout=0.05) == []
+
+
+def test_poll_delivers_sent_messages_to_both_users(client, broker, tokens):
+    (sender_id, sender), (recipient_id, recipient) = tokens
+
+    msg = send(client, sender, recipient_id, 'hi')
+
+    for headers in (sender, recipient):
+        body = client.get('/messages/poll?last_id=0&timeout=1', headers=headers).json
+        assert [m['id'] for m in body['msgs']] == [msg['id']]
+
+
+def test_poll_times_out_and_resumes_from_last_id(client, broker, tokens):
+    (sender_id, sender), (recipient_id, recipient) = tokens
+    first = send(client, sender, recipient_id, 'first')
+    body = client.get('/messages/poll?last_id=0&timeout=1', headers=recipient).json
+    last_id = body['last_id']
+
+    body = client.get(f'/messages/poll?last_id={last_id}&timeout=0.05', headers=recipient).json
+    assert body == {'msgs': [], 'last_id': last_id}
+
+    second = send(client, sender, recipient_id, 'second')
+    body = client.get(f'/messages/poll?last_id={last_id}&timeout=1', headers=recipient).json
+    assert [m['id'] for m in body['msgs']] == [second['id']]
+    assert first['id'] != second['id']
+
+
+def test_stream_resumes_after_last_event_id(client, broker, tokens):
+    (sender_id, sender), (recipient_id, recipient) = tokens
+    sent = [send(client, sender, recipient_id, f'message {n}') for n in range(3)]
+    first_event_id = broker.wait(recipient_id, 0, timeout=0)[0][0]
+
+    response = client.get(
+        '/messages/stream',
+        headers={**recipient, 'Last-Event-ID': str(first_event_id)},
+        buffered=False,
+    )
+    chunks = (chunk.decode() for chunk in response.response)
+    assert next(chunks) == 'retry: 3000\n\n'
+    events = [next(chunks), next(chunks)]
+    response.close()
+
+    event_ids = [int(event.split('\n')[0].removeprefix('id: ')) for event in events]
+    assert first_event_id < event_ids[0] < event_ids[1]
+    for event, msg in zip(events, sent[1:]):
+        assert f'"id": {msg["id"]}' in event
+
+
+def test_publish_failure_does_not_fail_send(client, broker, monkeypatch, tokens):
+    (sender_id, sender), (recipient_id, recipient) = tokens
+
+    def publish(user_id, message_id, data):
+        raise ConnectionError('broker unavailable')
+    monkeypatch.setattr(broker, 'publish', publish)
+
+    msg = send(client, sender, recipient_id, 'still saved')
+
+    body = client.get('/messages', headers=recipient).json
+    assert [m['id'] for m in body['msgs']] == [msg['id']]
+
+
+def test_load_message_events_reloads_notified_messages(client, broker, tokens):
+    (sender_id, sender), (recipient_id, recipient) = tokens
+    msg = send(client, sender, recipient_id, 'relayed')
+
+    events = app_module.load_message_events({msg['id'], msg['id'] + 100})
+
+    assert list(events) == [msg['id']]
+    assert json.loads(events[msg['id']]) == msg
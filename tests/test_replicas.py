@@ -0,0 +1,80 @@
+"""Reads of read_replica views go to the replica, except for a user who
+wrote within REPLICA_LAG_WINDOW, whose reads stay on the primary.
+
+The app binds its databases on import, so this runs it in a subprocess
+against two SQLite files, "replicating" by copying the primary's file over
+the replica's.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIO = """
+import json, shutil, sys, time
+
+from app import app, createJWT
+from models import User, db
+
+primary, replica = sys.argv[1:]
+
+with app.app_context():
+    db.create_all()
+    users = [
+        User(username=f'user{i}', email=f'user{i}@example.com', password='x',
+             phone='0', first_name='User', last_name=str(i))
+        for i in range(2)
+    ]
+    db.session.add_all(users)
+    db.session.commit()
+    sender, recipient = [{'Authorization': f'Bearer {createJWT(user)}'} for user in users]
+    recipient_id = users[1].id
+    db.session.remove()
+    db.engine.dispose()
+shutil.copyfile(primary, replica)
+
+client = app.test_client()
+
+def inbox(headers):
+    return [msg['text'] for msg in client.get('/messages', headers=headers).json['msgs']]
+
+client.post(f'/messages/{recipient_id}', json={'message': 'hello'}, headers=sender)
+results = {'sender_in_window': inbox(sender), 'recipient_in_window': inbox(recipient)}
+
+time.sleep(app.config['REPLICA_LAG_WINDOW'] + 0.2)
+results['sender_after_window'] = inbox(sender)
+
+with app.app_context():
+    db.get_engine(app, bind='replica0').dispose()
+shutil.copyfile(primary, replica)
+results['sender_after_replication'] = inbox(sender)
+
+print(json.dumps(results))
+"""
+
+
+def test_writes_pin_reads_to_primary_for_lag_window(tmp_path):
+    primary, replica = tmp_path / 'primary.sqlite', tmp_path / 'replica.sqlite'
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{primary}',
+        REPLICA_DATABASE_URLS=f'sqlite:///{replica}',
+        REPLICA_LAG_WINDOW='1',
+        RESPONSE_CACHE_TTL='0',
+    )
+
+    result = subprocess.run(
+        [sys.executable, '-c', SCENARIO, str(primary), str(replica)],
+        cwd=REPO, env=env, capture_output=True, text=True,
+    )
+    assert result.returncode == 0, result.stderr
+
+    assert json.loads(result.stdout.splitlines()[-1]) == {
+        'sender_in_window': ['hello'],
+        'recipient_in_window': ['hello'],
+        'sender_after_window': [],
+        'sender_after_replication': ['hello'],
+    }
@@ -0,0 +1,88 @@
+"""upload_files_to_s3 sends every file to every bucket under generated keys,
+against a moto S3 stand-in.
+"""
+
+from io import BytesIO
+
+import boto3
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from helpers import upload_files_to_s3
+
+moto = pytest.importorskip('moto')
+
+BUCKETS = ['small-bucket', 'large-bucket']
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        for bucket in BUCKETS:
+            client.create_bucket(Bucket=bucket)
+        yield client
+
+
+def upload(name, data, content_type='image/jpeg'):
+    return FileStorage(BytesIO(data), filename=name, content_type=content_type)
+
+
+def stored(client, bucket, url):
+    key = url.rsplit('/', 1)[1]
+    obj = client.get_object(Bucket=bucket, Key=key)
+    return key, obj['ContentType'], obj['Body'].read()
+
+
+def test_uploads_every_file_to_every_bucket(s3):
+    files = [upload('cat.JPG', b'cat'), upload('../../index.html', b'dog', 'text/html')]
+
+    results = upload_files_to_s3(files, BUCKETS, client=s3)
+
+    assert [(result.filename, result.error) for result in results] == [
+        ('cat.JPG', None), ('../../index.html', None)]
+    for result, data in zip(results, [b'cat', b'dog']):
+        assert set(result.urls) == set(BUCKETS)
+        keys = set()
+        for bucket in BUCKETS:
+            key, content_type, body = stored(s3, bucket, result.urls[bucket])
+            assert body == data
+            keys.add(key)
+        # One generated key per file, shared by its buckets.
+        [key] = keys
+        assert 'cat' not in key and 'index' not in key and '/' not in key
+
+    assert results[0].urls['small-bucket'].endswith('.jpg')
+    assert results[0].urls['small-bucket'] != results[1].urls['small-bucket']
+
+
+def test_same_filename_does_not_overwrite(s3):
+    first, second = upload_files_to_s3(
+        [upload('photo.jpg', b'first'), upload('photo.jpg', b'second')], BUCKETS, client=s3)
+
+    assert stored(s3, 'large-bucket', first.urls['large-bucket'])[2] == b'first'
+    assert stored(s3, 'large-bucket', second.urls['large-bucket'])[2] == b'second'
+
+
+def test_derived_variants_go_to_their_buckets(s3):
+    def derive(data):
+        return {
+            'small-bucket': (data[:2], 'image/webp', '.webp'),
+            'large-bucket': (data, 'image/jpeg', '.jpg'),
+        }
+
+    [result] = upload_files_to_s3([upload('big.png', b'pixels')], BUCKETS, client=s3, derive=derive)
+
+    assert result.error is None
+    assert stored(s3, 'small-bucket', result.urls['small-bucket'])[1:] == ('image/webp', b'pi')
+    assert stored(s3, 'large-bucket', result.urls['large-bucket'])[1:] == ('image/jpeg', b'pixels')
+
+
+def test_failed_bucket_is_reported_as_retryable(s3):
+    [result] = upload_files_to_s3([upload('cat.jpg', b'cat')], BUCKETS + ['missing'], client=s3)
+
+    assert set(result.urls) == set(BUCKETS)
+    assert result.error.startswith('missing: ')
+    assert result.retryable
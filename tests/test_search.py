@@ -0,0 +1,81 @@
+"""The in-process search index drops deleted listings and picks up listings
+written outside this process's ORM; ILIKE patterns match wildcards literally.
+"""
+
+import pytest
+
+from app import listing_search
+from models import Listing, User, db
+from search import escape_like
+
+
+@pytest.fixture
+def host(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'SEARCH_BACKEND', 'memory')
+    monkeypatch.setitem(app.config, 'SEARCH_INDEX_CHECK_INTERVAL', 0)
+    listing_search.invalidate()
+    user = User(
+        username='host', email='host@example.com', password='x', phone='555-0000',
+        first_name='Host', last_name='User',
+    )
+    db.session.add(user)
+    db.session.commit()
+    yield user.id
+    listing_search.invalidate()
+
+
+def add_listing(host_id, title):
+    listing = Listing(title=title, price=10, details='Shady', address='1 Elm St', host_id=host_id)
+    db.session.add(listing)
+    db.session.commit()
+    return listing.id
+
+
+def test_orm_writes_update_index(host):
+    pool = add_listing(host, 'Sunny pool')
+    assert listing_search.search('pool', 10) == [pool]
+
+    hammock = add_listing(host, 'Hammock pool')
+    db.session.get(Listing, pool).title = 'Sunny lawn'
+    db.session.commit()
+
+    assert listing_search.search('pool', 10) == [hammock]
+
+
+def test_deleted_outside_orm_are_not_returned(app, host):
+    pool = add_listing(host, 'Sunny pool')
+    assert listing_search.search('pool', 10) == [pool]
+    app.config['SEARCH_INDEX_CHECK_INTERVAL'] = 3600
+
+    db.session.execute(Listing.__table__.delete())
+    db.session.commit()
+
+    assert listing_search.search('pool', 10) == []
+
+
+def test_rows_loaded_outside_orm_are_indexed(host):
+    add_listing(host, 'Sunny pool')
+    assert len(listing_search.search('pool', 10)) == 1
+
+    db.session.execute(Listing.__table__.insert(), [
+        dict(title=f'Imported pool {i}', price=10, details='Wet', address='2 Elm St', host_id=host)
+        for i in range(3)
+    ])
+    db.session.commit()
+
+    assert len(listing_search.search('pool', 10)) == 4
+
+
+@pytest.mark.parametrize('term, expected', [
+    ('50%', ['50% off pool']),
+    ('a_b', ['a_b lawn']),
+    ('c\\d', ['c\\d deck']),
+])
+def test_escaped_patterns_match_literally(host, term, expected):
+    for title in ('50% off pool', '500 off pool', 'a_b lawn', 'axb lawn', 'c\\d deck', 'cd deck'):
+        add_listing(host, title)
+
+    pattern = f'%{escape_like(term)}%'
+    titles = db.session.query(Listing.title).filter(Listing.title.ilike(pattern, escape='\\'))
+
+    assert [title for (title,) in titles] == expected
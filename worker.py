@@ -0,0 +1,23 @@
+"""Background worker for queued listing photo uploads.
+
+Run alongside the web app:
+
+    python worker.py          # poll forever
+    python worker.py --once   # drain the queue and exit
+"""
+
+import argparse
+import logging
+
+from app import app
+from photos import run_worker
+
+parser = argparse.ArgumentParser(description="Process queued listing photos.")
+parser.add_argument('--once', action='store_true', help="exit when the queue is empty")
+parser.add_argument('--poll-interval', type=float, default=1.0, help="seconds between polls when idle")
+args = parser.parse_args()
+
+logging.basicConfig(level=logging.INFO)
+
+with app.app_context():
+    run_worker(poll_interval=args.poll_interval, once=args.once)